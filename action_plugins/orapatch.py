@@ -34,6 +34,46 @@ from ansible.plugins.action import ActionBase
 
 class ActionModule(ActionBase):
 
+    # Build rolling waves from the cluster membership of each host (CLUSTER_INFO).
+    # Nodes of one cluster are patched at most "cluster_batch" at a time, each
+    # batch in a later wave than the previous one. Standalone hosts and different
+    # clusters are patched in parallel. A wave holds at most "max_hosts" hosts
+    # (0 = unlimited).
+    def rolling_schedule(self, hosts, cluster_names, cluster_batch, max_hosts):
+
+        waves = []
+
+        def place(batch, first_wave):
+            wave = first_wave
+            while True:
+                if wave == len(waves):
+                    waves.append([])
+                if not max_hosts or len(waves[wave]) + len(batch) <= max(max_hosts, len(batch)):
+                    waves[wave].extend(batch)
+                    return wave
+                wave += 1
+
+        clusters = {}
+        standalone = []
+
+        for host in hosts:
+            if cluster_names.get(host):
+                clusters.setdefault(cluster_names[host], []).append(host)
+            else:
+                standalone.append(host)
+
+        # Clusters first, they need the most waves
+        for cluster in sorted(clusters, key=lambda name: -len(clusters[name])):
+            nodes = clusters[cluster]
+            wave = 0
+            for i in range(0, len(nodes), cluster_batch):
+                wave = place(nodes[i:i + cluster_batch], wave) + 1
+
+        for host in standalone:
+            place([host], 0)
+
+        return waves
+
     def run(self, tmp=None, task_vars=None):
 
         # define empty dict if task_vars is not defined
@@ -45,9 +85,36 @@ class ActionModule(ActionBase):
         # get module arguments
         args = self._task.args.copy()
 
+        if args["function"] == "ROLLING_SCHEDULE":
+
+            # Computed on the controller, the module is not executed
+            hostvars = task_vars["hostvars"]
+            hosts = args["hosts"]
+            cluster_names = {}
+
+            for host in hosts:
+                cluster_info = hostvars[host].get(args.get("cluster_info_var", "reg_cluster_info")) or {}
+                cluster_names[host] = hostvars[host].get("orapatch_cluster_name") or cluster_info.get("cluster_name")
+
+            waves = self.rolling_schedule(hosts, cluster_names,
+                                          max(1, int(args.get("cluster_batch") or 1)),
+                                          int(args.get("max_hosts") or 0))
+
+            result["changed"] = False
+            result["waves"] = waves
+            result["hosts"] = [host for wave in waves for host in wave]
+            result["serial"] = [len(wave) for wave in waves] or [1]
+            result["clusters"] = dict((host, cluster_names[host]) for host in hosts if cluster_names[host])
+            result["msg"] = str (len(hosts)) + " host(s) in " + str (len(waves)) + " wave(s)."
+
+            return result
+
         args["ansible_hostname"] = task_vars["ansible_hostname"]
 
-        if args["function"] == "START_LOGGER_SESSION" or args["function"] == "END_LOGGER_SESSION":
+        if "orapatch_json_logfile" in task_vars and task_vars["orapatch_json_logfile"]:
+            args["orapatch_json_logfile"] = task_vars["orapatch_json_logfile"]
+
+        if args["function"] == "START_LOGGER_SESSION" or args["function"] == "END_LOGGER_SESSION" or args["function"] == "CLUSTER_INFO":
 
             # set dummy values
             args["oracle_home"] = None
@@ -62,6 +129,9 @@ class ActionModule(ActionBase):
             args["patch_item"] = None
             args["root_password"] = None
             args["oratab_file"] = None
+            args["prereq_batch"] = None
+            args["parallel_degree"] = None
+            args["service_parallel_degree"] = None
 
             if "debug" not in task_vars:
                 args["debug"] = False
@@ -94,16 +164,47 @@ class ActionModule(ActionBase):
                 args["oratab_file"] = db_item["oratab_file"]
             else:
                 args["oratab_file"] = task_vars["oratab_file"]
+
+            if "prereq_batch" in db_item and db_item["prereq_batch"] is not None:
+                args["prereq_batch"] = db_item["prereq_batch"]
+            elif "prereq_batch" in task_vars:
+                args["prereq_batch"] = task_vars["prereq_batch"]
+
+            if "oop_home_path" in db_item and db_item["oop_home_path"]:
+                args["oop_home_path"] = db_item["oop_home_path"]
+
+            if "parallel_degree" in db_item and db_item["parallel_degree"] is not None:
+                args["parallel_degree"] = db_item["parallel_degree"]
+            elif "parallel_degree" in task_vars:
+                args["parallel_degree"] = task_vars["parallel_degree"]
+
+            if "service_parallel_degree" in db_item and db_item["service_parallel_degree"] is not None:
+                args["service_parallel_degree"] = db_item["service_parallel_degree"]
+            elif "service_parallel_degree" in task_vars:
+                args["service_parallel_degree"] = task_vars["service_parallel_degree"]
                 
                 
             try:
-                
-                patch_id = int(db_item["patch_id"])
+
+                # "patch_id" is a patch ID or an ordered list of patch IDs (patch stack)
+                patch_ids = db_item["patch_id"]
+                if not isinstance(patch_ids, list):
+                    patch_ids = [patch_ids]
+
                 patch_dict = task_vars["patch_dict"]
+                patch_items = []
+
+                for patch_id in patch_ids:
+                    patch_id = int(patch_id)
+                    patch_item = dict(patch_dict[patch_id])
+                    patch_item["patch_id"] = patch_id
+                    patch_items.append(patch_item)
 
-                patch_item = patch_dict[patch_id]
-                patch_item["patch_id"] = patch_id
-                args["patch_item"] = patch_item
+                args["patch_id"] = patch_items[0]["patch_id"]
+                args["patch_item"] = patch_items[0]
+
+                if len(patch_items) > 1:
+                    args["patch_items"] = patch_items
 
             except Exception as e:
 
@@ -122,6 +223,33 @@ class ActionModule(ActionBase):
             #    result['msg'] = "Root password missmatch."
             #    return result
 
+            # CRS/HAS readiness wait settings, the item overrides the global value
+            for crs_wait_arg in ("crs_wait_timeout", "crs_wait_initial_interval", "crs_wait_max_interval"):
+                if crs_wait_arg in db_item and db_item[crs_wait_arg] is not None:
+                    args[crs_wait_arg] = db_item[crs_wait_arg]
+                elif crs_wait_arg in task_vars:
+                    args[crs_wait_arg] = task_vars[crs_wait_arg]
+
+            # Cross-check of CRS databases with ASM clients on GI homes (logged only)
+            if "asm_client_crosscheck" in task_vars:
+                args["asm_client_crosscheck"] = task_vars["asm_client_crosscheck"]
+
+            # Host local stage cache settings
+            for stage_cache_arg in ("stage_cache_dir", "stage_cache_max_size_gb"):
+                if stage_cache_arg in task_vars and task_vars[stage_cache_arg]:
+                    args[stage_cache_arg] = task_vars[stage_cache_arg]
+
+            for backup_arg in ("backup_loc", "backup_mode", "backup_parallel_degree", "restore_files"):
+                if backup_arg in task_vars and task_vars[backup_arg]:
+                    args[backup_arg] = task_vars[backup_arg]
+
+            if "history_file" in task_vars and task_vars["history_file"]:
+                args["history_file"] = task_vars["history_file"]
+
+            # PLAN follows the role flow (PATCH_ALL or separate functions)
+            if "patch_single_downtime" in task_vars:
+                args["patch_single_downtime"] = task_vars["patch_single_downtime"]
+
             # Clear item argument
             del args["item"]
 
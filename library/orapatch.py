@@ -29,11 +29,15 @@
 """
 
 # Import libraries
+import collections
 import datetime
+import functools
 import subprocess
+import tempfile
 import re
 import time
 import json
+import atexit
 from distutils.util import strtobool
 try:
     import pexpect
@@ -41,8 +45,19 @@ try:
 except ImportError:
     pexpect_found = False
 import os
+import threading
+import shutil
+import stat
+import zipfile
+import tarfile
+import hashlib
+import mmap
+import fcntl
+import pwd
+import sqlite3
 import xml.etree.ElementTree as ET
 import traceback
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from ansible.module_utils.basic import AnsibleModule
 
 # Define global variables
@@ -51,6 +66,7 @@ g_supported_version_new = [12,18,19]
 g_function = "CHECK_OPATCH_MIN_VERSION"
 g_file_oratab = "/etc/oratab"
 g_sw_opatch_check_conflict_pattern = "Prereq \"checkConflictAgainstOHWithDetail\" passed"
+g_sw_opatch_check_conflict_among_pattern = "Prereq \"checkConflictAmongPatchesWithDetail\" passed"
 g_sw_opatch_spacecheck_pattern = "Prereq \"checkSystemSpace\" passed"
 g_sw_opatch_min_version = "Prereq \"checkMinimumOPatchVersion\" passed"
 g_sw_opatch_check_pattern1 = "OPatch succeeded"
@@ -67,6 +83,9 @@ g_changed = False
 g_output = {}
 g_instance_list = {}
 g_listener_list = {}
+g_process_snapshot = None
+g_sqlplus_pool = None
+g_sqlplus_timeout = 3600 # 60 minutes
 g_patch_applied = False
 g_debug = False
 g_hostname = None
@@ -75,8 +94,53 @@ g_expected_list = { 'Do you want to proceed\? \[y\|n\]': 'y\r',
                 'Do you wish to remain uninformed of security issues \(\[Y\]es, \[N\]o\) \[N\]': 'y\r',
                 'Is the local system ready for patching\? \[y\|n\]': 'y\r' }
 g_logger_file = ""
+g_json_logger_file = None
+g_session_logger = None
+g_log_phase = None
+g_log_home = None
+g_start_time = time.time()
+g_start_monotonic = time.monotonic()
 g_ocmrf_file = "/tmp/orapatch_ocm_" + time.strftime("%Y-%m-%d_%I-%M-%S%p")+".rsp"
 g_inventory_file = ""
+g_logger_lock = threading.Lock()
+g_logger_local = threading.local()
+g_timings_lock = threading.Lock()
+g_running_phases = []
+g_command_categories = [ "opatchauto", "opatch", "datapatch", "srvctl", "crsctl", "lsnrctl", "sqlplus" ]
+g_prereq_parallel_degree = 4
+g_output_tail_lines = 2000
+g_output_keep_patterns = [ g_sw_opatch_check_conflict_pattern, g_sw_opatch_check_conflict_among_pattern, g_sw_opatch_spacecheck_pattern,
+                           g_sw_opatch_min_version, g_sw_opatch_check_pattern1, g_sw_opatch_check_pattern2,
+                           g_sw_opatch_no_need, g_sw_opatchauto_check_pattern12, g_sw_opatchauto_check_pattern11,
+                           g_sw_opatch_check_patch_nonexist, g_sw_opatch_check_patch_exist, g_check_cluster_state ]
+g_inventory = None
+# Private (0700) discovery cache directory per oracle home owner
+g_cache_dir = "/tmp/orapatch_cache_" + str (os.getuid())
+# Default durations (seconds) used by PLAN to predict downtime
+g_plan_default_durations = { "listener_stop": 5, "listener_start": 5,
+                             "instance_stop": 60, "instance_start": 90,
+                             "opatch_apply": 600, "opatch_apply_ojvm": 300, "opatchauto": 2400,
+                             "datapatch": 900, "sqlplus_script": 600,
+                             "clone_oh": 900, "switch_oh": 30 }
+# Timing history (SQLite), see TimingHistory
+g_history = None
+g_history_context = {}
+g_history_min_samples = 5
+g_history_plan_percentile = 90
+g_history_timeout_factor = 3
+# PLAN duration -> history categories (first category with enough samples is used)
+g_plan_history_categories = { "listener_stop": ["lsnrctl_stop"], "listener_start": ["lsnrctl_start"],
+                              "instance_stop": ["srvctl_stop", "sqlplus_shutdown"],
+                              "instance_start": ["srvctl_start", "sqlplus_startup"],
+                              "opatch_apply": ["opatch_apply"], "opatch_apply_ojvm": ["opatch_apply"],
+                              "opatchauto": ["opatchauto"], "datapatch": ["datapatch"],
+                              "sqlplus_script": ["sqlplus_script"],
+                              "clone_oh": ["clone_copy"], "switch_oh": [] }
+g_olr_loc_files = [ "/etc/oracle/olr.loc", "/var/opt/oracle/olr.loc" ]
+g_ocr_loc_files = [ "/etc/oracle/ocr.loc", "/var/opt/oracle/ocr.loc" ]
+g_backup_chunk_size = 256 * 1024 * 1024
+g_backup_chunk_files = 10000
+g_backup_compress_level = 3
 
 # @Description:
 #   Function to convert value to boolean
@@ -96,16 +160,31 @@ def gf_to_bool(p_value):
 
     raise Exception('Invalid value for boolean conversion: ' + str(p_value))
 
+# @Description:
+#   Class: OrapatchError
+#   Exception raised instead of module failure when fail_module is
+#   called from a worker thread. The main thread decides how to fail.
+#
+class OrapatchError(Exception):
+    pass
+
 # @Description:
 #   Function to trigger module failure
+#   In worker threads OrapatchError is raised instead
 # @Return:
 #   None
 # @Exception:
 #   Module failure
+#   OrapatchError if called from a worker thread
 #
 def fail_module(p_message, p_code = 245):
+    if threading.current_thread() is not threading.main_thread():
+        raise OrapatchError(p_message)
+
     logger("Module fail: " + str (p_message))
-    module.fail_json(rc = p_code, msg = "[orapatch] module fail: " + str (p_message))
+    gf_flush_logger()
+    gf_finish_timings()
+    module.fail_json(rc = p_code, msg = "[orapatch] module fail: " + str (p_message), **g_output)
 
 # @Description:
 #   Function to return current time in specific format
@@ -134,32 +213,111 @@ def gf_gettime():
 #
 def logger(p_message, p_notime = False):
 
+    global g_session_logger
+
+    # Messages of a log section (concurrent task) are tagged with the section tag
+    v_tag = getattr(g_logger_local, "tag", None)
+    v_text = p_message if v_tag is None else "[" + v_tag + "] " + p_message
+
     if not p_notime:
-        v_message = time.strftime("%c") + "\t" + p_message + "\n"
+        v_message = time.strftime("%c") + "\t" + v_text + "\n"
     else:
-        v_message = p_message + "\n"
+        v_message = v_text + "\n"
+
+    v_record = { "ts": datetime.datetime.now().isoformat(),
+                 "phase": g_log_phase,
+                 "home": g_log_home,
+                 "sid": getattr(g_logger_local, "sid", None),
+                 "section": v_tag,
+                 "elapsed": round(time.time() - g_start_time, 3),
+                 "msg": p_message }
+
+    # Separator lines are written to the text log only
+    if not p_message.strip("=- "):
+        v_record = None
 
-    f = open(g_logger_file,'a')
-    f.write(v_message)
-    f.close
+    with g_logger_lock:
+        if g_session_logger is None:
+            g_session_logger = SessionLogger(g_logger_file, g_json_logger_file)
+        g_session_logger.write(v_message, v_record)
 
 # @Description:
-#   Function to put informational message in logfile for session start
+#   Class: SessionLogger
+#   It keeps one buffered handle to the orapatch log file open for the
+#   module's lifetime, and optionally a JSON lines log file
+#   Callers must hold g_logger_lock
 # @Parameters:
 #   None
+# @Constructor parameters:
+#   p_logger_file: orapatch log file
+#   p_json_logger_file: JSON lines log file, None if not used
 # @Return:
 #   None
 # @Exception:
 #   None
 #
-def gf_start_logger_session():
+class SessionLogger(object):
 
-    logger("--------------------------------", True)
-    logger("orapatch session start")
-    logger("--------------------------------", True)
+    def __init__(self, p_logger_file, p_json_logger_file = None):
+
+        self.file = open(p_logger_file, "a", buffering = 65536)
+        self.json_file = None
+
+        if p_json_logger_file:
+            self.json_file = open(p_json_logger_file, "a", buffering = 65536)
+
+    # @Description:
+    #   Writes one message to the log files
+    # @Parameters:
+    #   p_message: formatted text message
+    #   p_record: dictionary written as JSON line, None for text only
+    # @Return:
+    #   None
+    # @Exception:
+    #   None
+    #
+    def write(self, p_message, p_record):
+
+        self.file.write(p_message)
+
+        if self.json_file and p_record:
+            self.json_file.write(json.dumps(p_record) + "\n")
+
+    # @Description:
+    #   Flushes buffered messages to the log files
+    # @Parameters:
+    #   None
+    # @Return:
+    #   None
+    # @Exception:
+    #   None
+    #
+    def flush(self):
+
+        self.file.flush()
+
+        if self.json_file:
+            self.json_file.flush()
+
+    # @Description:
+    #   Flushes and closes the log files
+    # @Parameters:
+    #   None
+    # @Return:
+    #   None
+    # @Exception:
+    #   None
+    #
+    def close(self):
+
+        self.file.close()
+
+        if self.json_file:
+            self.json_file.close()
 
 # @Description:
-#   Function to put informational message in logfile for session end
+#   Function to flush the orapatch log
+#   Called at phase boundaries and on module failure
 # @Parameters:
 #   None
 # @Return:
@@ -167,624 +325,4614 @@ def gf_start_logger_session():
 # @Exception:
 #   None
 #
-def gf_end_logger_session():
+def gf_flush_logger():
 
-    logger("--------------------------------", True)
-    logger("orapatch session end")
-    logger("--------------------------------", True)
+    with g_logger_lock:
+        if g_session_logger is not None:
+            g_session_logger.flush()
 
 # @Description:
-#   Function to check if given oracle home is part of a cluster
-#   The check is based on "NODE_LIST" argument in invetory file
-#   Cluster oracle homes have the "NODE_LIST" argument which specifies each node
-#
+#   Function to close the orapatch log, registered with atexit
 # @Parameters:
-#   p_oracle_home = ORACLE_HOME path
+#   None
 # @Return:
 #   None
 # @Exception:
-#   Fail if specified oracle home is not found in inventory
+#   None
 #
-def gf_is_cluster(p_oracle_home):
-    global g_inventory_file
-    v_tree = ET.parse(g_inventory_file)
-    v_root = v_tree.getroot()
-
-    for inventory in v_root.findall('HOME_LIST'):
-       for home in inventory.findall('HOME'):
-          #print(home.get('LOC'))
-          if home.get('LOC') == p_oracle_home:
-              if home.find('NODE_LIST'):
-                  logger("Oracle home ["+p_oracle_home+"] is part of a cluster.")
-                  return True
-              else:
-                  logger("Oracle home ["+p_oracle_home+"] is not part of a cluster.")
-                  return False
-
-    logger("Oracle home ["+p_oracle_home+"] not found in inventory.")
-    fail_module("Oracle home ["+p_oracle_home+"] not found in inventory.")
+def gf_close_logger():
+
+    global g_session_logger
+
+    with g_logger_lock:
+        if g_session_logger is not None:
+            g_session_logger.close()
+            g_session_logger = None
 
 # @Description:
-#   Class: DatabaseFactory
-#   It creates a database object
+#   Function to log phase header and flush the log
+#   The phase name is written with every JSON log record
 # @Parameters:
-#   None
-# @Constructor parameters:
-#   p_sid: Instance SID name
-#   p_version: Database version (10,11,12)
-#   p_db_name: Database name
-#   p_is_asm: Indicator whether the instance is ASM
-#   p_is_rac: Indicator whether the database is RAC database
-#   p_is_standby: Indicator whether the database is standby database
-#   p_instance_list: List of all (RAC) instances, if it is RAC
-#   p_is_active: False #not used
-#   p_initial_state: Initial state of the database (OPEN, MOUNT)
-#   p_oracle_home: Database oracle home path
-#   p_hostname: Hostname where the database is located
-#   p_crs_registered: Indicator whether database is part of CRS:
-#                     Oracle Restart or Clusterware.
-#   p_patch: indicator Whether to patch database data dictionary
-#   p_db_unique_name: Database unique name
+#   p_phase: phase name
 # @Return:
 #   None
 # @Exception:
 #   None
 #
-class DatabaseFactory(object):
+def gf_log_phase(p_phase):
 
-    def __init__(self, p_sid, p_version, p_db_name, p_is_asm = False, p_is_rac = False
-                     , p_is_standby = False, p_instance_list = None, p_is_active = False
-                     , p_initial_state = None, p_oracle_home = None, p_hostname = None
-                     , p_crs_registered = False, p_patch = False, p_db_unique_name = None):
+    global g_log_phase
 
-        self.sid            = p_sid
-        self.version        = p_version
-        self.name           = p_db_name
-        self.is_asm         = p_is_asm
-        self.is_rac         = p_is_rac
-        self.is_standby     = p_is_standby
-        self.instance_list  = p_instance_list
-        self.is_active      = p_is_active
-        self.initial_state  = p_initial_state
-        self.version_short  = p_version
-        self.oracle_home    = p_oracle_home
-        self.hostname       = p_hostname
-        self.crs_registered = p_crs_registered
-        self.patch          = p_patch
-        self.db_unique_name = p_db_unique_name
+    gf_flush_logger()
+
+    g_log_phase = p_phase
+
+    logger("==============================================",True)
+    logger(p_phase,True)
+    logger("==============================================",True)
 
 # @Description:
-#   Class: ListenerFactory
-#   It creates a listener object
+#   Function to run a callable and log the time it took
 # @Parameters:
-#   None
-# @Constructor parameters:
-#   p_listener_name: Listener name
-#   p_oracle_home: Listener's home
+#   p_label: Label used in the log
+#   p_callable: callable (without arguments) to run
 # @Return:
-#   None
+#   Result of the callable
 # @Exception:
-#   None
+#   Exceptions raised by the callable
 #
-class ListenerFactory(object):
+def gf_run_timed(p_label, p_callable):
 
-    def __init__(self, p_listener_name, p_oracle_home):
+    v_start = time.monotonic()
 
-        self.listener_name = p_listener_name
-        self.oracle_home = p_oracle_home
+    try:
+        return p_callable()
+    finally:
+        logger(p_label + ": " + "%.2f" % (time.monotonic() - v_start) + " seconds.")
 
 # @Description:
-#   Class: PatchFactory
-#   It creates a patch object
-#   For each patch that needs to be applied an object is created
-#   Patch attributes are defined in separate file named patch_dict.yml
+#   Function to add a timing record to the module result
+#   Records are returned in g_output["timings"]["phases"|"commands"]
 # @Parameters:
-#   None
-# @Constructor parameters:
-#   p_patch_id: Patch ID
-#   p_patch_proactive_bp_id: Proactive bundle patch ID
-#   p_patch_gi_id: Grid infrastructure patch ID
-#   p_patch_db_id: Database patch ID
-#   p_patch_ocw_id: OCW patch ID
-#   p_patch_ojvm_id: OJVM patch ID
-#   p_patch_acfs_id: ACFS patch ID
-#   p_patch_dbwlm_id: DBWLM patch ID
-#   p_patch_dir: Patch directory
-#   p_file: Patch (zip) file name
-#   p_only_oh: Indicator whether the patch is only for OH without SQL changes
-#   p_desc: Patch description
+#   p_kind: "phases" or "commands"
+#   p_record: dictionary with timing details
 # @Return:
 #   None
 # @Exception:
 #   None
 #
-class PatchFactory(object):
+def gf_add_timing(p_kind, p_record):
 
-    def __init__(self,  p_patch_id,
-                        p_patch_proactive_bp_id,
-                        p_patch_gi_id,
-                        p_patch_db_id,
-                        p_patch_ocw_id,
-                        p_patch_ojvm_id,
-                        p_patch_acfs_id,
-                        p_patch_dbwlm_id,
-                        p_patch_dir,
-                        p_file,
-                        p_only_oh,
-                        p_desc):
+    with g_timings_lock:
+        v_timings = g_output.setdefault("timings", { "phases": [], "commands": [] })
+        v_timings[p_kind].append(p_record)
 
-        self.patch_id               = p_patch_id
-        self.patch_proactive_bp_id  = p_patch_proactive_bp_id
-        self.patch_gi_id            = p_patch_gi_id
-        self.patch_db_id            = p_patch_db_id
-        self.patch_ocw_id           = p_patch_ocw_id
-        self.patch_ojvm_id          = p_patch_ojvm_id
-        self.patch_dir              = str (p_patch_dir)
-        self.file                   = p_file
-        self.desc                   = p_desc
-        self.only_oh                = p_only_oh
-        self.patch_acfs_id          = p_patch_acfs_id
-        self.patch_dbwlm_id         = p_patch_dbwlm_id
+# @Description:
+#   Function to return the category of an OS command
+#   The category is the first known Oracle tool found in the command
+# @Parameters:
+#   p_command: command
+# @Return:
+#   Category name, "os" if no known tool is found
+# @Exception:
+#   None
+#
+def gf_get_command_category(p_command):
 
-        if p_patch_proactive_bp_id:
-            self.is_dbbp = True
-        else:
-            self.is_dbbp = False
+    v_match = re.search(r"\b(" + "|".join(g_command_categories) + r")\b", p_command)
 
-        if p_patch_ojvm_id and (p_patch_proactive_bp_id or p_patch_db_id or p_patch_gi_id):
-            self.is_combo = True
-        else:
-            self.is_combo = False
+    if v_match:
+        return v_match.group(1)
 
-        if p_patch_gi_id:
-            self.is_grid = True
-        else:
-            self.is_grid = False
+    return "os"
 
 # @Description:
-#   Class: PatchProcess
-#   Class where all magic happens
+#   Function to return the history category of a command record
+#   Categories are finer than the timing categories: the OPatch operation,
+#   srvctl/lsnrctl start or stop, sqlplus startup, shutdown or script,
+#   copy of the oracle home by PATCH_OOP (clone_copy)
 # @Parameters:
-#   None
-# @Constructor parameters:
-#   p_oracle_home: Oracle home path
-#   p_only_prereq: Indicator whether to run only prerequisites
-#   p_patch_id: Patch ID of the patch to be appled
-#   p_sw_stage: OS location of the patch binaries
-#   p_patch_only_oh: Indicator whether to patch only oracle home without applying SQL changes
-#   p_patch_ojvm: Indicator whether to apply OJVM patch
-#   p_patch_db_all: Indicator whether to patch all databases for given oracle home
-#   p_patch_db_list: If not all databases need to be patched
-#                    This list contains which databases to patch
-#   p_patch_item: Patch definition. It contains argument definitions from patch_dict.yml file
+#   p_record: command timing record (command, category)
 # @Return:
-#   None
+#   Category name
 # @Exception:
 #   None
 #
-class PatchProcess(object):
-
-    def __init__(self, p_oracle_home, p_only_prereq,
-                       p_patch_id, p_sw_stage,
-                       p_patch_only_oh = None,
-                       p_patch_ojvm = None, p_patch_db_all = None,
-                       p_patch_db_list = None, p_patch_item = None):
-
+def gf_get_history_category(p_record):
 
-        self.oracle_home = p_oracle_home
-        self.only_prereq = p_only_prereq
-        self.patch_id    = p_patch_id
-        self.sw_stage    = p_sw_stage
-        self.patch_list  = {}
-        self.patch_item  = p_patch_item
-        self.is_crs     = False
-        self.is_cluster = False
+    v_command = p_record["command"]
+    v_category = p_record["category"]
 
-        # Run this block if "prerequisites" flag is false
-        # The user has chosen to apply patch
-        if not p_only_prereq:
+    if v_category == "opatchauto" or re.search(r"\bopatch auto\b", v_command):
+        return "opatchauto"
 
-            # Check if required parameters are set to True/False
-            # If not been specified, terminate module execution
-            # One of the following parameters needs to be defined:
-            #   p_patch_only_oh: Indicator whether to patch *only* oracle home
-            #   p_patch_ojvm: Indicator whether to apply OJVM patch
-            #   p_patch_db_all: Indicator whether to patch all databases
-            if p_patch_only_oh == None or p_patch_ojvm == None or p_patch_db_all == None:
-                # Terminate module execution
-                fail_module("Specify all required arguments.")
+    if v_category == "opatch":
+        v_match = re.search(r"\bopatch (prereq|n?apply|lspatches|version)\b", v_command)
+        if v_match:
+            return "opatch_" + v_match.group(1).replace("napply", "apply")
 
-            self.patch_only_oh  = p_patch_only_oh
-            self.patch_ojvm     = p_patch_ojvm
-            self.patch_db_all   = p_patch_db_all
-            self.patch_db_list  = None
+    if v_category == "os" and re.match(r"cp .*--reflink", v_command):
+        return "clone_copy"
 
-            # Check if the user has specified a list of databases to be patched
-            # The list is comma (,) separated list of databases
-            # The list can be empty (None)
-            # Strip the defined list of databases
-            if p_patch_db_list and p_patch_db_list.strip():
-                # Populate "patch_db_list" array from user defined list
-                # The list is split by comma (,)
-                self.patch_db_list  = p_patch_db_list.split(',')
+    if v_category in ("srvctl", "lsnrctl"):
+        v_match = re.search(r"\b" + v_category + r" (start|stop)\b", v_command)
+        if v_match:
+            return v_category + "_" + v_match.group(1)
 
-        self.set_inventory()
+    if v_category == "sqlplus":
+        v_statement = v_command.strip().lower()
+        if v_statement.startswith("startup"):
+            return "sqlplus_startup"
+        if v_statement.startswith("shutdown"):
+            return "sqlplus_shutdown"
+        if v_statement.startswith("@"):
+            return "sqlplus_script"
 
-        # Prepare a command to check if the given oracle home is GI (CRS) home
-        command = "grep \"LOC=\\\"" + self.oracle_home + "\\\"\" " + g_inventory_file + " | grep -i \"CRS=\\\"true\\\"\" | wc -l"
-        output = self.run_os_command(command)
-        # If the given oracle home is GI (CRS) home, set "is_crs" to True
-        if output and int(output) == 1:
-            self.is_crs = True
-        else:
-            # Note: 11g homes does not have CRS attribute in inventory.xml
-            # Workaround: Check for ohasd.bin existence in $ORACLE_HOME/bin dir
-            command = "ls " + self.oracle_home + "/bin | grep -iw [o]hasd.bin | wc -l"
-            output = self.run_os_command(command)
-            if output and int(output) == 1:
-                self.is_crs = True
-            else:
-                self.is_crs = False
+    return v_category
 
+# @Description:
+#   Function to return a command timeout from the timing history
+#   With enough samples of the category for the current patch, the timeout
+#   is g_history_timeout_factor times the 99th percentile
+#   The timeout is never below the default
+# @Parameters:
+#   p_category: history category
+#   p_default: default timeout (seconds)
+# @Return:
+#   Timeout (seconds)
+# @Exception:
+#   None
+#
+def gf_get_history_timeout(p_category, p_default):
 
-        #start: check if is cluster
+    if g_history is None or not g_history_context.get("patch_id"):
+        return p_default
 
-        #todo: gf_is_cluster needs to be checked/validated
-        command = "ls " + self.oracle_home + "/bin | grep -iw [c]emutlo.bin | wc -l"
-        output = self.run_os_command(command)
-        if output and int(output) == 1:
-            command = self.oracle_home + "/bin/cemutlo -n"
-            output = self.run_os_command(command)
-            if (output):
-                self.is_cluster = True
-                self.cluster_name = str (output)
+    v_stats = g_history.get_percentiles([p_category], g_history_context.get("oracle_home"), g_history_context.get("version"),
+                                        g_history_context.get("patch_id"))
 
-        # # Check if the given oracle home is part of a clusterware
-        # if gf_is_cluster(self.oracle_home):
-        #     # Set indicator "is_cluster" to True
-        #     self.is_cluster = True
-        #     # Get cluster name
-        #     command = self.oracle_home + "/bin/cemutlo -n"
-        #     output = self.run_os_command(command)
-        #     self.cluster_name = str (output)
+    if v_stats is None:
+        return p_default
 
-        #end: check if is cluster
+    v_timeout = max(p_default, int(v_stats["p99"] * g_history_timeout_factor))
+    logger("Timeout for " + p_category + " is " + str (v_timeout) + " seconds (" + str (v_stats["count"]) + " samples, " + v_stats["scope"] + ").")
+
+    return v_timeout
+
+# @Description:
+#   Function to log a phase header, run the phase and record its timing
+# @Parameters:
+#   p_phase: phase name
+#   p_callable: callable (without arguments) to run
+# @Return:
+#   Result of the callable
+# @Exception:
+#   Exceptions raised by the callable
+#
+def gf_run_phase(p_phase, p_callable):
+
+    gf_log_phase(p_phase)
+
+    # The record is added when the phase starts, so a module failure
+    # returns it as well (see gf_finish_timings)
+    v_record = { "phase": p_phase, "seconds": None, "status": "running" }
+    v_start = time.monotonic()
+
+    gf_add_timing("phases", v_record)
+    g_running_phases.append((v_record, v_start))
+
+    v_result = p_callable()
+
+    g_running_phases.remove((v_record, v_start))
+    v_record["seconds"] = round(time.monotonic() - v_start, 3)
+    v_record["status"] = "ok"
+
+    logger("Phase " + p_phase + " completed in " + "%.2f" % v_record["seconds"] + " seconds.")
+
+    return v_result
+
+# @Description:
+#   Function to complete timings before the module result is returned
+#   Phases still running are marked as failed
+# @Parameters:
+#   None
+# @Return:
+#   None
+# @Exception:
+#   None
+#
+def gf_finish_timings():
+
+    for v_record, v_start in g_running_phases:
+        v_record["seconds"] = round(time.monotonic() - v_start, 3)
+        v_record["status"] = "failed"
+
+    del g_running_phases[:]
+
+    if "timings" in g_output:
+        g_output["timings"]["total_seconds"] = round(time.monotonic() - g_start_monotonic, 3)
+
+    # Store command durations, the history must not fail the module
+    if g_history is not None and g_history_context:
+        try:
+            g_history.save(g_output.get("timings", {}).get("commands", []), g_output.get("stack_wait"))
+        except Exception as e:
+            logger("Timing history not saved: " + str (e))
+
+# @Description:
+#   Function to run a callable in its own log section
+#   Messages logged by the callable (in the current thread) are written
+#   immediately, tagged with p_tag (text log prefix, "section" in JSON
+#   records), so lines of concurrent tasks can be told apart
+#   Begin and end of the section are marked with banner messages
+# @Parameters:
+#   p_title: Log section title
+#   p_tag: Tag of the section messages (SID, service)
+#   p_callable: callable (without arguments) to run
+# @Return:
+#   Result of the callable
+# @Exception:
+#   Exceptions raised by the callable
+#
+def gf_run_log_section(p_title, p_tag, p_callable):
+
+    logger("----- " + p_title + " -----")
+
+    g_logger_local.tag = p_tag
+
+    try:
+        return p_callable()
+    finally:
+        g_logger_local.tag = None
+        logger("----- " + p_title + " end -----")
+
+# @Description:
+#   Function to return file modification time
+# @Parameters:
+#   p_path: file or directory path
+# @Return:
+#   Float or None if the path does not exist
+# @Exception:
+#   None
+#
+def gf_get_mtime(p_path):
+
+    try:
+        return os.stat(p_path).st_mtime
+    except (OSError, TypeError):
+        return None
+
+# @Description:
+#   Function to put informational message in logfile for session start
+# @Parameters:
+#   None
+# @Return:
+#   None
+# @Exception:
+#   None
+#
+def gf_start_logger_session():
+
+    logger("--------------------------------", True)
+    logger("orapatch session start")
+    logger("--------------------------------", True)
+
+# @Description:
+#   Function to put informational message in logfile for session end
+# @Parameters:
+#   None
+# @Return:
+#   None
+# @Exception:
+#   None
+#
+def gf_end_logger_session():
+
+    logger("--------------------------------", True)
+    logger("orapatch session end")
+    logger("--------------------------------", True)
+
+# @Description:
+#   Function to run tasks concurrently on a bounded worker pool
+#   Module failures inside a task are caught and reported per task
+# @Parameters:
+#   p_tasks: ordered dictionary of task name -> callable (without arguments)
+#   p_degree: maximum number of tasks running at the same time
+# @Return:
+#   Dictionary of task name -> (result, error message or None),
+#   in the same order as p_tasks
+# @Exception:
+#   None
+#
+def gf_run_concurrently(p_tasks, p_degree):
+
+    v_results = {}
+
+    with ThreadPoolExecutor(max_workers = max(1, p_degree)) as v_executor:
+
+        v_futures = {}
+
+        for v_name in p_tasks:
+            v_futures[v_name] = v_executor.submit(p_tasks[v_name])
+
+        for v_name in p_tasks:
+            try:
+                v_results[v_name] = (v_futures[v_name].result(), None)
+            except Exception as e:
+                v_results[v_name] = (None, str (e))
+
+    return v_results
+
+# @Description:
+#   Function to parse the per-patch result of an OPatch conflict prereq
+#   ("Summary of Conflict Analysis"). The patch IDs follow these lines:
+#     "Patches that can be applied now without any conflicts are :"
+#     "Following patches are not required, as they are subset of ..."
+#     "Following patches have conflicts. ..."
+# @Parameters:
+#   p_output: opatch prereq output
+# @Return:
+#   Dictionary of patch ID -> status (passed, failed), empty if there is no summary
+# @Exception:
+#   None
+#
+def gf_parse_prereq_patch_results(p_output):
+
+    v_results = {}
+    v_status = None
+
+    for v_line in p_output.splitlines():
+
+        v_line = v_line.strip()
+
+        if v_line.startswith("Patches that can be applied now without any conflicts are") or v_line.startswith("Following patches are not required"):
+            v_status = "passed"
+            continue
+
+        if v_line.startswith("Following patches have conflicts"):
+            v_status = "failed"
+            continue
+
+        if v_status and v_line:
+            # IDs are listed on the line after the header
+            for v_patch_id in re.findall(r"\b\d+\b", v_line):
+                if v_results.get(v_patch_id) != "failed":
+                    v_results[v_patch_id] = v_status
+            v_status = None
+
+    return v_results
+
+# @Description:
+#   Function to parse "srvctl config database" output
+#   Each database block starts with "Database unique name:"
+#   Output without such block (e.g. database not registered) returns
+#   an empty dictionary
+# @Parameters:
+#   p_output: srvctl config database output
+# @Return:
+#   Dictionary of lower case database unique name -> dictionary of
+#   lower case attribute name -> value
+# @Exception:
+#   None
+#
+def gf_parse_srvctl_config(p_output):
+
+    v_config = {}
+    v_db_config = None
+
+    for v_line in p_output.splitlines():
+
+        v_key, v_sep, v_value = v_line.partition(":")
+
+        if not v_sep:
+            continue
+
+        v_key = v_key.strip().lower()
+        v_value = v_value.strip()
+
+        if v_key == "database unique name":
+            v_db_config = {}
+            v_config[v_value.lower()] = v_db_config
+
+        if v_db_config is not None:
+            v_db_config[v_key] = v_value
+
+    return v_config
+
+# @Description:
+#   Function to walk a directory tree with os.scandir (symlinks are not followed)
+# @Parameters:
+#   p_root: directory to walk
+#   p_exclude: list of directories to skip
+# @Return:
+#   Generator of (relative path, os.DirEntry)
+# @Exception:
+#   None
+#
+def gf_scan_tree(p_root, p_exclude = None):
+
+    v_exclude = set(os.path.normpath(path) for path in (p_exclude or []))
+    v_stack = [""]
+
+    while v_stack:
+
+        v_rel_dir = v_stack.pop()
+
+        try:
+            v_entries = list(os.scandir(os.path.join(p_root, v_rel_dir)))
+        except OSError:
+            continue
+
+        for v_entry in v_entries:
+
+            v_rel_path = os.path.join(v_rel_dir, v_entry.name)
+
+            if os.path.normpath(v_entry.path) in v_exclude:
+                continue
+
+            yield v_rel_path, v_entry
+
+            if v_entry.is_dir(follow_symlinks = False):
+                v_stack.append(v_rel_path)
+
+# @Description:
+#   Function to write one backup chunk as gzip compressed tar (runs in a worker process)
+#   Ownership, permissions, timestamps and symlinks are kept by tarfile
+# @Parameters:
+#   p_root: directory the paths are relative to
+#   p_paths: list of relative paths
+#   p_part_file: chunk file to write
+# @Return:
+#   Tuple (chunk file, size of the chunk file)
+# @Exception:
+#   OSError
+#
+def gf_write_backup_chunk(p_root, p_paths, p_part_file):
+
+    with tarfile.open(p_part_file, "w:gz", compresslevel = g_backup_compress_level) as v_tar:
+        for v_path in p_paths:
+            v_tar.add(os.path.join(p_root, v_path), arcname = v_path, recursive = False)
+
+    return p_part_file, os.path.getsize(p_part_file)
+
+# @Description:
+#   Function to extract tar members as they were archived (owner, mode, absolute symlinks)
+# @Parameters:
+#   p_tar: tarfile object
+#   p_target_dir: target directory
+#   p_member: member to extract, None extracts all members
+# @Return:
+#   None
+# @Exception:
+#   tarfile.TarError, OSError
+#
+def gf_tar_extract(p_tar, p_target_dir, p_member = None):
+
+    v_kwargs = {}
+
+    if hasattr(tarfile, "fully_trusted_filter"):
+        v_kwargs["filter"] = "fully_trusted"
+
+    if p_member is None:
+        p_tar.extractall(p_target_dir, **v_kwargs)
+    else:
+        p_tar.extract(p_member, p_target_dir, **v_kwargs)
+
+# @Description:
+#   Function to extract zip members under given directories
+#   Only the zip central directory is read to select members, selected members
+#   are streamed directly to their target files
+#   File modes, modification times and symbolic links are preserved
+#   Files which exist with the same size and modification time are skipped
+#   Members are written to a .part file first and renamed, so no partially
+#   written file is left under its final name
+# @Parameters:
+#   p_zip_file: zip file
+#   p_prefixes: list of directories (relative to the zip root) to extract
+#   p_target_dir: directory where members are extracted
+# @Return:
+#   Dictionary with number of extracted and skipped members and extracted bytes
+# @Exception:
+#   Module failure if a member path is outside of the target directory
+#
+def gf_extract_zip_members(p_zip_file, p_prefixes, p_target_dir):
+
+    v_prefixes = [prefix.strip("/") + "/" for prefix in p_prefixes]
+    v_target_dir = os.path.realpath(p_target_dir)
+    v_result = { "members": 0, "skipped": 0, "bytes": 0 }
+
+    with zipfile.ZipFile(p_zip_file) as v_zip:
+
+        for v_member in v_zip.infolist():
+
+            if not any(v_member.filename.startswith(prefix) for prefix in v_prefixes):
+                continue
+
+            v_target = os.path.normpath(os.path.join(v_target_dir, v_member.filename))
+
+            if not v_target.startswith(v_target_dir + "/"):
+                fail_module("Zip member " + v_member.filename + " is outside of " + v_target_dir)
+
+            v_mode = v_member.external_attr >> 16
+            v_mtime = time.mktime(v_member.date_time + (0, 0, -1))
+
+            if v_member.is_dir():
+                os.makedirs(v_target, exist_ok = True)
+                continue
+
+            os.makedirs(os.path.dirname(v_target), exist_ok = True)
+
+            if stat.S_ISLNK(v_mode):
+
+                v_link = v_zip.read(v_member).decode("utf-8")
+
+                if os.path.islink(v_target) and os.readlink(v_target) == v_link:
+                    v_result["skipped"] += 1
+                    continue
+
+                if os.path.lexists(v_target + ".part"):
+                    os.remove(v_target + ".part")
+
+                os.symlink(v_link, v_target + ".part")
+                os.rename(v_target + ".part", v_target)
+                v_result["members"] += 1
+                continue
+
+            if (os.path.isfile(v_target) and os.path.getsize(v_target) == v_member.file_size
+                and int(os.path.getmtime(v_target)) == int(v_mtime)):
+                v_result["skipped"] += 1
+                continue
+
+            with v_zip.open(v_member) as v_source, open(v_target + ".part", "wb") as v_dest:
+                shutil.copyfileobj(v_source, v_dest, 1024 * 1024)
+
+            if v_mode:
+                os.chmod(v_target + ".part", stat.S_IMODE(v_mode))
+
+            os.utime(v_target + ".part", (v_mtime, v_mtime))
+            os.rename(v_target + ".part", v_target)
+
+            v_result["members"] += 1
+            v_result["bytes"] += v_member.file_size
+
+    return v_result
+
+# @Description:
+#   Function to list oracle home files referenced by a patch metadata file
+#   (etc/config/actions.xml or etc/config/inventory.xml)
+#   Elements with a "path" attribute under %ORACLE_HOME% are used, "name" is
+#   the file name within the path (copy, archive, jar actions)
+#   Make actions relink binaries, "i<name>" targets install bin/<name>
+# @Parameters:
+#   p_xml_file: patch metadata file
+#   p_oracle_home: oracle home path
+# @Return:
+#   Set of files (relative to the oracle home)
+# @Exception:
+#   None
+#
+def gf_get_patch_files(p_xml_file, p_oracle_home):
+
+    v_files = set()
+
+    for v_event, v_element in ET.iterparse(p_xml_file):
+
+        v_path = v_element.get("path")
+
+        if v_element.tag == "make":
+
+            v_target = v_element.get("make_target", "")
+
+            if v_target.startswith("i") and os.path.isfile(p_oracle_home + "/bin/" + v_target[1:]):
+                v_files.add("bin/" + v_target[1:])
+
+        elif v_path and v_path.startswith("%ORACLE_HOME%"):
+
+            v_file = v_path.replace("%ORACLE_HOME%", "").strip("/")
+
+            if v_element.get("name"):
+                v_file = (v_file + "/" + v_element.get("name")).strip("/")
+
+            if v_file and not os.path.isdir(p_oracle_home + "/" + v_file):
+                v_files.add(os.path.normpath(v_file))
+
+        v_element.clear()
+
+    return v_files
+
+# @Description:
+#   Function to list patches applied to an oracle home, without OPatch (no JVM)
+#   Patches are read from ONEOFF REF_ID of inventory/ContentsXML/comps.xml
+#   and from the inventory/oneoffs/<patch ID> directories. A patch is applied
+#   if it is found in both, differences are logged.
+# @Parameters:
+#   p_oracle_home: oracle home path
+# @Return:
+#   Set of applied patch IDs (int)
+# @Exception:
+#   None
+#
+def gf_get_applied_patches(p_oracle_home):
+
+    v_comps_file = p_oracle_home + "/inventory/ContentsXML/comps.xml"
+    v_oneoffs_dir = p_oracle_home + "/inventory/oneoffs"
+
+    v_comps = set()
+    v_oneoffs = set()
+
+    if os.path.isfile(v_comps_file):
+        try:
+            for v_event, v_element in ET.iterparse(v_comps_file):
+                if v_element.tag == "ONEOFF" and (v_element.get("REF_ID") or "").isdigit():
+                    v_comps.add(int(v_element.get("REF_ID")))
+                v_element.clear()
+        except ET.ParseError as e:
+            logger("Could not parse " + v_comps_file + ": " + str (e))
+            return set()
+    else:
+        logger("File " + v_comps_file + " not found.")
+
+    if os.path.isdir(v_oneoffs_dir):
+        v_oneoffs = set(int(name) for name in os.listdir(v_oneoffs_dir) if name.isdigit())
+
+    for v_patch_id in sorted(v_comps - v_oneoffs):
+        logger("Patch " + str (v_patch_id) + " is in comps.xml, but inventory/oneoffs/" + str (v_patch_id) + " does not exist.")
+
+    for v_patch_id in sorted(v_oneoffs - v_comps):
+        logger("Directory inventory/oneoffs/" + str (v_patch_id) + " exists, but the patch is not in comps.xml.")
+
+    return v_comps & v_oneoffs
+
+# @Description:
+#   Function to parse "crsctl stat res -f" output
+#   Resource blocks are separated by empty lines, each line is ATTRIBUTE=value
+# @Parameters:
+#   p_output: crsctl stat res -f output
+# @Return:
+#   List of dictionaries of attribute -> value
+# @Exception:
+#   None
+#
+def gf_parse_crs_resources(p_output):
+
+    v_resources = []
+    v_resource = {}
+
+    for v_line in p_output.splitlines() + [""]:
+
+        v_line = v_line.strip()
+
+        if not v_line:
+            if v_resource:
+                v_resources.append(v_resource)
+                v_resource = {}
+            continue
+
+        v_key, v_sep, v_value = v_line.partition("=")
+
+        if v_sep:
+            v_resource[v_key] = v_value
+
+    return v_resources
+
+# @Description:
+#   Function to check if given oracle home is part of a cluster
+#   The check is based on "NODE_LIST" argument in invetory file
+#   Cluster oracle homes have the "NODE_LIST" argument which specifies each node
+#
+# @Parameters:
+#   p_oracle_home = ORACLE_HOME path
+# @Return:
+#   None
+# @Exception:
+#   Fail if specified oracle home is not found in inventory
+#
+def gf_is_cluster(p_oracle_home):
+    global g_inventory
+
+    if g_inventory is None:
+        g_inventory = InventoryReader(p_oracle_home)
+
+    v_home = g_inventory.get_home(p_oracle_home)
+
+    if v_home is None:
+        logger("Oracle home ["+p_oracle_home+"] not found in inventory.")
+        fail_module("Oracle home ["+p_oracle_home+"] not found in inventory.")
+
+    if v_home["node_list"]:
+        logger("Oracle home ["+p_oracle_home+"] is part of a cluster.")
+        return True
+    else:
+        logger("Oracle home ["+p_oracle_home+"] is not part of a cluster.")
+        return False
+
+# @Description:
+#   Function to return a percentile (nearest rank) of sorted values
+# @Parameters:
+#   p_values: sorted list of values
+#   p_percentile: percentile (0-100)
+# @Return:
+#   Value
+# @Exception:
+#   None
+#
+def gf_percentile(p_values, p_percentile):
+
+    v_rank = max(1, -(-len(p_values) * p_percentile // 100))
+
+    return p_values[int(v_rank) - 1]
+
+# @Description:
+#   Function to read key=value pairs of the first existing file
+# @Parameters:
+#   p_files: list of candidate files (e.g. olr.loc locations)
+# @Return:
+#   Dictionary key -> value, empty if no file exists
+# @Exception:
+#   None
+#
+def gf_read_loc_file(p_files):
+
+    for v_file in p_files:
+
+        if os.path.isfile(v_file):
+
+            v_values = {}
+
+            with open(v_file, "r") as f:
+                for v_line in f:
+                    if "=" in v_line and not v_line.startswith("#"):
+                        v_key, v_value = v_line.split("=", 1)
+                        v_values[v_key.strip()] = v_value.strip()
+
+            return v_values
+
+    return {}
+
+# @Description:
+#   Function to discover the cluster membership of the host (CLUSTER_INFO)
+#   The grid home is read from olr.loc, the cluster name from "cemutlo -n"
+#   and the nodes from "olsnodes". Hosts without grid infrastructure and
+#   Oracle Restart hosts (local_only in ocr.loc) are standalone.
+# @Parameters:
+#   None
+# @Return:
+#   Dictionary with cluster_name (None if standalone), crs_home and nodes
+# @Exception:
+#   None
+#
+def gf_get_cluster_info():
+
+    v_info = { "cluster_name": None, "crs_home": None, "nodes": [] }
+
+    v_crs_home = gf_read_loc_file(g_olr_loc_files).get("crs_home")
+    v_local_only = gf_read_loc_file(g_ocr_loc_files).get("local_only", "FALSE").upper() == "TRUE"
+
+    if not v_crs_home or v_local_only or not os.path.isfile(v_crs_home + "/bin/cemutlo.bin"):
+        return v_info
+
+    v_info["crs_home"] = v_crs_home
+
+    v_env = dict(os.environ, ORACLE_HOME = v_crs_home)
+
+    for v_key, v_command in (("cluster_name", "cemutlo -n"), ("nodes", "olsnodes")):
+
+        process = subprocess.Popen(v_crs_home + "/bin/" + v_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True, env=v_env)
+        v_output, v_error = process.communicate()
+
+        if process.returncode != 0:
+            logger("Command \"" + v_command + "\" failed: " + (v_output + v_error).decode("utf-8", "replace").strip())
+            continue
+
+        v_output = v_output.decode("utf-8").split()
+
+        if v_key == "cluster_name":
+            v_info["cluster_name"] = v_output[0] if v_output else None
+        else:
+            v_info["nodes"] = v_output
+
+    return v_info
+
+# @Description:
+#   Function to return the sqlplus session pool
+# @Parameters:
+#   None
+# @Return:
+#   SqlplusPool object
+# @Exception:
+#   None
+#
+def gf_get_sqlplus_pool():
+    global g_sqlplus_pool
+
+    if g_sqlplus_pool is None:
+        g_sqlplus_pool = SqlplusPool()
+
+    return g_sqlplus_pool
+
+# @Description:
+#   Function to close all sqlplus sessions, registered with atexit
+# @Parameters:
+#   None
+# @Return:
+#   None
+# @Exception:
+#   None
+#
+def gf_close_sqlplus_pool():
+
+    if g_sqlplus_pool is not None:
+        g_sqlplus_pool.close()
+
+# @Description:
+#   Function to return the process table snapshot
+#   The snapshot is taken once and shared until a refresh is requested
+# @Parameters:
+#   p_refresh: Indicator whether to take a new snapshot
+# @Return:
+#   ProcessSnapshot object
+# @Exception:
+#   None
+#
+def gf_get_process_snapshot(p_refresh = False):
+    global g_process_snapshot
+
+    if g_process_snapshot is None or p_refresh:
+        g_process_snapshot = ProcessSnapshot()
+
+    return g_process_snapshot
+
+# @Description:
+#   Class: DatabaseFactory
+#   It creates a database object
+# @Parameters:
+#   None
+# @Constructor parameters:
+#   p_sid: Instance SID name
+#   p_version: Database version (10,11,12)
+#   p_db_name: Database name
+#   p_is_asm: Indicator whether the instance is ASM
+#   p_is_rac: Indicator whether the database is RAC database
+#   p_is_standby: Indicator whether the database is standby database
+#   p_instance_list: List of all (RAC) instances, if it is RAC
+#   p_is_active: False #not used
+#   p_initial_state: Initial state of the database (OPEN, MOUNT)
+#   p_oracle_home: Database oracle home path
+#   p_hostname: Hostname where the database is located
+#   p_crs_registered: Indicator whether database is part of CRS:
+#                     Oracle Restart or Clusterware.
+#   p_patch: indicator Whether to patch database data dictionary
+#   p_db_unique_name: Database unique name
+# @Return:
+#   None
+# @Exception:
+#   None
+#
+class DatabaseFactory(object):
+
+    def __init__(self, p_sid, p_version, p_db_name, p_is_asm = False, p_is_rac = False
+                     , p_is_standby = False, p_instance_list = None, p_is_active = False
+                     , p_initial_state = None, p_oracle_home = None, p_hostname = None
+                     , p_crs_registered = False, p_patch = False, p_db_unique_name = None):
+
+        self.sid            = p_sid
+        self.version        = p_version
+        self.name           = p_db_name
+        self.is_asm         = p_is_asm
+        self.is_rac         = p_is_rac
+        self.is_standby     = p_is_standby
+        self.instance_list  = p_instance_list
+        self.is_active      = p_is_active
+        self.initial_state  = p_initial_state
+        self.version_short  = p_version
+        self.oracle_home    = p_oracle_home
+        self.hostname       = p_hostname
+        self.crs_registered = p_crs_registered
+        self.patch          = p_patch
+        self.db_unique_name = p_db_unique_name
+
+# @Description:
+#   Class: ListenerFactory
+#   It creates a listener object
+# @Parameters:
+#   None
+# @Constructor parameters:
+#   p_listener_name: Listener name
+#   p_oracle_home: Listener's home
+# @Return:
+#   None
+# @Exception:
+#   None
+#
+class ListenerFactory(object):
+
+    def __init__(self, p_listener_name, p_oracle_home):
+
+        self.listener_name = p_listener_name
+        self.oracle_home = p_oracle_home
+
+# @Description:
+#   Class: PatchFactory
+#   It creates a patch object
+#   For each patch that needs to be applied an object is created
+#   Patch attributes are defined in separate file named patch_dict.yml
+# @Parameters:
+#   None
+# @Constructor parameters:
+#   p_patch_id: Patch ID
+#   p_patch_proactive_bp_id: Proactive bundle patch ID
+#   p_patch_gi_id: Grid infrastructure patch ID
+#   p_patch_db_id: Database patch ID
+#   p_patch_ocw_id: OCW patch ID
+#   p_patch_ojvm_id: OJVM patch ID
+#   p_patch_acfs_id: ACFS patch ID
+#   p_patch_dbwlm_id: DBWLM patch ID
+#   p_patch_dir: Patch directory
+#   p_file: Patch (zip) file name
+#   p_only_oh: Indicator whether the patch is only for OH without SQL changes
+#   p_desc: Patch description
+#   p_sha256: Expected SHA-256 digest of the patch (zip) file
+# @Return:
+#   None
+# @Exception:
+#   None
+#
+class PatchFactory(object):
+
+    def __init__(self,  p_patch_id,
+                        p_patch_proactive_bp_id,
+                        p_patch_gi_id,
+                        p_patch_db_id,
+                        p_patch_ocw_id,
+                        p_patch_ojvm_id,
+                        p_patch_acfs_id,
+                        p_patch_dbwlm_id,
+                        p_patch_dir,
+                        p_file,
+                        p_only_oh,
+                        p_desc,
+                        p_sha256 = None):
+
+        self.patch_id               = p_patch_id
+        self.patch_proactive_bp_id  = p_patch_proactive_bp_id
+        self.patch_gi_id            = p_patch_gi_id
+        self.patch_db_id            = p_patch_db_id
+        self.patch_ocw_id           = p_patch_ocw_id
+        self.patch_ojvm_id          = p_patch_ojvm_id
+        self.patch_dir              = str (p_patch_dir)
+        self.file                   = p_file
+        self.desc                   = p_desc
+        self.only_oh                = p_only_oh
+        self.patch_acfs_id          = p_patch_acfs_id
+        self.patch_dbwlm_id         = p_patch_dbwlm_id
+        self.sha256                 = p_sha256
+
+        if p_patch_proactive_bp_id:
+            self.is_dbbp = True
+        else:
+            self.is_dbbp = False
+
+        if p_patch_ojvm_id and (p_patch_proactive_bp_id or p_patch_db_id or p_patch_gi_id):
+            self.is_combo = True
+        else:
+            self.is_combo = False
+
+        if p_patch_gi_id:
+            self.is_grid = True
+        else:
+            self.is_grid = False
+
+# @Description:
+#   Class: InventoryReader
+#   It reads the central inventory in-process
+#   The inventory location is read from oraInst.loc and inventory.xml is
+#   parsed once into an index of homes keyed by home location (LOC)
+# @Parameters:
+#   None
+# @Constructor parameters:
+#   p_oracle_home: Oracle home path, used to locate oraInst.loc
+# @Return:
+#   None
+# @Exception:
+#   Module failure if oraInst.loc can not be read
+#
+class InventoryReader(object):
+
+    def __init__(self, p_oracle_home):
+
+        self.oracle_home    = p_oracle_home
+        self.orainst_file   = p_oracle_home + "/oraInst.loc"
+        self.home_index     = None
+
+        # Home specific oraInst.loc has precedence over the global one
+        if not os.path.isfile(self.orainst_file):
+            self.orainst_file = "/etc/oraInst.loc"
+
+        self.inventory_loc  = self.read_orainst_loc()
+        self.inventory_file = self.inventory_loc + "/ContentsXML/inventory.xml"
+
+    # @Description:
+    #   Reads "inventory_loc" from oraInst.loc
+    # @Parameters:
+    #   None
+    # @Return:
+    #   String
+    # @Exception:
+    #   Module failure if "inventory_loc" is not found
+    #
+    def read_orainst_loc(self):
+
+        try:
+
+            with open(self.orainst_file, "r") as f:
+                for line in f:
+                    v_key, v_sep, v_value = line.partition("=")
+                    if v_sep and v_key.strip() == "inventory_loc":
+                        return v_value.strip()
+
+        except (IOError, OSError) as e:
+            fail_module("Could not read " + self.orainst_file + ": " + str (e))
+
+        fail_module("Inventory location [inventory_loc] not found in " + self.orainst_file)
+
+    # @Description:
+    #   Parses inventory.xml into an index keyed by home location
+    #   Incremental parsing is used, each HOME element is released once indexed
+    # @Parameters:
+    #   None
+    # @Return:
+    #   None
+    # @Exception:
+    #   Module failure if inventory.xml can not be parsed
+    #
+    def build_home_index(self):
+
+        self.home_index = {}
+
+        try:
+
+            for v_event, v_elem in ET.iterparse(self.inventory_file, events = ("end",)):
+
+                if v_elem.tag != "HOME":
+                    continue
+
+                v_loc = v_elem.get("LOC")
+
+                if v_loc:
+                    self.home_index[os.path.normpath(v_loc)] = {
+                        "name": v_elem.get("NAME"),
+                        "is_crs": str (v_elem.get("CRS")).lower() == "true",
+                        "removed": str (v_elem.get("REMOVED")).upper() == "T",
+                        "node_list": [node.get("NAME") for node in v_elem.iter("NODE")] }
+
+                v_elem.clear()
+
+        except (IOError, OSError, ET.ParseError) as e:
+            fail_module("Could not parse inventory " + self.inventory_file + ": " + str (e))
+
+    # @Description:
+    #   Returns inventory details for given home location
+    # @Parameters:
+    #   p_oracle_home: Oracle home path
+    # @Return:
+    #   Dictionary (name, is_crs, removed, node_list) or None if not found
+    # @Exception:
+    #   None
+    #
+    def get_home(self, p_oracle_home):
+
+        if self.home_index is None:
+            self.build_home_index()
+
+        return self.home_index.get(os.path.normpath(p_oracle_home))
+
+# @Description:
+#   Class: ProcessSnapshot
+#   It takes a snapshot of the process table by reading /proc once
+#   Processes are indexed by pmon SID, ASM pmon SID, listener name and
+#   the oracle home of the process executable
+# @Parameters:
+#   None
+# @Constructor parameters:
+#   None
+# @Return:
+#   None
+# @Exception:
+#   None
+#
+class ProcessSnapshot(object):
+
+    def __init__(self):
+
+        self.pmon_sids  = {}  # lower case SID -> pid
+        self.asm_sids   = {}  # lower case ASM SID -> pid
+        self.listeners  = {}  # (listener name, listener oracle home) -> pid
+        self.home_index = {}  # oracle home -> list of pids
+        self.args       = {}  # pid -> process arguments
+
+        for v_pid in os.listdir("/proc"):
+
+            if not v_pid.isdigit() or int(v_pid) == os.getpid():
+                continue
+
+            try:
+                with open("/proc/" + v_pid + "/cmdline", "rb") as f:
+                    v_cmdline = f.read()
+            except (IOError, OSError):
+                # Process has exited in the meantime
+                continue
+
+            v_args = [arg.decode("utf-8", "replace") for arg in v_cmdline.split(b"\0") if arg]
+
+            # Kernel threads do not have arguments
+            if not v_args:
+                continue
+
+            # Background processes rewrite their arguments, e.g. "ora_pmon_ORCL"
+            v_args = " ".join(v_args).split()
+            v_pid = int(v_pid)
+            self.args[v_pid] = " ".join(v_args)
+
+            v_match = re.match(r"(ora|asm)_pmon_(\S+)$", v_args[0], re.IGNORECASE)
+            if v_match:
+                if v_match.group(1).lower() == "asm":
+                    self.asm_sids[v_match.group(2).lower()] = v_pid
+                else:
+                    self.pmon_sids[v_match.group(2).lower()] = v_pid
+
+            try:
+                v_exe = os.readlink("/proc/" + str (v_pid) + "/exe")
+            except OSError:
+                # Executable of processes owned by other users is not readable
+                v_exe = v_args[0]
+
+            # Binary replaced while the process is running, e.g. by opatch
+            v_exe = re.sub(r" \(deleted\)$", "", v_exe)
+
+            v_home = None
+            if os.path.isabs(v_exe) and os.path.basename(os.path.dirname(v_exe)) == "bin":
+                v_home = os.path.dirname(os.path.dirname(v_exe))
+                self.home_index.setdefault(v_home, []).append(v_pid)
+
+            if os.path.basename(v_args[0]) == "tnslsnr" and len(v_args) > 1:
+                if os.path.isabs(v_args[0]):
+                    v_home = os.path.dirname(os.path.dirname(v_args[0]))
+                # Listeners of the same name can run from different homes
+                self.listeners[(v_args[1], v_home)] = v_pid
+
+    # @Description:
+    #   Checks whether pmon process is running for given SID
+    # @Parameters:
+    #   p_sid: instance SID
+    #   p_asm: indicator whether it's an ASM instance
+    # @Return:
+    #   Boolean
+    # @Exception:
+    #   None
+    #
+    def is_pmon_running(self, p_sid, p_asm = False):
+
+        if p_asm:
+            return p_sid.lower() in self.asm_sids
+
+        return p_sid.lower() in self.pmon_sids
+
+    # @Description:
+    #   Returns listeners running from given oracle home
+    # @Parameters:
+    #   p_oracle_home: oracle home path
+    # @Return:
+    #   List of listener names
+    # @Exception:
+    #   None
+    #
+    def get_listeners(self, p_oracle_home):
+
+        v_oracle_home = os.path.normpath(p_oracle_home)
+
+        return [name for name, home in self.listeners if home == v_oracle_home]
+
+    # @Description:
+    #   Returns processes running from given oracle home
+    #   A process belongs to the home if its executable is under the home or
+    #   if the oracle home path appears (as a word) in its arguments
+    # @Parameters:
+    #   p_oracle_home: oracle home path
+    # @Return:
+    #   List of pids
+    # @Exception:
+    #   None
+    #
+    def get_home_processes(self, p_oracle_home):
+
+        v_oracle_home = os.path.normpath(p_oracle_home)
+        v_pids = set(self.home_index.get(v_oracle_home, []))
+
+        v_pattern = re.compile(r"(?<!\w)" + re.escape(v_oracle_home) + r"(?!\w)", re.IGNORECASE)
+
+        for v_pid in self.args:
+            if v_pattern.search(self.args[v_pid]):
+                v_pids.add(v_pid)
+
+        return sorted(v_pids)
+
+# @Description:
+#   Class: CommandOutput
+#   It collects output of an OS command line by line
+#   Only a bounded tail of the output is kept, together with lines matching
+#   g_output_keep_patterns and the caller's patterns, unless the full output
+#   is requested (output parsed by the caller)
+#   In debug mode each line is logged as it arrives
+# @Parameters:
+#   None
+# @Constructor parameters:
+#   p_patterns: additional patterns of lines to keep
+#   p_log: indicator whether to log lines in debug mode
+#   p_full_output: indicator whether to keep all lines
+# @Return:
+#   None
+# @Exception:
+#   None
+#
+class CommandOutput(object):
+
+    def __init__(self, p_patterns = None, p_log = True, p_full_output = False):
+
+        self.tail       = collections.deque(maxlen = None if p_full_output else g_output_tail_lines)
+        self.matches    = []
+        self.line_count = 0
+        self.log        = p_log and g_debug
+        self.patterns   = [re.compile(pattern) for pattern in g_output_keep_patterns + list(p_patterns or [])]
+
+    # @Description:
+    #   Adds one line of output
+    # @Parameters:
+    #   p_line: line of output
+    # @Return:
+    #   None
+    # @Exception:
+    #   None
+    #
+    def add_line(self, p_line):
+
+        v_line = p_line.rstrip("\r\n")
+
+        if self.log:
+            logger(v_line, True)
+
+        for v_pattern in self.patterns:
+            if v_pattern.search(v_line):
+                self.matches.append((self.line_count, v_line))
+                break
+
+        self.tail.append((self.line_count, v_line))
+        self.line_count += 1
+
+    # @Description:
+    #   Reads a binary stream line by line until end of stream
+    #   Non UTF-8 characters are replaced
+    # @Parameters:
+    #   p_stream: binary stream, e.g. process stdout
+    # @Return:
+    #   None
+    # @Exception:
+    #   None
+    #
+    def read_stream(self, p_stream):
+
+        for v_line in iter(p_stream.readline, b""):
+            self.add_line(v_line.decode("utf-8", "replace"))
+
+        p_stream.close()
+
+    # @Description:
+    #   Returns collected output
+    #   Matched lines which dropped out of the tail are put before the tail
+    # @Parameters:
+    #   None
+    # @Return:
+    #   String
+    # @Exception:
+    #   None
+    #
+    def get_output(self):
+
+        v_first_line = self.tail[0][0] if self.tail else self.line_count
+
+        v_lines = [line for index, line in self.matches if index < v_first_line]
+        v_lines += [line for index, line in self.tail]
+
+        return "\n".join(v_lines).strip()
+
+    # @Description:
+    #   Returns the number of lines not kept
+    # @Parameters:
+    #   None
+    # @Return:
+    #   Number of lines
+    # @Exception:
+    #   None
+    #
+    def get_dropped_lines(self):
+
+        v_first_line = self.tail[0][0] if self.tail else self.line_count
+
+        return v_first_line - len([index for index, line in self.matches if index < v_first_line])
+
+# @Description:
+#   Class: SqlplusSession
+#   Long-lived "sqlplus -s / as sysdba" process driven through pexpect
+#   Statements are followed by a sentinel prompt, output is read line by line
+#   until the sentinel is printed
+# @Parameters:
+#   None
+# @Constructor parameters:
+#   p_sid: Instance SID name
+#   p_oracle_home: Oracle home path
+# @Return:
+#   None
+# @Exception:
+#   None
+#
+class SqlplusSession(object):
+
+    def __init__(self, p_sid, p_oracle_home):
+
+        self.sid            = p_sid
+        self.oracle_home    = p_oracle_home
+        self.sequence       = 0
+        self.lock           = threading.Lock()
+
+        v_env = dict(os.environ)
+        v_env["ORACLE_HOME"] = p_oracle_home
+        v_env["ORACLE_SID"] = p_sid
+
+        logger("Open sqlplus session for SID: " + p_sid + ", OH: " + p_oracle_home)
+
+        self.child = pexpect.spawn(p_oracle_home + "/bin/sqlplus", ["-s", "/ as sysdba"], env = v_env,
+                                   timeout = g_sqlplus_timeout, encoding = "utf-8", codec_errors = "replace", echo = False)
+
+        # Consume output of glogin.sql
+        self.execute("")
+
+    # @Description:
+    #   Checks whether sqlplus process is running
+    # @Parameters:
+    #   None
+    # @Return:
+    #   Boolean
+    # @Exception:
+    #   None
+    #
+    def is_alive(self):
+
+        return self.child.isalive()
+
+    # @Description:
+    #   Executes statements and returns their output
+    #   If sqlplus exits (e.g. a script ends with "exit"), the output read
+    #   so far is returned and the session is closed
+    # @Parameters:
+    #   p_statements: statements or sqlplus commands, one per line
+    # @Return:
+    #   Output
+    # @Exception:
+    #   Module failure if the sentinel is not printed within the timeout
+    #
+    def execute(self, p_statements):
+
+        with self.lock:
+
+            self.sequence += 1
+            v_sentinel = "ORAPATCH_SENTINEL_" + str (os.getpid()) + "_" + str (self.sequence)
+            v_output = CommandOutput()
+
+            for v_line in p_statements.splitlines():
+                self.child.sendline(v_line)
+
+            self.child.sendline("prompt " + v_sentinel)
+
+            v_pattern_list = self.child.compile_pattern_list(["\r?\n", pexpect.EOF])
+
+            while True:
+
+                try:
+                    v_index = self.child.expect_list(v_pattern_list)
+                except pexpect.TIMEOUT:
+                    self.close()
+                    fail_module("sqlplus session for SID " + self.sid + " timed out after " + str (g_sqlplus_timeout) + " seconds.")
+
+                if v_index == 1:
+
+                    if self.child.before:
+                        v_output.add_line(self.child.before)
+                    logger("sqlplus session for SID " + self.sid + " ended.")
+                    self.close()
+                    break
+
+                if self.child.before.strip() == v_sentinel:
+                    break
+
+                v_output.add_line(self.child.before)
+
+            return v_output.get_output()
+
+    # @Description:
+    #   Closes sqlplus process
+    # @Parameters:
+    #   None
+    # @Return:
+    #   None
+    # @Exception:
+    #   None
+    #
+    def close(self):
+
+        if self.child.isalive():
+            try:
+                self.child.sendline("exit")
+                self.child.expect(pexpect.EOF, timeout = 30)
+            except (pexpect.TIMEOUT, OSError):
+                pass
+
+        self.child.close(force = True)
+
+# @Description:
+#   Class: SqlplusPool
+#   Pool of sqlplus sessions, one per SID and Oracle home
+#   Process creation and login are paid once per SID per module run
+#   Sessions from a home are closed before its binaries are patched
+# @Parameters:
+#   None
+# @Constructor parameters:
+#   None
+# @Return:
+#   None
+# @Exception:
+#   None
+#
+class SqlplusPool(object):
+
+    def __init__(self):
+
+        self.sessions   = {}
+        self.lock       = threading.Lock()
+
+    # @Description:
+    #   Executes statements in the session for given SID
+    #   The session is opened on first use or if it has ended
+    # @Parameters:
+    #   p_sid: Instance SID name
+    #   p_oracle_home: Oracle home path
+    #   p_statements: statements or sqlplus commands, one per line
+    # @Return:
+    #   Output
+    # @Exception:
+    #   Module failure
+    #
+    def execute(self, p_sid, p_oracle_home, p_statements):
+
+        v_key = (p_sid, os.path.normpath(p_oracle_home))
+
+        with self.lock:
+
+            v_session = self.sessions.get(v_key)
+
+            if v_session is None or not v_session.is_alive():
+                v_session = None
+
+        if v_session is None:
+            v_session = SqlplusSession(p_sid, p_oracle_home)
+
+            with self.lock:
+                self.sessions[v_key] = v_session
+
+        logger("sqlplus [" + p_sid + "]: " + " / ".join(p_statements.splitlines()))
+
+        v_start = time.monotonic()
+
+        try:
+            return v_session.execute(p_statements)
+        finally:
+            gf_add_timing("commands", { "command": p_statements,
+                                        "category": "sqlplus",
+                                        "seconds": round(time.monotonic() - v_start, 3),
+                                        "exit_status": None if v_session.is_alive() else v_session.child.exitstatus,
+                                        "phase": g_log_phase,
+                                        "sid": p_sid })
+
+    # @Description:
+    #   Closes sessions
+    # @Parameters:
+    #   p_oracle_home: close only sessions from this Oracle home
+    #   p_sid: close only session for this SID
+    # @Return:
+    #   None
+    # @Exception:
+    #   None
+    #
+    def close(self, p_oracle_home = None, p_sid = None):
+
+        with self.lock:
+
+            v_keys = [key for key in self.sessions
+                      if (p_oracle_home is None or key[1] == os.path.normpath(p_oracle_home))
+                      and (p_sid is None or key[0] == p_sid)]
+            v_sessions = [self.sessions.pop(key) for key in v_keys]
+
+        for v_session in v_sessions:
+            logger("Close sqlplus session for SID: " + v_session.sid)
+            v_session.close()
+
+# @Description:
+#   Class: StageCache
+#   Host local cache of patch zip files and their extracted sub-patches
+#   Each oracle home owner has a private (0700) cache directory
+#   <p_cache_dir>/<owner>, OPatch never applies files other users can write
+#   Layout:
+#     zips/<zip name>       local copy of the patch zip (.part while copying)
+#     stage/<patch_dir>     extracted sub-patches, used as stage by OPatch
+#     index.json            entries keyed by "<zip name>:<SHA-256>"
+#   Zip copies resume after interruption. The digest is stored together with
+#   size and modification time of the source, so later runs skip hashing.
+#   Entries are evicted least recently used first once the cache exceeds its size.
+#   Index changes are serialized with a lock file.
+#   The cache of another owner (BACKUP runs as backup_user) is opened read-only:
+#   nothing is created, locked or written.
+# @Parameters:
+#   None
+# @Constructor parameters:
+#   p_cache_dir: Cache directory
+#   p_max_size: Maximum cache size in bytes per owner (None or 0 for unlimited)
+#   p_owner_uid: Uid of the cache owner (None for the current user)
+# @Return:
+#   None
+# @Exception:
+#   Module failure if the owner's cache directory is not private
+#
+class StageCache(object):
+
+    def __init__(self, p_cache_dir, p_max_size = None, p_owner_uid = None):
+
+        if p_owner_uid is None:
+            p_owner_uid = os.getuid()
+
+        v_owner = pwd.getpwuid(p_owner_uid).pw_name
+
+        self.cache_dir  = p_cache_dir.rstrip("/") + "/" + v_owner
+        self.zip_dir    = self.cache_dir + "/zips"
+        self.stage_dir  = self.cache_dir + "/stage"
+        self.index_file = self.cache_dir + "/index.json"
+        self.max_size   = p_max_size
+        self.lock_fd    = None
+        self.owner_uid  = p_owner_uid
+        self.read_only  = p_owner_uid != os.getuid()
+
+        if self.read_only:
+
+            if os.path.lexists(self.cache_dir):
+                v_stat = os.lstat(self.cache_dir)
+                if not stat.S_ISDIR(v_stat.st_mode) or v_stat.st_uid != p_owner_uid or v_stat.st_mode & 0o077:
+                    fail_module("Stage cache directory " + self.cache_dir + " must be a directory owned by " + v_owner + " with mode 0700.")
+
+            return
+
+        # The base directory only holds the owner directories (like /tmp)
+        if not os.path.isdir(p_cache_dir):
+            os.makedirs(p_cache_dir)
+            os.chmod(p_cache_dir, 0o1777)
+
+        if not os.path.lexists(self.cache_dir):
+            os.mkdir(self.cache_dir, 0o700)
+
+        v_stat = os.lstat(self.cache_dir)
+        if not stat.S_ISDIR(v_stat.st_mode) or v_stat.st_uid != os.getuid() or v_stat.st_mode & 0o077:
+            fail_module("Stage cache directory " + self.cache_dir + " must be a directory owned by " + v_owner + " with mode 0700.")
+
+        for v_dir in (self.zip_dir, self.stage_dir):
+            if not os.path.isdir(v_dir):
+                os.mkdir(v_dir, 0o700)
+
+    # @Description:
+    #   Acquires (exclusive) cache lock
+    # @Parameters:
+    #   None
+    # @Return:
+    #   None
+    # @Exception:
+    #   None
+    #
+    def lock(self):
+
+        if self.read_only:
+            return
+
+        self.lock_fd = os.open(self.cache_dir + "/.lock", os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self.lock_fd, fcntl.LOCK_EX)
+
+    # @Description:
+    #   Releases cache lock
+    # @Parameters:
+    #   None
+    # @Return:
+    #   None
+    # @Exception:
+    #   None
+    #
+    def unlock(self):
+
+        if self.lock_fd is not None:
+            fcntl.flock(self.lock_fd, fcntl.LOCK_UN)
+            os.close(self.lock_fd)
+            self.lock_fd = None
+
+    # @Description:
+    #   Reads cache index
+    #   An index not owned by the cache owner is ignored
+    # @Parameters:
+    #   None
+    # @Return:
+    #   Dictionary of entries
+    # @Exception:
+    #   None
+    #
+    def load_index(self):
+
+        try:
+            with open(self.index_file, "r") as f:
+                if os.fstat(f.fileno()).st_uid != self.owner_uid:
+                    logger("Stage cache index " + self.index_file + " is not owned by the cache owner, ignored.")
+                    return {}
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    # @Description:
+    #   Writes cache index
+    # @Parameters:
+    #   p_index: Dictionary of entries
+    # @Return:
+    #   None
+    # @Exception:
+    #   None
+    #
+    def save_index(self, p_index):
+
+        v_tmp_file = self.index_file + "." + str (os.getpid())
+
+        with open(v_tmp_file, "w") as f:
+            json.dump(p_index, f, indent = 1)
+
+        os.rename(v_tmp_file, self.index_file)
+
+    # @Description:
+    #   Returns index entry for given zip name
+    # @Parameters:
+    #   p_index: Dictionary of entries
+    #   p_zip_name: zip file name
+    # @Return:
+    #   Tuple of key and entry, (None, None) if not found
+    # @Exception:
+    #   None
+    #
+    def find_entry(self, p_index, p_zip_name):
+
+        for v_key in p_index:
+            if p_index[v_key]["zip"] == p_zip_name:
+                return v_key, p_index[v_key]
+
+        return None, None
+
+    # @Description:
+    #   Copies zip file into the cache
+    #   The copy is written to a .part file and continues from its size if it exists
+    # @Parameters:
+    #   p_source: source zip file
+    # @Return:
+    #   Local zip file
+    # @Exception:
+    #   None
+    #
+    def copy_zip(self, p_source):
+
+        v_target = self.zip_dir + "/" + os.path.basename(p_source)
+        v_part = v_target + ".part"
+        v_source_stat = os.stat(p_source)
+        v_source_size = v_source_stat.st_size
+
+        # The .part file is resumed only if the source did not change
+        v_source_id = str (v_source_size) + ":" + str (int(v_source_stat.st_mtime))
+
+        v_offset = 0
+        if os.path.isfile(v_part) and os.path.isfile(v_part + ".source"):
+            with open(v_part + ".source", "r") as f:
+                if f.read() == v_source_id:
+                    v_offset = os.path.getsize(v_part)
+            if v_offset > v_source_size:
+                v_offset = 0
+
+        with open(v_part + ".source", "w") as f:
+            f.write(v_source_id)
+
+        if v_offset:
+            logger("Resume copy of " + p_source + " at " + str (v_offset) + " of " + str (v_source_size) + " bytes.")
+        else:
+            logger("Copy " + p_source + " (" + str (v_source_size) + " bytes) to " + self.zip_dir)
+
+        with open(p_source, "rb") as v_src, open(v_part, "ab" if v_offset else "wb") as v_dest:
+            v_src.seek(v_offset)
+            shutil.copyfileobj(v_src, v_dest, 16 * 1024 * 1024)
+
+        os.rename(v_part, v_target)
+        os.remove(v_part + ".source")
+
+        return v_target
+
+    # @Description:
+    #   Computes SHA-256 digest of a file over memory mapped chunks
+    # @Parameters:
+    #   p_file: file
+    # @Return:
+    #   Hex digest
+    # @Exception:
+    #   None
+    #
+    def get_sha256(self, p_file):
+
+        v_chunk_size = 64 * 1024 * 1024
+        v_hash = hashlib.sha256()
+
+        with open(p_file, "rb") as f:
+
+            v_size = os.fstat(f.fileno()).st_size
+
+            for v_offset in range(0, v_size, v_chunk_size):
+                v_length = min(v_chunk_size, v_size - v_offset)
+                v_map = mmap.mmap(f.fileno(), v_length, access = mmap.ACCESS_READ, offset = v_offset)
+                try:
+                    v_hash.update(v_map)
+                finally:
+                    v_map.close()
+
+        return v_hash.hexdigest()
+
+    # @Description:
+    #   Makes sure the zip file is in the cache and verified
+    #   The stored digest is reused if source size and modification time did not change
+    # @Parameters:
+    #   p_source: source zip file
+    #   p_sha256: expected SHA-256 digest (optional)
+    # @Return:
+    #   Tuple of key, local zip file and digest
+    # @Exception:
+    #   Module failure if the digest does not match
+    #
+    def add_zip(self, p_source, p_sha256 = None):
+
+        v_zip_name = os.path.basename(p_source)
+        v_local_zip = self.zip_dir + "/" + v_zip_name
+        v_source_stat = os.stat(p_source)
+
+        v_index = self.load_index()
+        v_key, v_entry = self.find_entry(v_index, v_zip_name)
+
+        if (v_entry and os.path.isfile(v_local_zip)
+            and v_entry["source_size"] == v_source_stat.st_size
+            and v_entry["source_mtime"] == int(v_source_stat.st_mtime)):
+
+            logger("Zip " + v_zip_name + " found in stage cache, SHA-256: " + v_entry["sha256"])
+            v_digest = v_entry["sha256"]
+
+        else:
+
+            if v_entry:
+                self.remove_entry(v_index, v_key)
+                self.save_index(v_index)
+
+            v_local_zip = self.copy_zip(p_source)
+            v_digest = self.get_sha256(v_local_zip)
+            logger("Zip " + v_zip_name + " SHA-256: " + v_digest)
+
+        if p_sha256 and p_sha256.lower() != v_digest:
+            os.remove(v_local_zip)
+            fail_module("SHA-256 of " + v_zip_name + " (" + v_digest + ") does not match expected " + p_sha256)
+
+        v_key = v_zip_name + ":" + v_digest
+
+        v_entry = v_index.get(v_key, { "zip": v_zip_name, "sha256": v_digest, "dirs": [] })
+        v_entry["source_size"] = v_source_stat.st_size
+        v_entry["source_mtime"] = int(v_source_stat.st_mtime)
+        v_index[v_key] = v_entry
+        self.save_index(v_index)
+
+        return v_key, v_local_zip, v_digest
+
+    # @Description:
+    #   Registers extracted directories and updates size and last use of an entry
+    # @Parameters:
+    #   p_key: entry key
+    #   p_dirs: extracted directories (relative to stage)
+    # @Return:
+    #   None
+    # @Exception:
+    #   None
+    #
+    def update_entry(self, p_key, p_dirs):
+
+        v_index = self.load_index()
+        v_entry = v_index[p_key]
+
+        v_entry["dirs"] = sorted(set(v_entry["dirs"]) | set(p_dirs))
+        v_entry["last_used"] = time.time()
+
+        v_size = 0
+        if os.path.isfile(self.zip_dir + "/" + v_entry["zip"]):
+            v_size = os.path.getsize(self.zip_dir + "/" + v_entry["zip"])
+
+        for v_dir in v_entry["dirs"]:
+            for v_root, v_dirs, v_files in os.walk(self.stage_dir + "/" + v_dir):
+                for v_file in v_files:
+                    try:
+                        v_size += os.lstat(os.path.join(v_root, v_file)).st_size
+                    except OSError:
+                        pass
+
+        v_entry["size"] = v_size
+        self.save_index(v_index)
+
+    # @Description:
+    #   Returns stage directory if all zips are cached and extracted
+    #   Last use of the entries is updated
+    # @Parameters:
+    #   p_zip_names: zip file names
+    # @Return:
+    #   Stage directory or None
+    # @Exception:
+    #   None
+    #
+    def get_stage(self, p_zip_names):
+
+        v_index = self.load_index()
+        v_keys = []
+
+        for v_zip_name in p_zip_names:
+
+            v_key, v_entry = self.find_entry(v_index, v_zip_name)
+
+            if not v_entry or not v_entry["dirs"]:
+                return None
+
+            for v_dir in v_entry["dirs"]:
+                if not os.path.isdir(self.stage_dir + "/" + v_dir):
+                    return None
+
+            v_keys.append(v_key)
+
+        if not self.read_only:
+
+            for v_key in v_keys:
+                v_index[v_key]["last_used"] = time.time()
+
+            self.save_index(v_index)
+
+        return self.stage_dir
+
+    # @Description:
+    #   Removes entry files (zip and extracted patch directories) and the index entry
+    # @Parameters:
+    #   p_index: Dictionary of entries
+    #   p_key: entry key
+    # @Return:
+    #   None
+    # @Exception:
+    #   None
+    #
+    def remove_entry(self, p_index, p_key):
+
+        v_entry = p_index.pop(p_key)
+
+        logger("Remove " + p_key + " from stage cache.")
+
+        for v_file in (self.zip_dir + "/" + v_entry["zip"], self.zip_dir + "/" + v_entry["zip"] + ".part",
+                       self.zip_dir + "/" + v_entry["zip"] + ".part.source"):
+            if os.path.isfile(v_file):
+                os.remove(v_file)
+
+        # Patch directory is removed as a whole, the first path element is patch_dir
+        for v_patch_dir in set(v_dir.split("/")[0] for v_dir in v_entry["dirs"]):
+            shutil.rmtree(self.stage_dir + "/" + v_patch_dir, ignore_errors = True)
+
+    # @Description:
+    #   Evicts least recently used entries until the cache fits its maximum size
+    # @Parameters:
+    #   p_keep: entry keys which must not be evicted
+    # @Return:
+    #   List of evicted keys
+    # @Exception:
+    #   None
+    #
+    def evict(self, p_keep):
+
+        v_evicted = []
+
+        if not self.max_size:
+            return v_evicted
+
+        v_index = self.load_index()
+        v_total = sum(v_index[key].get("size", 0) for key in v_index)
+
+        for v_key in sorted(v_index, key = lambda key: v_index[key].get("last_used", 0)):
+
+            if v_total <= self.max_size:
+                break
+
+            if v_key in p_keep:
+                continue
+
+            v_total -= v_index[v_key].get("size", 0)
+            self.remove_entry(v_index, v_key)
+            v_evicted.append(v_key)
+
+        self.save_index(v_index)
+
+        if v_total > self.max_size:
+            logger("Stage cache size " + str (v_total) + " bytes exceeds maximum " + str (self.max_size) + " bytes, entries in use are kept.")
+
+        return v_evicted
+
+# @Description:
+#   Class: TimingHistory
+#   Host local SQLite store of command durations
+#   Each command of a module run is stored with its history category
+#   (gf_get_history_category), oracle home, version, patch ID and function.
+#   The CRS/HAS stack wait after opatchauto is stored as "crs_wait".
+#   Percentiles of successful commands are used by PLAN and for timeouts.
+#   Each oracle home owner has its own file (mode 0600), the uid is added
+#   to the file name: <name>_<uid>.db
+# @Parameters:
+#   None
+# @Constructor parameters:
+#   p_history_file: SQLite database file
+# @Return:
+#   None
+# @Exception:
+#   None
+#
+class TimingHistory(object):
+
+    def __init__(self, p_history_file):
+
+        v_root, v_ext = os.path.splitext(p_history_file)
+        self.history_file = v_root + "_" + str (os.getuid()) + v_ext
+
+    # @Description:
+    #   Opens the database, the table is created on first use
+    #   The file must be owned by the current user and not accessible by others
+    # @Parameters:
+    #   None
+    # @Return:
+    #   sqlite3 connection
+    # @Exception:
+    #   sqlite3.Error
+    #
+    def connect(self):
+
+        try:
+            os.close(os.open(self.history_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600))
+        except FileExistsError:
+            pass
+
+        v_stat = os.lstat(self.history_file)
+        if not stat.S_ISREG(v_stat.st_mode) or v_stat.st_uid != os.getuid() or v_stat.st_mode & 0o077:
+            raise sqlite3.DatabaseError("History file " + self.history_file + " must be a file owned by the current user with mode 0600.")
+
+        v_connection = sqlite3.connect(self.history_file, timeout = 30)
+        v_connection.execute("create table if not exists command_history ("
+                             "recorded real, host text, oracle_home text, version integer, patch_id integer, "
+                             "function text, phase text, category text, sid text, seconds real, exit_status integer)")
+        v_connection.execute("create index if not exists command_history_i1 on command_history (category, oracle_home, version)")
+
+        return v_connection
+
+    # @Description:
+    #   Stores the command records of the current module run
+    # @Parameters:
+    #   p_commands: command timing records
+    #   p_stack_wait: CRS/HAS stack wait result, None if there was no wait
+    # @Return:
+    #   None
+    # @Exception:
+    #   sqlite3.Error
+    #
+    def save(self, p_commands, p_stack_wait = None):
+
+        v_rows = []
+        v_recorded = time.time()
+
+        for v_record in p_commands:
+            v_rows.append((v_record["phase"], gf_get_history_category(v_record), v_record["sid"],
+                           v_record["seconds"], v_record["exit_status"]))
+
+        if p_stack_wait and not p_stack_wait.get("not_online"):
+            v_rows.append((None, "crs_wait", None, p_stack_wait["seconds"], 0))
+
+        if not v_rows:
+            return
+
+        v_connection = self.connect()
+
+        try:
+            with v_connection:
+                v_connection.executemany("insert into command_history (recorded, host, oracle_home, version, patch_id, function, phase, category, sid, seconds, exit_status) "
+                                         "values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                         [(v_recorded, g_hostname, g_history_context.get("oracle_home"),
+                                           g_history_context.get("version"), g_history_context.get("patch_id"),
+                                           g_history_context.get("function")) + v_row for v_row in v_rows])
+        finally:
+            v_connection.close()
+
+    # @Description:
+    #   Returns percentiles of successful command durations
+    #   Scope is widened until there are enough samples:
+    #   oracle home and version, version, all homes
+    #   With a patch ID (timeouts), only commands of that patch are used:
+    #   oracle home and version, all homes
+    # @Parameters:
+    #   p_categories: history categories, the first one with enough samples is used
+    #   p_oracle_home: oracle home
+    #   p_version: oracle home version
+    #   p_patch_id: patch ID (optional)
+    # @Return:
+    #   Dictionary (category, scope, count, p50, p90, p99, max), None if there are not enough samples
+    # @Exception:
+    #   None
+    #
+    def get_percentiles(self, p_categories, p_oracle_home = None, p_version = None, p_patch_id = None):
+
+        if not os.path.exists(self.history_file):
+            return None
+
+        if p_patch_id:
+            v_scopes = [ ("oracle home, patch", "and oracle_home = ? and version = ? and patch_id = ?", [p_oracle_home, p_version, p_patch_id]),
+                         ("patch", "and patch_id = ?", [p_patch_id]) ]
+        else:
+            v_scopes = [ ("oracle home", "and oracle_home = ? and version = ?", [p_oracle_home, p_version]),
+                         ("version", "and version = ?", [p_version]),
+                         ("all", "", []) ]
+
+        try:
+            v_connection = self.connect()
+        except sqlite3.Error as e:
+            logger("Timing history not available: " + str (e))
+            return None
+
+        try:
+            for v_scope, v_where, v_binds in v_scopes:
+                for v_category in p_categories:
+
+                    v_seconds = [row[0] for row in v_connection.execute(
+                        "select seconds from command_history where category = ? and coalesce(exit_status, 0) = 0 " + v_where + " order by seconds",
+                        [v_category] + v_binds)]
+
+                    if len(v_seconds) >= g_history_min_samples:
+                        return { "category": v_category, "scope": v_scope, "count": len(v_seconds),
+                                 "p50": gf_percentile(v_seconds, 50), "p90": gf_percentile(v_seconds, 90),
+                                 "p99": gf_percentile(v_seconds, 99), "max": v_seconds[-1] }
+        finally:
+            v_connection.close()
+
+        return None
+
+    # @Description:
+    #   Returns percentiles of all categories of an oracle home (HISTORY function)
+    # @Parameters:
+    #   p_oracle_home: oracle home
+    #   p_version: oracle home version
+    # @Return:
+    #   Dictionary category -> percentiles (see get_percentiles)
+    # @Exception:
+    #   sqlite3.Error
+    #
+    def get_report(self, p_oracle_home, p_version):
+
+        if not os.path.exists(self.history_file):
+            return {}
+
+        v_connection = self.connect()
+
+        try:
+            v_categories = [row[0] for row in v_connection.execute("select distinct category from command_history order by 1")]
+        finally:
+            v_connection.close()
+
+        v_report = {}
+
+        for v_category in v_categories:
+            v_stats = self.get_percentiles([v_category], p_oracle_home, p_version)
+            if v_stats:
+                v_report[v_category] = v_stats
+
+        return v_report
+
+# @Description:
+#   Class: PatchProcess
+#   Class where all magic happens
+# @Parameters:
+#   None
+# @Constructor parameters:
+#   p_oracle_home: Oracle home path
+#   p_only_prereq: Indicator whether to run only prerequisites
+#   p_patch_id: Patch ID of the patch to be appled
+#   p_sw_stage: OS location of the patch binaries
+#   p_patch_only_oh: Indicator whether to patch only oracle home without applying SQL changes
+#   p_patch_ojvm: Indicator whether to apply OJVM patch
+#   p_patch_db_all: Indicator whether to patch all databases for given oracle home
+#   p_patch_db_list: If not all databases need to be patched
+#                    This list contains which databases to patch
+#   p_patch_item: Patch definition. It contains argument definitions from patch_dict.yml file
+#   p_prereq_batch: Indicator whether to run OPatch prerequisites for all sub-patches
+#                   with one OPatch call using a patch list file (-phBaseFile)
+#   p_parallel_degree: Maximum number of databases patched concurrently (datapatch)
+#   p_crs_wait: CRS/HAS readiness wait settings (timeout, initial_interval, max_interval)
+#   p_asm_client_crosscheck: Indicator whether to cross-check CRS databases with ASM clients
+#   p_patch_items: Ordered list of patch definitions applied in one OPatch session (patch stack)
+#                  The first entry is p_patch_item
+#   p_oop_home_path: New oracle home path used by out-of-place patching (PATCH_OOP)
+#   p_stage_cache: StageCache object, None if the host local stage cache is not used
+#   p_backup_loc: Location of BACKUP archives and manifests
+#   p_backup_mode: BACKUP/RESTORE mode, "incremental" or "parallel" (whole home)
+#   p_backup_parallel_degree: Number of processes of parallel BACKUP, None uses all CPUs
+#   p_restore_files: Files restored by parallel RESTORE, None restores the whole home
+#   p_patch_single_downtime: Indicator whether the role patches with PATCH_ALL (used by PLAN)
+#   p_service_parallel_degree: Maximum number of services of one oracle home stopped or started concurrently
+# @Return:
+#   None
+# @Exception:
+#   None
+#
+class PatchProcess(object):
+
+    def __init__(self, p_oracle_home, p_only_prereq,
+                       p_patch_id, p_sw_stage,
+                       p_patch_only_oh = None,
+                       p_patch_ojvm = None, p_patch_db_all = None,
+                       p_patch_db_list = None, p_patch_item = None,
+                       p_prereq_batch = False, p_parallel_degree = 1,
+                       p_crs_wait = None, p_asm_client_crosscheck = False, p_patch_items = None,
+                       p_oop_home_path = None, p_stage_cache = None, p_backup_loc = None,
+                       p_backup_mode = None, p_backup_parallel_degree = None, p_restore_files = None,
+                       p_patch_single_downtime = False, p_service_parallel_degree = 1):
+
+
+        self.oracle_home = p_oracle_home
+        self.only_prereq = p_only_prereq
+        self.patch_id    = p_patch_id
+        self.sw_stage    = p_sw_stage
+        self.patch_list  = {}
+        self.patch_item  = p_patch_item
+        self.prereq_batch = p_prereq_batch
+        self.parallel_degree = p_parallel_degree or 1
+
+        # CRS/HAS stack readiness wait after opatchauto: timeout, initial and maximum poll interval (seconds)
+        v_crs_wait = p_crs_wait or {}
+        # Timeout not set: 600 seconds, raised from the timing history
+        self.crs_wait_timeout          = v_crs_wait.get("timeout")
+        self.crs_wait_initial_interval = v_crs_wait.get("initial_interval") or 2
+        self.crs_wait_max_interval     = v_crs_wait.get("max_interval") or 30
+        self.is_crs     = False
+        self.is_cluster = False
+        self.cluster_name = None
+        self.oh_version = None
+        self.srvctl_config = None
+        self.asm_client_crosscheck = p_asm_client_crosscheck
+        self.patch_items = p_patch_items
+        self.oop_home_path = p_oop_home_path
+        self.stage_cache = p_stage_cache
+        self.backup_loc = p_backup_loc
+        self.backup_mode = p_backup_mode or "incremental"
+        self.backup_parallel_degree = p_backup_parallel_degree
+        self.restore_files = p_restore_files
+        self.patch_single_downtime = p_patch_single_downtime
+        self.service_parallel_degree = p_service_parallel_degree or 1
+
+        # Patch scope, also used by STAGE, BACKUP and PLAN when only the
+        # prerequisites are run (the scope arguments are optional then)
+        self.patch_only_oh  = bool(p_patch_only_oh)
+        self.patch_ojvm     = bool(p_patch_ojvm)
+        self.patch_db_all   = bool(p_patch_db_all)
+        self.patch_db_list  = None
+
+        # Run this block if "prerequisites" flag is false
+        # The user has chosen to apply patch
+        if not p_only_prereq:
+
+            # Check if required parameters are set to True/False
+            # If not been specified, terminate module execution
+            # One of the following parameters needs to be defined:
+            #   p_patch_only_oh: Indicator whether to patch *only* oracle home
+            #   p_patch_ojvm: Indicator whether to apply OJVM patch
+            #   p_patch_db_all: Indicator whether to patch all databases
+            if p_patch_only_oh == None or p_patch_ojvm == None or p_patch_db_all == None:
+                # Terminate module execution
+                fail_module("Specify all required arguments.")
+
+            # Check if the user has specified a list of databases to be patched
+            # The list is comma (,) separated list of databases
+            # The list can be empty (None)
+            # Strip the defined list of databases
+            if p_patch_db_list and p_patch_db_list.strip():
+                # Populate "patch_db_list" array from user defined list
+                # The list is split by comma (,)
+                self.patch_db_list  = p_patch_db_list.split(',')
+
+        # Load oracle home facts from the discovery cache
+        # If there is no valid cache entry, run the discovery and cache the facts
+        if not self.load_discovery_cache():
+
+            self.discover_oh()
+            self.save_discovery_cache()
+
+        # If oracle home version is 10 or 11 define OCM file
+        # OCM file is needed when patching 10g and 11g oracle homes
+        # OCM file from the discovery cache is reused if it still exists
+        if self.oh_version in g_supported_version_old and (g_function == "PATCH_OH" or g_function == "PATCH_OH_OJVM" or g_function == "PATCH_ALL" or g_function == "PATCH_OOP"):
+            if not os.path.isfile(g_ocmrf_file):
+                self.gen_ocm_file(p_oracle_home)
+                self.save_discovery_cache()
+
+    # @Description:
+    #   Discovers oracle home facts: inventory, CRS/cluster indicators and version
+    # @Parameters:
+    #   None
+    # @Return:
+    #   None
+    # @Exception:
+    #   None
+    #
+    def discover_oh(self):
+
+        self.set_inventory()
+
+        # Check in the inventory if the given oracle home is GI (CRS) home
+        v_home = g_inventory.get_home(self.oracle_home)
+        # If the given oracle home is GI (CRS) home, set "is_crs" to True
+        if v_home and v_home["is_crs"]:
+            self.is_crs = True
+        else:
+            # Note: 11g homes does not have CRS attribute in inventory.xml
+            # Workaround: Check for ohasd.bin existence in $ORACLE_HOME/bin dir
+            self.is_crs = os.path.isfile(self.oracle_home + "/bin/ohasd.bin")
+
+
+        #start: check if is cluster
+
+        #todo: gf_is_cluster needs to be checked/validated
+        if os.path.isfile(self.oracle_home + "/bin/cemutlo.bin"):
+            command = self.oracle_home + "/bin/cemutlo -n"
+            output = self.run_os_command(command, p_full_output = True)
+            if (output):
+                self.is_cluster = True
+                self.cluster_name = str (output)
+
+        # # Check if the given oracle home is part of a clusterware
+        # if gf_is_cluster(self.oracle_home):
+        #     # Set indicator "is_cluster" to True
+        #     self.is_cluster = True
+        #     # Get cluster name
+        #     command = self.oracle_home + "/bin/cemutlo -n"
+        #     output = self.run_os_command(command)
+        #     self.cluster_name = str (output)
+
+        #end: check if is cluster
 
 
         # Define oracle home installed version
         # 10/11/12
-        self.oh_version = self.get_oh_version(p_oracle_home)
+        self.oh_version = self.get_oh_version(self.oracle_home)
+
+    # @Description:
+    #   Returns the discovery cache file for the oracle home
+    #   Each oracle home has its own cache file in g_cache_dir
+    # @Parameters:
+    #   None
+    # @Return:
+    #   String
+    # @Exception:
+    #   None
+    #
+    def get_discovery_cache_file(self):
+
+        v_file_name = re.sub("[^A-Za-z0-9]", "_", self.oracle_home.strip("/"))
+
+        return os.path.join(g_cache_dir, "discovery_" + v_file_name + ".json")
+
+    # @Description:
+    #   Builds the discovery cache key
+    #   The key is the oracle home path and the modification times of
+    #   oraInst.loc, inventory.xml and $ORACLE_HOME/lib
+    # @Parameters:
+    #   p_inventory_file: inventory.xml file path
+    # @Return:
+    #   Dictionary
+    # @Exception:
+    #   None
+    #
+    def get_discovery_cache_key(self, p_inventory_file):
+
+        v_orainst_file = self.oracle_home + "/oraInst.loc"
+
+        if not os.path.isfile(v_orainst_file):
+            v_orainst_file = "/etc/oraInst.loc"
+
+        return { "oracle_home": self.oracle_home,
+                 "orainst_file": v_orainst_file,
+                 "orainst_mtime": gf_get_mtime(v_orainst_file),
+                 "inventory_file": p_inventory_file,
+                 "inventory_mtime": gf_get_mtime(p_inventory_file),
+                 "lib_mtime": gf_get_mtime(self.oracle_home + "/lib") }
+
+    # @Description:
+    #   Loads oracle home facts from the discovery cache
+    #   The cache entry is valid only if its key matches the current key
+    # @Parameters:
+    #   None
+    # @Return:
+    #   Boolean: True if the facts were loaded from the cache
+    # @Exception:
+    #   None
+    #
+    def load_discovery_cache(self):
+
+        global g_inventory_file
+        global g_ocmrf_file
+
+        v_cache_file = self.get_discovery_cache_file()
+
+        if not os.path.isfile(v_cache_file):
+            return False
+
+        try:
+
+            with open(v_cache_file, "r") as f:
+                if os.fstat(f.fileno()).st_uid != os.getuid():
+                    logger("Discovery cache [" + v_cache_file + "] is not owned by the current user, ignored.")
+                    return False
+                v_cache = json.load(f)
+
+            v_key = v_cache["key"]
+            v_facts = v_cache["facts"]
+
+            if v_key != self.get_discovery_cache_key(v_key["inventory_file"]):
+                logger("Discovery cache for [" + self.oracle_home + "] is stale.")
+                return False
+
+            g_inventory_file = v_facts["inventory_file"]
+            self.is_crs       = v_facts["is_crs"]
+            self.is_cluster   = v_facts["is_cluster"]
+            self.cluster_name = v_facts["cluster_name"]
+            self.oh_version   = v_facts["oh_version"]
+
+            if v_facts["ocmrf_file"] and os.path.isfile(v_facts["ocmrf_file"]):
+                g_ocmrf_file = v_facts["ocmrf_file"]
+
+        except (IOError, OSError, ValueError, KeyError, TypeError) as e:
+            logger("Could not read discovery cache [" + v_cache_file + "]: " + str (e))
+            return False
+
+        logger("Oracle home facts for [" + self.oracle_home + "] loaded from discovery cache.")
+
+        return True
+
+    # @Description:
+    #   Saves oracle home facts to the discovery cache
+    #   Failure to save the cache is logged, but does not fail the module
+    # @Parameters:
+    #   None
+    # @Return:
+    #   None
+    # @Exception:
+    #   None
+    #
+    def save_discovery_cache(self):
+
+        v_cache_file = self.get_discovery_cache_file()
+
+        v_ocmrf_file = None
+        if os.path.isfile(g_ocmrf_file):
+            v_ocmrf_file = g_ocmrf_file
+
+        v_cache = { "key": self.get_discovery_cache_key(g_inventory_file),
+                    "facts": { "inventory_file": g_inventory_file,
+                               "is_crs": self.is_crs,
+                               "is_cluster": self.is_cluster,
+                               "cluster_name": self.cluster_name,
+                               "oh_version": self.oh_version,
+                               "ocmrf_file": v_ocmrf_file } }
+
+        try:
+
+            if not os.path.lexists(g_cache_dir):
+                os.mkdir(g_cache_dir, 0o700)
+
+            v_stat = os.lstat(g_cache_dir)
+            if not stat.S_ISDIR(v_stat.st_mode) or v_stat.st_uid != os.getuid() or v_stat.st_mode & 0o077:
+                logger("Discovery cache directory [" + g_cache_dir + "] is not a private directory of the current user, cache not saved.")
+                return
+
+            v_tmp_file = v_cache_file + "." + str (os.getpid())
+
+            with open(v_tmp_file, "w") as f:
+                json.dump(v_cache, f)
+
+            os.rename(v_tmp_file, v_cache_file)
+
+        except (IOError, OSError) as e:
+            logger("Could not write discovery cache [" + v_cache_file + "]: " + str (e))
+
+    # @Description:
+    #   Identifies and sets OH inventory file
+    # @Parameters:
+    #   None
+    # @Return:
+    #   None
+    # @Exception:
+    #   None
+    #
+    def set_inventory(self):
+        global g_inventory_file
+        global g_inventory
+
+        g_inventory = InventoryReader(self.oracle_home)
+
+        logger("Inventory location [inventory_loc]: " + g_inventory.inventory_loc)
+        g_inventory_file = g_inventory.inventory_file
+
+    # @Description:
+    #   Generates OCM file required for OPatch
+    # @Parameters:
+    #   p_oracle_home: oracle home for which to generate OCM file
+    # @Return:
+    #   None
+    # @Exception:
+    #   None
+    #
+    def gen_ocm_file(self, p_oracle_home):
+        global g_ocmrf_file
+        global g_expected_list
+
+        # Set environment variables
+        self.set_env(p_oracle_home)
+
+        # Prepare the command to generate OCM file
+        v_command = p_oracle_home + "/OPatch/ocm/bin/emocmrsp -no_banner -output " + g_ocmrf_file
+        self.run_os_command(v_command, p_expect = True)
+
+    # @Description:
+    #   Generates OCM file required for OPatch
+    # @Parameters:
+    #   p_oracle_home: oracle home for which to generate OCM file
+    # @Return:
+    #   int
+    # @Exception:
+    #   None
+    #
+    #todo: check for version > 12
+    def get_oh_version(self, p_oracle_home):
+
+        # Get oracle installed version from $ORACLE_HOME/lib
+        # Current check is based on libcell library
+        # The library name contains version number
+        # Examples:
+        #   10g: libcell10.so
+        #   11g: libcell11.so
+        #   12c: libcell12.so
+        v_result = None
+
+        try:
+            for v_entry in os.scandir(p_oracle_home + "/lib"):
+                v_match = re.match(r"libcell(\d\d)\.so$", v_entry.name)
+                if v_match:
+                    v_result = max(v_result or 0, int(v_match.group(1)))
+        except OSError as e:
+            logger("Could not read " + p_oracle_home + "/lib: " + str (e))
+
+        if (v_result):
+            return int(v_result)
+
+        else:
+            logger("Could not determine Oracle version.")
+            fail_module("Could not determine Oracle version.")
+
+    # @Description:
+    #   Sets oracle environment
+    # @Parameters:
+    #   p_ora_home: oracle home for which to ORACLE_HOME environment
+    # @Return:
+    #   None
+    # @Exception:
+    #   None
+    #
+    def set_env(self, p_ora_home):
+
+        logger("ORACLE_HOME set to to '" + p_ora_home + "'")
+        os.environ["ORACLE_HOME"] = p_ora_home
+
+    # @Description:
+    #   This function creates an object from PatchFactory
+    #   The object contains details for the patch to be installed
+    # @Parameters:
+    #   None
+    # @Return:
+    #   None
+    # @Exception:
+    #   Module failure
+    #
+    def build_patch_dict(self):
+
+        #global patch_list
+        v_patch_temp = None
+
+        for v_patch_item in (self.patch_items or [self.patch_item]):
+
+            p_patch_id              = v_patch_item["patch_id"]
+            p_patch_proactive_bp_id = v_patch_item["patch_proactive_bp_id"]
+            p_patch_gi_id           = v_patch_item["patch_gi_id"]
+            p_patch_db_id           = v_patch_item["patch_db_id"]
+            p_patch_ocw_id          = v_patch_item["patch_ocw_id"]
+            p_patch_ojvm_id         = v_patch_item["patch_ojvm_id"]
+            p_patch_dir             = v_patch_item["patch_dir"]
+            p_file                  = v_patch_item["file"]
+            p_only_oh               = gf_to_bool(v_patch_item["only_oh"])
+            p_desc                  = v_patch_item["desc"]
+            p_patch_acfs_id         = v_patch_item["patch_acfs_id"]
+            p_patch_dbwlm_id        = v_patch_item["patch_dbwlm_id"]
+            p_sha256                = v_patch_item.get("sha256")
+
+            v_patch_temp = PatchFactory(p_patch_id, p_patch_proactive_bp_id,
+                                      p_patch_gi_id, p_patch_db_id, p_patch_ocw_id,
+                                      p_patch_ojvm_id, p_patch_acfs_id,
+                                      p_patch_dbwlm_id, p_patch_dir,
+                                      p_file, p_only_oh, p_desc, p_sha256)
+
+            self.patch_list[p_patch_id] = v_patch_temp
+
+            # If patch is not found throw fail message
+            if not v_patch_temp:
+
+                fail_module("Patch " + str (p_patch_id) + " not found!")
+
+        if len(self.patch_list) > 1:
+            logger("Patch stack: " + ", ".join(str (patch) for patch in self.patch_list))
+
+    # @Description:
+    #   Function to return OJVM patch IDs of the patch stack
+    # @Parameters:
+    #   None
+    # @Return:
+    #   List of OJVM patch IDs
+    # @Exception:
+    #   None
+    #
+    def get_ojvm_patch_ids(self):
+
+        return [self.patch_list[patch].patch_ojvm_id for patch in self.patch_list if self.patch_list[patch].patch_ojvm_id]
+
+    # @Description:
+    #   Function to check whether all patches of the patch stack are only for OH without SQL changes
+    # @Parameters:
+    #   None
+    # @Return:
+    #   Boolean
+    # @Exception:
+    #   None
+    #
+    def is_only_oh(self):
+
+        return all(self.patch_list[patch].only_oh for patch in self.patch_list)
+
+    # @Description:
+    #   Function to execute OS command
+    # @Parameters:
+    #   p_command: command to be executed
+    #   p_expect: indicator whether the command requires user input
+    #             In case of an user input, the questions are matched 
+    #             against g_expect_list provided answers
+    #   p_patterns: additional patterns of lines kept in the output
+    #   p_full_output: indicator whether to return the full output
+    #                  Must be set if the output is parsed, otherwise only the
+    #                  last g_output_tail_lines lines and lines matching the
+    #                  patterns are returned (enough to log and check patterns)
+    #   p_return_status: indicator whether to return the exit status as well
+    # @Return:
+    #   Command output/result
+    #   Tuple of command output and exit status if p_return_status is set
+    # @Exception:
+    #   Module failure
+    #
+    def run_os_command(self, p_command, p_expect = False, p_patterns = None, p_full_output = False, p_return_status = False):
+
+        v_error = None
+        v_output = CommandOutput(p_patterns, p_full_output = p_full_output)
+        global g_expected_list
+
+        logger("command: " + p_command)
+
+        if g_debug:
+            logger("---------------------------", True)
+            logger("output:", False)
+
+        v_start = time.monotonic()
+
+        if p_expect:
+
+            v_error = self.stream_expect_command(p_command, v_output)
+            v_exit_status = v_error
+
+        else:
+
+            v_error, v_exit_status = self.stream_os_command(p_command, v_output)
+
+        gf_add_timing("commands", { "command": p_command,
+                                    "category": gf_get_command_category(p_command),
+                                    "seconds": round(time.monotonic() - v_start, 3),
+                                    "exit_status": v_exit_status,
+                                    "phase": g_log_phase,
+                                    "sid": getattr(g_logger_local, "sid", None) })
+
+        if g_debug:
+            logger("---------------------------", True)
+
+        if v_output.get_dropped_lines():
+            logger("Output truncated, " + str (v_output.get_dropped_lines()) + " of " + str (v_output.line_count) + " lines not kept.")
+
+        v_output = v_output.get_output()
+
+        try:
+            v_error = v_error.get_output()
+        except AttributeError:
+            # if "v_error" is an exit status
+            pass
+
+        # 1. If there is an error terminate the module execution.
+        # (and) 2. If the error is reported for "OPatch Session completed with warnings" don't terminate the module execution.
+        if v_error and re.search(g_sw_opatch_check_pattern2,str (v_error)) is None:
+
+            if g_debug:
+                logger("subprocess error: " + str (v_error))
+
+            fail_module(v_error)
+
+        elif p_return_status:
+
+            return str (v_output), v_exit_status
+
+        else:
+
+            return str (v_output)
+
+    # @Description:
+    #   Function to execute OS command through the shell and stream its output
+    #   stdout is read line by line, stderr is read by a separate thread
+    # @Parameters:
+    #   p_command: command to be executed
+    #   p_output: CommandOutput object which collects stdout
+    # @Return:
+    #   Tuple of CommandOutput object with stderr and exit status
+    # @Exception:
+    #   None
+    #
+    def stream_os_command(self, p_command, p_output):
+
+        v_error = CommandOutput(p_log = False)
+
+        process = subprocess.Popen(p_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
+
+        v_stderr_reader = threading.Thread(target = v_error.read_stream, args = (process.stderr,))
+        v_stderr_reader.daemon = True
+        v_stderr_reader.start()
+
+        p_output.read_stream(process.stdout)
+
+        process.wait()
+        v_stderr_reader.join()
+
+        return v_error, process.returncode
+
+    # @Description:
+    #   Function to execute OS command through pexpect and stream its output
+    #   Questions are matched against g_expected_list and answered
+    # @Parameters:
+    #   p_command: command to be executed
+    #   p_output: CommandOutput object which collects the output
+    # @Return:
+    #   Exit status
+    # @Exception:
+    #   Module failure if the command does not complete within the timeout
+    #
+    def stream_expect_command(self, p_command, p_output):
+
+        # 60 minutes, unless the history of the command category gives a timeout
+        v_category = gf_get_command_category(p_command)
+        timeout = gf_get_history_timeout(gf_get_history_category({ "command": p_command, "category": v_category }), 3600)
+
+        v_questions = list(g_expected_list.keys())
+
+        child = pexpect.spawn(p_command, timeout = timeout, encoding = "utf-8", codec_errors = "replace")
+
+        # Questions first, then end of line and end of output
+        v_pattern_list = child.compile_pattern_list(v_questions + ["\r?\n", pexpect.EOF])
+
+        while True:
+
+            try:
+                v_index = child.expect_list(v_pattern_list)
+            except pexpect.TIMEOUT:
+                if child.before:
+                    p_output.add_line(child.before)
+                child.close(force = True)
+                fail_module("Command (" + str (v_category) + ") did not complete within " + str (timeout) + " seconds: " + p_command
+                            + "\nOutput:\n" + p_output.get_output())
+
+            if v_index == len(v_questions):
+
+                p_output.add_line(child.before)
+
+            elif v_index == len(v_questions) + 1:
+
+                if child.before:
+                    p_output.add_line(child.before)
+                break
+
+            else:
+
+                p_output.add_line(child.before + child.after)
+                child.send(g_expected_list[v_questions[v_index]])
+
+        child.close()
+
+        if child.exitstatus is None:
+            return child.signalstatus
+
+        return child.exitstatus
+
+    # @Description:
+    #   Function to check OPatch required version
+    #   It checks OPatch required version for all patches
+    # @Parameters:
+    #   None
+    # @Return:
+    #   None
+    # @Exception:
+    #   Module failure if OPatch version check fails
+    #
+    def check_opatch_min_version(self):
+
+        global g_sw_opatch_min_version
+
+        v_oracle_home   = str (self.oracle_home)
+        v_sw_stage      = str (self.sw_stage)
+
+        # Batch mode: check all patches with one OPatch call
+        if self.prereq_batch:
+
+            logger("Check minumum OPatch version for OH: " + self.oracle_home)
+
+            v_dirs = [self.get_min_version_dir(self.patch_list[patch]) for patch in self.patch_list]
+            v_patch_list_file = self.write_patch_list_file(v_dirs)
+
+            try:
+                output = self.run_os_command(v_oracle_home + "/OPatch/opatch prereq CheckMinimumOPatchVersion -phBaseFile " + v_patch_list_file)
+            finally:
+                os.remove(v_patch_list_file)
+
+            if re.search(g_sw_opatch_min_version,output) is None:
+
+                p_message = "CheckMinimumOPatchVersion failed for " + self.oracle_home
+                fail_module(p_message)
+
+            return
+
+        for patch in self.patch_list:
+
+            v_patch_obj = self.patch_list[patch]
+
+            logger("Check minumum OPatch version for OH: " + self.oracle_home)
+
+            v_command = v_oracle_home + "/OPatch/opatch prereq CheckMinimumOPatchVersion -phBaseDir " + v_sw_stage + "/" + self.get_min_version_dir(v_patch_obj)
+
+            output = self.run_os_command(v_command)
+
+            if re.search(g_sw_opatch_min_version,output) is None:
+
+                p_message = "CheckMinimumOPatchVersion failed for " + self.oracle_home
+                fail_module(p_message)
+
+    # @Description:
+    #   Function to return the patch directory used for OPatch minimum version check
+    #   The directory is relative to the patch stage location
+    # @Parameters:
+    #   p_patch_obj: patch object
+    # @Return:
+    #   String
+    # @Exception:
+    #   None
+    #
+    def get_min_version_dir(self, p_patch_obj):
+
+        v_dir = p_patch_obj.patch_dir
+
+        if p_patch_obj.is_combo:
+            if p_patch_obj.patch_proactive_bp_id:
+                v_dir += "/" + str (p_patch_obj.patch_proactive_bp_id) + "/" + str (p_patch_obj.patch_db_id)
+            elif p_patch_obj.patch_gi_id:
+                v_dir += "/" + str (p_patch_obj.patch_gi_id) + "/" + str (p_patch_obj.patch_db_id)
+
+        return v_dir
+
+    # @Description:
+    #   Function to write a patch list file for OPatch "-phBaseFile" option
+    #   The file contains one patch directory per line
+    # @Parameters:
+    #   p_dirs: list of patch directories relative to the patch stage location
+    # @Return:
+    #   Patch list file path. The caller removes the file.
+    # @Exception:
+    #   None
+    #
+    def write_patch_list_file(self, p_dirs):
+
+        v_fd, v_patch_list_file = tempfile.mkstemp(prefix = "orapatch_phbase_", suffix = ".txt")
+
+        with os.fdopen(v_fd, "w") as f:
+            for v_dir in p_dirs:
+                f.write(str (self.sw_stage) + "/" + v_dir + "\n")
+
+        logger("Patch list file " + v_patch_list_file + ": " + ", ".join(p_dirs))
+
+        return v_patch_list_file
+
+    # @Description:
+    #   Function to check patch conflicts against oracle home
+    # @Parameters:
+    #   None
+    # @Return:
+    #   Command output/result
+    # @Exception:
+    #   Module failure if OPatch version check fails
+    #
+    def check_conflict_against_oh(self):
+
+        global g_sw_opatch_check_conflict_pattern
+        global g_sw_opatch_spacecheck_pattern
+
+        v_oracle_home   = str (self.oracle_home)
+        v_sw_stage      = str (self.sw_stage)
+
+        # Whole stack applied by opatch napply, also one-off and non-combo patches
+        # A single patch has nothing to conflict with inside the stack
+        if not self.is_crs and len(self.patch_list) > 1:
+            self.check_conflict_stack()
+
+        # Batch mode: check all sub-patches with one OPatch call per check
+        if self.prereq_batch:
+            self.check_conflict_against_oh_batch()
+            return
+
+        for patch in self.patch_list:
+
+            v_patch_obj = self.patch_list[patch]
+
+            logger("Check conflict for patch: " + v_patch_obj.desc)
+
+            v_command_list = {}
+
+            v_base_path_conflict = v_oracle_home + "/OPatch/opatch prereq CheckConflictAgainstOHWithDetail -phBaseDir " + v_sw_stage + "/"
+            v_base_path_space = v_oracle_home + "/OPatch/opatch prereq CheckSystemSpace -phBaseDir " + v_sw_stage + "/"
+
+            v_sub_patch_dirs = self.get_sub_patch_dirs(v_patch_obj)
+
+            for v_component in v_sub_patch_dirs:
+                v_command_list["conflict_" + v_component] = v_base_path_conflict + v_sub_patch_dirs[v_component]
+                v_command_list["space_" + v_component] = v_base_path_space + v_sub_patch_dirs[v_component]
+
+            # Each prereq command starts its own JVM, run them concurrently
+            v_tasks = {}
+            for command in v_command_list:
+                v_tasks[command] = functools.partial(self.run_os_command, v_command_list[command])
+
+            v_results = gf_run_concurrently(v_tasks, g_prereq_parallel_degree)
+
+            v_prereq_checks = {}
+            v_fail_message = None
+
+            for command in v_command_list:
+
+                output, v_error = v_results[command]
+                v_check, v_component = command.split("_", 1)
+                v_status = "passed"
+
+                if v_error:
+
+                    v_status = "failed"
+                    v_message = "Prereq command failed for " + self.oracle_home + ": " + v_error
+
+                elif v_check == "conflict" and re.search(g_sw_opatch_check_conflict_pattern,output) is None:
+
+                    v_status = "failed"
+                    v_message = "CheckConflictAgainstOHWithDetail failed for " + self.oracle_home
+
+                elif v_check == "space" and re.search(g_sw_opatch_spacecheck_pattern,output) is None:
+
+                    v_status = "failed"
+                    v_message = "CheckSystemSpace failed for " + self.oracle_home
+
+                logger("Prereq " + v_check + " for sub-patch " + v_sub_patch_dirs[v_component] + ": " + v_status)
+                v_prereq_checks.setdefault(v_component, {})[v_check] = v_status
+
+                if v_status == "failed" and not v_fail_message:
+                    v_fail_message = v_message + " (sub-patch " + v_sub_patch_dirs[v_component] + ")"
+
+            g_output.setdefault("prereq_checks", {})[str (v_patch_obj.patch_id)] = v_prereq_checks
+
+            if v_fail_message:
+                fail_module(v_fail_message)
+
+    # @Description:
+    #   Function to check the patch stack of a DB oracle home for conflicts
+    #   The directories applied by PATCH_OH (and PATCH_OH_OJVM) are written to
+    #   a patch list file and checked with CheckConflictAmongPatchesWithDetail
+    #   and CheckConflictAgainstOHWithDetail
+    # @Parameters:
+    #   None
+    # @Return:
+    #   None
+    # @Exception:
+    #   Module failure if any of the checks fails
+    #
+    def check_conflict_stack(self):
+
+        v_patch_dirs = [self.get_db_oh_patch_dir(self.patch_list[item]) for item in self.patch_list]
+
+        if self.patch_ojvm:
+            v_patch_dirs += self.get_ojvm_patch_dirs()
+
+        v_patch_dirs = list(collections.OrderedDict.fromkeys(v_patch_dirs))
+
+        logger("Check conflicts for patch stack: " + ", ".join(v_patch_dirs))
+
+        v_patch_list_file = self.write_patch_list_file(v_patch_dirs)
+
+        v_checks = { "conflict_among": ("CheckConflictAmongPatchesWithDetail", g_sw_opatch_check_conflict_among_pattern),
+                     "conflict": ("CheckConflictAgainstOHWithDetail", g_sw_opatch_check_conflict_pattern) }
+
+        v_tasks = {}
+        for v_check in v_checks:
+            v_tasks[v_check] = functools.partial(self.run_os_command, self.oracle_home + "/OPatch/opatch prereq " + v_checks[v_check][0] + " -phBaseFile " + v_patch_list_file)
+
+        try:
+            v_results = gf_run_concurrently(v_tasks, len(v_tasks))
+        finally:
+            os.remove(v_patch_list_file)
+
+        v_fail_message = None
+
+        for v_check in v_checks:
+
+            output, v_error = v_results[v_check]
+            v_status = "passed"
+
+            if v_error or re.search(v_checks[v_check][1], output) is None:
+
+                v_status = "failed"
+
+                if not v_fail_message:
+                    v_fail_message = v_checks[v_check][0] + " failed for patch stack of " + self.oracle_home + (": " + v_error if v_error else "")
+
+            logger("Prereq " + v_check + " for patch stack: " + v_status)
+            g_output.setdefault("prereq_checks", {}).setdefault("stack", {})[v_check] = v_status
+
+        if v_fail_message:
+            fail_module(v_fail_message)
+
+    # @Description:
+    #   Function to check patch conflicts against oracle home in batch mode
+    #   All sub-patches are written to a patch list file and checked with
+    #   one CheckConflictAgainstOHWithDetail and one CheckSystemSpace call
+    #   The output is mapped back to each sub-patch
+    # @Parameters:
+    #   None
+    # @Return:
+    #   None
+    # @Exception:
+    #   Module failure if any of the checks fails
+    #
+    def check_conflict_against_oh_batch(self):
+
+        v_oracle_home = str (self.oracle_home)
+        v_sub_patches = {}
+
+        for patch in self.patch_list:
+
+            v_patch_obj = self.patch_list[patch]
+
+            logger("Check conflict for patch: " + v_patch_obj.desc)
+
+            v_sub_patch_dirs = self.get_sub_patch_dirs(v_patch_obj)
+
+            for v_component in v_sub_patch_dirs:
+                v_sub_patches[v_sub_patch_dirs[v_component]] = (str (v_patch_obj.patch_id), v_component)
+
+        if not v_sub_patches:
+            return
+
+        v_patch_list_file = self.write_patch_list_file(list(v_sub_patches))
+
+        v_checks = { "conflict": ("CheckConflictAgainstOHWithDetail", g_sw_opatch_check_conflict_pattern),
+                     "space": ("CheckSystemSpace", g_sw_opatch_spacecheck_pattern) }
+
+        # The per-patch summary is parsed, it can be followed by long conflict details
+        v_tasks = {}
+        for v_check in v_checks:
+            v_tasks[v_check] = functools.partial(self.run_os_command, v_oracle_home + "/OPatch/opatch prereq " + v_checks[v_check][0] + " -phBaseFile " + v_patch_list_file,
+                                                 p_full_output = True)
+
+        try:
+            v_results = gf_run_concurrently(v_tasks, len(v_tasks))
+        finally:
+            os.remove(v_patch_list_file)
+
+        v_fail_message = None
+
+        for v_check in v_checks:
+
+            output, v_error = v_results[v_check]
+            v_failed_dirs = []
+
+            if v_error or re.search(v_checks[v_check][1], output) is None:
+
+                # Failed sub-patches are taken from the per-patch result of the check
+                # If none can be identified (e.g. CheckSystemSpace), all sub-patches are reported as failed
+                v_patch_results = gf_parse_prereq_patch_results(str (output or ""))
+                v_failed_dirs = [v_dir for v_dir in v_sub_patches if v_patch_results.get(v_dir.split("/")[-1]) == "failed"]
+
+                if not v_failed_dirs:
+                    v_failed_dirs = list(v_sub_patches)
+
+                if not v_fail_message:
+                    v_fail_message = v_checks[v_check][0] + " failed for " + self.oracle_home + " (sub-patch " + ", ".join(v_failed_dirs) + ")"
+                    if v_error:
+                        v_fail_message += ": " + v_error
+
+            for v_dir in v_sub_patches:
+
+                v_patch_id, v_component = v_sub_patches[v_dir]
+                v_status = "failed" if v_dir in v_failed_dirs else "passed"
+
+                logger("Prereq " + v_check + " for sub-patch " + v_dir + ": " + v_status)
+                g_output.setdefault("prereq_checks", {}).setdefault(v_patch_id, {}).setdefault(v_component, {})[v_check] = v_status
+
+        if v_fail_message:
+            fail_module(v_fail_message)
+
+    # @Description:
+    #   Function to return sub-patch directories of a patch
+    #   Directories are relative to the patch stage location
+    # @Parameters:
+    #   p_patch_obj: patch object
+    # @Return:
+    #   Dictionary of component (db, ocw, dbwlm, acfs) -> sub-patch directory
+    # @Exception:
+    #   None
+    #
+    def get_sub_patch_dirs(self, p_patch_obj):
+
+        v_sub_patch_dirs = {}
+
+        if p_patch_obj.is_combo:
+
+            v_base_path = p_patch_obj.patch_dir
+
+            if p_patch_obj.patch_proactive_bp_id:
+                v_base_path += "/" + str (p_patch_obj.patch_proactive_bp_id)
+            elif p_patch_obj.patch_gi_id:
+                v_base_path += "/" + str (p_patch_obj.patch_gi_id)
+
+            if p_patch_obj.patch_db_id:
+                v_sub_patch_dirs["db"] = v_base_path + "/" + str (p_patch_obj.patch_db_id)
+
+            if p_patch_obj.patch_ocw_id:
+                v_sub_patch_dirs["ocw"] = v_base_path + "/" + str (p_patch_obj.patch_ocw_id)
+
+            if p_patch_obj.patch_dbwlm_id:
+                v_sub_patch_dirs["dbwlm"] = v_base_path + "/" + str (p_patch_obj.patch_dbwlm_id)
+
+            if p_patch_obj.patch_acfs_id:
+                v_sub_patch_dirs["acfs"] = v_base_path + "/" + str (p_patch_obj.patch_acfs_id)
+
+        return v_sub_patch_dirs
+
+    # @Description:
+    #   Function to stage patches from their zip files (PatchFactory.file) into the
+    #   host local stage cache. The shared stage (swlib_path) is only read, hosts
+    #   patched in parallel would otherwise write the same files.
+    #   Only the sub-patches used by this home are extracted:
+    #     - GI home: everything except the OJVM sub-patch
+    #     - DB home: DB sub-patch, sub-patches checked by prerequisites and OJVM (if patch_ojvm)
+    #   The zip root directory is expected to be the patch directory (patch_dir)
+    # @Parameters:
+    #   None
+    # @Return:
+    #   None
+    # @Exception:
+    #   Module failure if the stage cache is not defined or the zip file is not found
+    #
+    def stage_patches(self):
+
+        if not self.stage_cache:
+            fail_module("STAGE extracts patches into the host local stage cache, stage_cache_dir is not defined.")
+
+        v_sw_stage = str (self.sw_stage)
+        v_stage_result = g_output.setdefault("stage", {})
+
+        for item in self.patch_list:
+
+            v_patch_obj = self.patch_list[item]
+
+            if not v_patch_obj.file:
+                logger("Patch " + str (v_patch_obj.patch_id) + " has no zip file defined, skip staging.")
+                continue
+
+            v_zip_file = v_sw_stage + "/" + v_patch_obj.file
+
+            if not os.path.isfile(v_zip_file):
+                fail_module("Patch zip file " + v_zip_file + " not found.")
+
+            v_prefixes = set()
+
+            if not v_patch_obj.is_combo:
+
+                v_prefixes.add(v_patch_obj.patch_dir)
+
+            elif self.is_crs:
+
+                # Sub-patch directories directly under patch_dir (it can have several components)
+                v_patch_dir = v_patch_obj.patch_dir.strip("/") + "/"
+                v_ojvm_dir = v_patch_dir + str (v_patch_obj.patch_ojvm_id) + "/"
+
+                with zipfile.ZipFile(v_zip_file) as v_zip:
+                    for v_name in v_zip.namelist():
+                        if not v_name.startswith(v_patch_dir) or v_name.startswith(v_ojvm_dir):
+                            continue
+                        v_dir = v_name[len(v_patch_dir):].strip("/").split("/")
+                        if len(v_dir) > 1:
+                            v_prefixes.add(v_patch_dir + v_dir[0])
+
+            else:
+
+                v_prefixes.add(self.get_db_oh_patch_dir(v_patch_obj))
+                v_prefixes.add(self.get_min_version_dir(v_patch_obj))
+                v_prefixes.update(self.get_sub_patch_dirs(v_patch_obj).values())
+
+                if self.patch_ojvm and v_patch_obj.patch_ojvm_id:
+                    v_prefixes.add(v_patch_obj.patch_dir + "/" + str (v_patch_obj.patch_ojvm_id))
+
+            self.stage_cache.lock()
+
+            try:
+
+                v_key, v_local_zip, v_digest = self.stage_cache.add_zip(v_zip_file, v_patch_obj.sha256)
+
+                logger("Stage " + v_local_zip + ": " + ", ".join(sorted(v_prefixes)))
+
+                v_result = gf_extract_zip_members(v_local_zip, v_prefixes, self.stage_cache.stage_dir)
+
+                self.stage_cache.update_entry(v_key, v_prefixes)
+
+                v_result["sha256"] = v_digest
+                v_result["evicted"] = self.stage_cache.evict([v_key])
+
+            finally:
+                self.stage_cache.unlock()
+
+            logger("Staged " + str (v_result["members"]) + " member(s), " + str (v_result["bytes"]) + " bytes, "
+                   + str (v_result["skipped"]) + " member(s) already staged.")
+
+            v_stage_result[str (v_patch_obj.patch_id)] = dict(v_result, zip = v_zip_file, dirs = sorted(v_prefixes))
+
+    # @Description:
+    #   Function to return the directories of the stage applied to this home
+    # @Parameters:
+    #   None
+    # @Return:
+    #   List of directories (relative to the stage)
+    # @Exception:
+    #   None
+    #
+    def get_applied_patch_dirs(self):
+
+        v_dirs = []
+
+        for item in self.patch_list:
+
+            v_patch_obj = self.patch_list[item]
+
+            if self.is_crs:
+                v_dirs += list(self.get_sub_patch_dirs(v_patch_obj).values()) or [v_patch_obj.patch_dir]
+            else:
+                v_dirs.append(self.get_db_oh_patch_dir(v_patch_obj))
+
+                if self.patch_ojvm and v_patch_obj.patch_ojvm_id:
+                    v_dirs.append(v_patch_obj.patch_dir + "/" + str (v_patch_obj.patch_ojvm_id))
+
+        return v_dirs
+
+    # @Description:
+    #   Function to back up only the oracle home files the patches will modify
+    #   Files are read from etc/config/actions.xml and etc/config/inventory.xml
+    #   of every (sub-)patch in the stage. The home inventory and the central
+    #   inventory.xml are always backed up.
+    #   A tar archive and a JSON manifest are written to the backup location.
+    #   The manifest lists backed up files and files the patches will create,
+    #   RESTORE uses it to restore the home.
+    # @Parameters:
+    #   None
+    # @Return:
+    #   None
+    # @Exception:
+    #   Module failure if the backup location is not defined or no patch metadata is found
+    #
+    def backup_oh(self):
+
+        if not self.backup_loc:
+            fail_module("Backup location (backup_loc) is not defined.")
+
+        v_sw_stage = str (self.sw_stage)
+        v_files = set()
+        v_metadata_files = []
+
+        for v_dir in self.get_applied_patch_dirs():
+            for v_root, v_dirs, v_names in os.walk(v_sw_stage + "/" + v_dir):
+                if v_root.endswith("/etc/config"):
+                    for v_name in ("actions.xml", "inventory.xml"):
+                        if v_name in v_names:
+                            v_metadata_files.append(v_root + "/" + v_name)
+                            v_files |= gf_get_patch_files(v_root + "/" + v_name, self.oracle_home)
+
+        if not v_metadata_files:
+            fail_module("No patch metadata (etc/config/actions.xml) found in " + v_sw_stage)
+
+        logger("Patch metadata files: " + ", ".join(v_metadata_files))
+
+        v_manifest = { "oracle_home": self.oracle_home,
+                       "patches": [str (patch) for patch in self.patch_list],
+                       "created": gf_gettime(),
+                       "files": [],
+                       "new_files": [],
+                       "unreadable": [] }
+
+        v_backup_name = self.backup_loc + "/" + self.get_backup_prefix("backup") + gf_gettime()
+        v_manifest["archive"] = v_backup_name + ".tar.gz"
+
+        v_size = 0
+
+        with tarfile.open(v_manifest["archive"], "w:gz") as v_tar:
+
+            for v_file in sorted(v_files):
+
+                v_path = self.oracle_home + "/" + v_file
+
+                if not os.path.lexists(v_path):
+                    v_manifest["new_files"].append(v_file)
+                    continue
+
+                if not os.access(v_path, os.R_OK):
+                    v_manifest["unreadable"].append(v_file)
+                    continue
+
+                v_tar.add(v_path, arcname = v_file)
+                v_manifest["files"].append(v_file)
+                v_size += os.lstat(v_path).st_size
+
+            # Home inventory, it is replaced as a whole on restore
+            if os.path.isdir(self.oracle_home + "/inventory"):
+                v_tar.add(self.oracle_home + "/inventory", arcname = "inventory")
+                v_manifest["files"].append("inventory")
+
+            # Central inventory is saved next to the archive
+            if g_inventory_file and os.path.isfile(g_inventory_file):
+                shutil.copy2(g_inventory_file, v_backup_name + ".inventory.xml")
+                v_manifest["central_inventory"] = { "file": g_inventory_file, "backup": v_backup_name + ".inventory.xml" }
+
+        with open(v_backup_name + ".json", "w") as f:
+            json.dump(v_manifest, f, indent = 1)
+
+        if v_manifest["unreadable"]:
+            logger("Files not readable (not backed up): " + ", ".join(v_manifest["unreadable"]))
+
+        logger("Backed up " + str (len(v_manifest["files"])) + " file(s) (" + str (v_size) + " bytes, inventory included) to " + v_manifest["archive"])
+        logger("Manifest: " + v_backup_name + ".json")
+
+        g_output["backup"] = { "archive": v_manifest["archive"], "manifest": v_backup_name + ".json",
+                               "files": len(v_manifest["files"]), "new_files": len(v_manifest["new_files"]),
+                               "unreadable": len(v_manifest["unreadable"]), "bytes": v_size }
+
+    # @Description:
+    #   Function to return the backup file name prefix of the oracle home
+    #   The prefix holds the home directory name and a hash of the full path,
+    #   so homes with the same directory name (e.g. dbhome_1) do not collide
+    # @Parameters:
+    #   p_type: backup type (backup, full)
+    # @Return:
+    #   File name prefix
+    # @Exception:
+    #   None
+    #
+    def get_backup_prefix(self, p_type):
+
+        v_home = os.path.normpath(self.oracle_home)
+
+        return "orapatch_" + p_type + "_" + os.path.basename(v_home) + "_" + hashlib.sha1(v_home.encode()).hexdigest()[:8] + "_"
+
+    # @Description:
+    #   Function to return the latest backup manifest (or index) of the oracle home
+    #   Files of other homes are skipped by their "oracle_home" field
+    # @Parameters:
+    #   p_type: backup type (backup, full)
+    #   p_suffix: manifest file suffix
+    # @Return:
+    #   Tuple of manifest file and manifest
+    # @Exception:
+    #   Module failure if no manifest is found
+    #
+    def get_latest_backup(self, p_type, p_suffix):
+
+        v_prefix = self.get_backup_prefix(p_type)
+        v_names = sorted((name for name in os.listdir(self.backup_loc or ".") if name.startswith(v_prefix) and name.endswith(p_suffix)), reverse = True)
+
+        for v_name in v_names if self.backup_loc else []:
+
+            with open(self.backup_loc + "/" + v_name, "r") as f:
+                v_manifest = json.load(f)
+
+            if os.path.normpath(v_manifest["oracle_home"]) == os.path.normpath(self.oracle_home):
+                return self.backup_loc + "/" + v_name, v_manifest
+
+            logger("Backup " + v_name + " is for oracle home " + v_manifest["oracle_home"] + ", skipped.")
+
+        fail_module("No backup found for " + self.oracle_home + " in " + str (self.backup_loc))
+
+    # @Description:
+    #   Function to restore the oracle home from the latest BACKUP manifest of the home
+    #   Files are extracted from the archive, files created by the patches are removed
+    #   Central inventory is not restored, it is only reported
+    # @Parameters:
+    #   None
+    # @Return:
+    #   None
+    # @Exception:
+    #   Module failure if no manifest is found
+    #
+    def restore_oh(self):
+
+        v_manifest_file, v_manifest = self.get_latest_backup("backup", ".json")
+
+        logger("Restore " + self.oracle_home + " from " + v_manifest["archive"])
+
+        if os.path.isdir(self.oracle_home + "/inventory") and "inventory" in v_manifest["files"]:
+            shutil.rmtree(self.oracle_home + "/inventory")
+
+        with tarfile.open(v_manifest["archive"], "r:gz") as v_tar:
+            gf_tar_extract(v_tar, self.oracle_home)
+
+        for v_file in v_manifest["new_files"]:
+            if os.path.lexists(self.oracle_home + "/" + v_file):
+                os.remove(self.oracle_home + "/" + v_file)
+
+        if "central_inventory" in v_manifest:
+            logger("Central inventory backup: " + v_manifest["central_inventory"]["backup"] + " (" + v_manifest["central_inventory"]["file"] + ")")
+
+        g_output["restore"] = { "manifest": v_manifest_file, "files": len(v_manifest["files"]), "removed": len(v_manifest["new_files"]) }
+
+    # @Description:
+    #   Function to back up the whole oracle home in parallel
+    #   The home is walked with os.scandir and regular files are split into
+    #   chunks (g_backup_chunk_size bytes or g_backup_chunk_files files). Each
+    #   chunk is written as gzip compressed tar by a process pool. Chunks are
+    #   appended to one archive in order (concatenated gzip members), followed
+    #   by a chunk with directories, symlinks and other entries, so directory
+    #   attributes are set last on restore.
+    #   An index (JSON) keeps offset and length of each chunk and the chunk of
+    #   each path, so single files can be restored without reading the archive.
+    #   The archive can also be extracted with "tar -xzf <archive> --ignore-zeros".
+    # @Parameters:
+    #   None
+    # @Return:
+    #   None
+    # @Exception:
+    #   Module failure if the backup location is not defined or a chunk fails
+    #
+    def backup_oh_full(self):
+
+        if not self.backup_loc:
+            fail_module("Backup location (backup_loc) is not defined.")
+
+        v_home = os.path.normpath(self.oracle_home)
+        v_backup_name = self.backup_loc + "/" + self.get_backup_prefix("full") + gf_gettime()
+        v_chunks = []
+        v_other = []
+        v_unreadable = []
+        v_chunk = []
+        v_chunk_size = 0
+        v_size = 0
+
+        for v_path, v_entry in gf_scan_tree(v_home, [self.backup_loc]):
+
+            if not v_entry.is_file(follow_symlinks = False):
+                if not stat.S_ISSOCK(v_entry.stat(follow_symlinks = False).st_mode):
+                    v_other.append(v_path)
+                continue
+
+            if not os.access(v_entry.path, os.R_OK):
+                v_unreadable.append(v_path)
+                continue
+
+            v_chunk.append(v_path)
+            v_chunk_size += v_entry.stat(follow_symlinks = False).st_size
+
+            if v_chunk_size >= g_backup_chunk_size or len(v_chunk) >= g_backup_chunk_files:
+                v_chunks.append(v_chunk)
+                v_size += v_chunk_size
+                v_chunk = []
+                v_chunk_size = 0
+
+        if v_chunk:
+            v_chunks.append(v_chunk)
+            v_size += v_chunk_size
+
+        v_chunks.append(v_other)
+
+        v_degree = self.backup_parallel_degree or os.cpu_count() or 1
+
+        logger("Backup " + v_home + " (" + str (v_size) + " bytes in " + str (len(v_chunks)) + " chunks) to " + v_backup_name + ".tgz with " + str (v_degree) + " processes.")
+
+        v_index = { "oracle_home": v_home,
+                    "archive": v_backup_name + ".tgz",
+                    "created": gf_gettime(),
+                    "chunks": [],
+                    "paths": {},
+                    "unreadable": v_unreadable }
+
+        with ProcessPoolExecutor(max_workers = v_degree) as v_executor:
+
+            v_futures = [ v_executor.submit(gf_write_backup_chunk, v_home, chunk, v_backup_name + ".part" + str (i))
+                          for i, chunk in enumerate(v_chunks) ]
+
+            with open(v_index["archive"], "wb") as v_archive:
+
+                # Append chunks in order as they complete
+                for i, v_future in enumerate(v_futures):
+
+                    try:
+                        v_part_file, v_part_size = v_future.result()
+                    except Exception as e:
+                        # shutdown(cancel_futures = True) needs Python 3.9
+                        for v_pending in v_futures:
+                            v_pending.cancel()
+                        v_executor.shutdown(wait = True)
+                        for v_part in range(len(v_chunks)):
+                            if os.path.exists(v_backup_name + ".part" + str (v_part)):
+                                os.remove(v_backup_name + ".part" + str (v_part))
+                        fail_module("Backup of chunk " + str (i) + " failed: " + str (e))
+
+                    v_index["chunks"].append({ "offset": v_archive.tell(), "length": v_part_size })
+
+                    with open(v_part_file, "rb") as f:
+                        shutil.copyfileobj(f, v_archive, 1024 * 1024)
+
+                    os.remove(v_part_file)
+
+                    for v_path in v_chunks[i]:
+                        v_index["paths"][v_path] = i
+
+        with open(v_backup_name + ".idx.json", "w") as f:
+            json.dump(v_index, f)
+
+        if v_unreadable:
+            logger("Files not readable (not backed up): " + ", ".join(v_unreadable))
+
+        v_archive_size = os.path.getsize(v_index["archive"])
+
+        logger("Backed up " + str (len(v_index["paths"])) + " entries, archive size " + str (v_archive_size) + " bytes.")
+        logger("Index: " + v_backup_name + ".idx.json")
+
+        g_output["backup"] = { "archive": v_index["archive"], "index": v_backup_name + ".idx.json",
+                               "entries": len(v_index["paths"]), "chunks": len(v_chunks),
+                               "unreadable": len(v_unreadable), "bytes": v_size, "archive_bytes": v_archive_size }
+
+    # @Description:
+    #   Function to restore the oracle home (or the files in restore_files) from
+    #   the latest full backup index of the home
+    #   Only the chunks holding the requested files are read
+    # @Parameters:
+    #   None
+    # @Return:
+    #   None
+    # @Exception:
+    #   Module failure if no index is found or a requested file is not in the backup
+    #
+    def restore_oh_full(self):
+
+        v_index_file, v_index = self.get_latest_backup("full", ".idx.json")
+
+        # Requested paths by chunk, all chunks if no path is requested
+        v_wanted = collections.defaultdict(set)
+
+        for v_path in self.restore_files or []:
+
+            v_path = os.path.normpath(v_path.replace(v_index["oracle_home"] + "/", "", 1))
+
+            if v_path not in v_index["paths"]:
+                fail_module("File " + v_path + " is not in backup " + v_index["archive"])
+
+            v_wanted[v_index["paths"][v_path]].add(v_path)
+
+        v_chunk_ids = sorted(v_wanted) if self.restore_files else range(len(v_index["chunks"]))
+
+        logger("Restore " + (", ".join(self.restore_files) if self.restore_files else "oracle home") + " from " + v_index["archive"])
+
+        v_count = 0
+
+        with open(v_index["archive"], "rb") as v_archive:
+
+            for i in v_chunk_ids:
+
+                v_archive.seek(v_index["chunks"][i]["offset"])
+
+                with tarfile.open(fileobj = v_archive, mode = "r|gz") as v_tar:
+                    for v_member in v_tar:
+                        if not self.restore_files or v_member.name in v_wanted[i]:
+                            gf_tar_extract(v_tar, v_index["oracle_home"], v_member)
+                            v_count += 1
+
+        logger("Restored " + str (v_count) + " entries.")
+
+        g_output["restore"] = { "index": v_index_file, "entries": v_count }
+
+    # @Description:
+    #   Function to use the host local stage cache as stage
+    #   The cache is used only if all patches are cached and extracted
+    # @Parameters:
+    #   None
+    # @Return:
+    #   None
+    # @Exception:
+    #   None
+    #
+    def use_stage_cache(self):
+
+        v_zip_names = [self.patch_list[item].file for item in self.patch_list]
+
+        if not all(v_zip_names):
+            logger("Stage cache not used, zip file is not defined for all patches.")
+            return
+
+        self.stage_cache.lock()
+
+        try:
+            v_stage_dir = self.stage_cache.get_stage(v_zip_names)
+        finally:
+            self.stage_cache.unlock()
+
+        if v_stage_dir:
+            logger("Use stage cache: " + v_stage_dir)
+            self.sw_stage = v_stage_dir
+        else:
+            logger("Stage cache not used, patches are not staged in " + self.stage_cache.cache_dir + ". Use " + str (self.sw_stage))
+
+    # @Description:
+    #   Function to initiate actual patching process
+    # @Parameters:
+    #   None
+    # @Return:
+    #   None
+    # @Exception:
+    #   None
+    #
+    def patch_oh(self):
+
+        self.set_env(self.oracle_home)
+        
+        # start: "if self.is_crs"
+        if self.is_crs:
+
+            self.patch_grid_oh()
+
+            self.wait_stack_ready()
+
+        else:
+
+            self.patch_db_oh()
+
+    # end: patch_oh
+
+    # @Description:
+    #   Function to wait until the CRS/HAS stack is online after opatchauto
+    #   The stack is polled quickly at first, then the poll interval backs off
+    #   Each daemon (HAS, CRS, CSS, EVM) and ASM is tracked separately
+    #   The time each daemon took to come online is logged and returned
+    # @Parameters:
+    #   None
+    # @Return:
+    #   None
+    # @Exception:
+    #   Module failure if the stack is not online within the timeout
+    #
+    def wait_stack_ready(self):
+
+        v_daemons = { "HAS": "Oracle High Availability Services" }
+        v_command = "$ORACLE_HOME/bin/crsctl check has 2>&1"
+        v_stack_label = "HAS"
+
+        if (self.is_cluster):
+            v_stack_label = "CRS"
+            v_command = "$ORACLE_HOME/bin/crsctl check crs 2>&1"
+            v_daemons["CRS"] = "Cluster Ready Services"
+            v_daemons["CSS"] = "Cluster Synchronization Services"
+            v_daemons["EVM"] = "Event Manager"
+
+        v_timeout = self.crs_wait_timeout or gf_get_history_timeout("crs_wait", 600)
+
+        v_check_asm = any(g_instance_list[item].is_asm for item in g_instance_list)
+
+        v_online = {}
+        v_interval = self.crs_wait_initial_interval
+        v_polls = 0
+        v_start = time.time()
+
+        while(True):
+
+            v_result = self.run_os_command(v_command)
+            v_elapsed = time.time() - v_start
+            v_polls += 1
+
+            for v_daemon in v_daemons:
+                if v_daemon not in v_online and re.search(re.escape(v_daemons[v_daemon]) + " is online", v_result):
+                    v_online[v_daemon] = round(v_elapsed, 1)
+                    logger(v_daemon + " is online after " + "%.1f" % v_elapsed + " seconds.")
+
+            # ASM is checked only once the stack daemons are online
+            if v_check_asm and "ASM" not in v_online and len(v_online) == len(v_daemons):
+                if re.search("ASM is running", self.run_os_command("$ORACLE_HOME/bin/srvctl status asm 2>&1")):
+                    v_online["ASM"] = round(time.time() - v_start, 1)
+                    logger("ASM is online after " + "%.1f" % v_online["ASM"] + " seconds.")
+
+            v_not_online = [daemon for daemon in list(v_daemons) + (["ASM"] if v_check_asm else []) if daemon not in v_online]
+
+            if not v_not_online:
+                v_elapsed = time.time() - v_start
+                logger(v_stack_label + " is online after " + "%.1f" % v_elapsed + " seconds, continue...")
+                g_output["stack_wait"] = { "stack": v_stack_label, "seconds": round(v_elapsed, 1),
+                                           "polls": v_polls, "daemons": v_online }
+                break
+
+            if (v_elapsed >= v_timeout):
+                logger("Timeout: " + v_stack_label + " did not start within " + str (v_timeout) + " seconds. Not online: " + ", ".join(v_not_online))
+                g_output["stack_wait"] = { "stack": v_stack_label, "seconds": round(v_elapsed, 1),
+                                           "polls": v_polls, "daemons": v_online, "not_online": v_not_online }
+                fail_module("Error: " + v_stack_label + " start timeout. " + ", ".join(v_not_online) + " did not start within " + str (v_timeout) + " seconds")
+
+            v_sleep_time = min(v_interval, v_timeout - v_elapsed)
+            logger(v_stack_label + " is not online (" + ", ".join(v_not_online) + "), check again in " + "%.0f" % v_sleep_time + " seconds...")
+            time.sleep(v_sleep_time)
+
+            v_interval = min(v_interval * 2, self.crs_wait_max_interval)
+
+    # @Description:
+    #   Function to initiate patching process to DB dictionary
+    # @Parameters:
+    #   p_ojvm: indicator whether to patch JVM
+    # @Return:
+    #   None
+    # @Exception:
+    #   None
+    #
+    def patch_db(self, p_ojvm = False):
+
+        if self.patch_db_all:
+
+            logger("Patch all databases for ORACLE_HOME: " + self.oracle_home)
+
+        else:
+
+            logger("Patch specific databases for ORACLE_HOME: " + self.oracle_home)
+
+            if not g_instance_list:
+                logger("No database found for patching.",True)
+            else:
+
+                for item in g_instance_list:
+                    logger("database: " + g_instance_list[item].name,True)
+
+        #db_list_to_patch = active_instance_list
+        v_db_list = []
+
+        for dbname in g_instance_list:
+
+            v_db_obj = g_instance_list[dbname]
+
+            v_skip_reason = self.get_db_skip_reason(v_db_obj)
+
+            if v_skip_reason is None:
+
+                v_db_list.append(v_db_obj)
+
+            elif not v_db_obj.is_asm:
+
+                logger("Skip database [" + str (v_db_obj.name) + "/" + str (v_db_obj.db_unique_name) + "].")
+                logger("Database " + str (v_db_obj.name) + " will not be patched because " + v_skip_reason + ".",True)
+
+        v_patch_db_result = g_output.setdefault("patch_db", {})
+
+        # Sequential mode: stop at the first error
+        if self.parallel_degree <= 1:
+
+            for v_db_obj in v_db_list:
+
+                self.patch_db_instance(v_db_obj, p_ojvm)
+                v_patch_db_result[v_db_obj.sid] = { "status": "success" }
+
+            return
+
+        # Concurrent mode: each database is patched in its own log section
+        # Errors are collected per database, all databases are processed
+        logger("Patch " + str (len(v_db_list)) + " database(s) with degree of parallelism " + str (self.parallel_degree) + ".")
+
+        v_tasks = {}
+        for v_db_obj in v_db_list:
+            v_tasks[v_db_obj.sid] = functools.partial(gf_run_log_section, "PATCH_DB => " + v_db_obj.sid, v_db_obj.sid,
+                                                      functools.partial(self.patch_db_instance, v_db_obj, p_ojvm))
+
+        v_results = gf_run_concurrently(v_tasks, self.parallel_degree)
+
+        v_failed = []
+
+        for v_sid in v_results:
+
+            v_error = v_results[v_sid][1]
+
+            if v_error:
+                logger("Database dictionary \"" + v_sid + "\" patching failed: " + v_error)
+                v_patch_db_result[v_sid] = { "status": "failed", "msg": v_error }
+                v_failed.append(v_sid)
+            else:
+                v_patch_db_result[v_sid] = { "status": "success" }
+
+        if v_failed:
+            fail_module("Database dictionary patching failed for: " + ", ".join(v_failed))
+
+    # @Description:
+    #   Function to return why the dictionary of a database is not patched
+    # @Parameters:
+    #   p_db_obj: database object
+    # @Return:
+    #   Reason, None if the database is patched
+    # @Exception:
+    #   None
+    #
+    def get_db_skip_reason(self, p_db_obj):
+
+        if p_db_obj.is_asm:
+            return "it's an ASM instance"
+
+        if not p_db_obj.patch:
+
+            if self.is_crs:
+                return "the oracle home is a GI home"
+            if self.patch_only_oh:
+                return "only the oracle home is patched (patch_only_oh)"
+            if p_db_obj.is_standby:
+                return "it's a standby database"
+            if not self.patch_db_all:
+                return "it's not in patch_db_list"
+
+            return "it's not selected for patching"
+
+        if p_db_obj.initial_state != "OPEN":
+            return "its initial state is " + str (p_db_obj.initial_state)
+
+        return None
+
+    # @Description:
+    #   Function to patch DB dictionary of one database
+    #   The instance is started, patched and stopped
+    # @Parameters:
+    #   p_db_obj: database object
+    #   p_ojvm: indicator whether to patch JVM
+    # @Return:
+    #   None
+    # @Exception:
+    #   None
+    #
+    def patch_db_instance(self, p_db_obj, p_ojvm):
+
+        g_logger_local.sid = p_db_obj.sid
+
+        try:
+
+            if p_db_obj.version_short in g_supported_version_new:
+                self.patch_db_12c(p_db_obj, p_ojvm)
+
+            elif p_db_obj.version_short in g_supported_version_old:
+                self.patch_db_pre_12c(p_db_obj, p_ojvm)
+
+        finally:
+            g_logger_local.sid = None
+
+    # @Description:
+    #   Function to perform actual patching of DB dictionary for databases prior 12c version
+    # @Parameters:
+    #   p_db_obj: database object
+    #   p_ojvm: indicator whether to patch JVM
+    # @Return:
+    #   None
+    # @Exception:
+    #   None
+    #
+    def patch_db_pre_12c(self, p_db_obj, p_ojvm):
+
+        #if self.patch_db_id:
+        #logger("starting instance: " + p_db_obj.sid)
+
+        if not p_ojvm:
+
+            self.start_instance(p_db_obj)
+
+            logger("Now applying PSU for database dictionary: \"" + p_db_obj.sid + "\"", True)
+            output = gf_get_sqlplus_pool().execute(p_db_obj.sid, self.oracle_home, "@" + self.oracle_home + "/rdbms/admin/catbundle.sql psu apply")
+            logger("Database dictionary \"" + p_db_obj.sid + "\" was patched. Check logfiles for errors.")
+
+        elif p_ojvm and self.get_ojvm_patch_ids():
+
+            self.start_instance(p_db_obj, "upgrade")
+
+            for v_patch_ojvm_id in self.get_ojvm_patch_ids():
+                logger("Now applying OJVM for database dictionary: """ + p_db_obj.sid + "", True)
+                output = gf_get_sqlplus_pool().execute(p_db_obj.sid, self.oracle_home, "@" + self.oracle_home + "/sqlpatch/" + str (v_patch_ojvm_id) + "/postinstall.sql")
+            logger("Database dictionary \"" + p_db_obj.sid + "\" was patched. Check logfiles for errors.")
+
+        self.stop_instance(p_db_obj)
+
+    # @Description:
+    #   Function to perform actual patching of DB dictionary for 12c version and higher
+    # @Parameters:
+    #   p_db_obj: database object
+    #   p_ojvm: indicator whether to patch JVM
+    # @Return:
+    #   None
+    # @Exception:
+    #   None
+    #
+    def patch_db_12c(self, p_db_obj, p_ojvm):
+
+        if p_ojvm:
+            self.start_instance(p_db_obj, "upgrade")
+        else:
+            self.start_instance(p_db_obj)
+
+        v_command = self.get_datapatch_command(p_db_obj)
+
+        logger("Now patching database: \"" + p_db_obj.sid + "\"", p_notime = True)
+
+        v_output = self.run_os_command(v_command)
+
+        logger("Database dictionary \"" + p_db_obj.sid + "\" was patched. Check logfiles for errors.")
+
+        self.stop_instance(p_db_obj)
+
+    # @Description:
+    #   Function to return the patch directories (relative to the stage) applied to a GI home
+    # @Parameters:
+    #   None
+    # @Return:
+    #   List of directories
+    # @Exception:
+    #   None
+    #
+    def get_grid_patch_dirs(self):
+
+        v_patch_dirs = []
+
+        for item in self.patch_list:
+
+            v_patch_obj = self.patch_list[item]
+
+            v_patch_proactive_bp_id = str (v_patch_obj.patch_proactive_bp_id)
+            v_patch_gi_id = str (v_patch_obj.patch_gi_id)
+            v_patch_db_id = str (v_patch_obj.patch_db_id)
+            v_patch_dir = v_patch_obj.patch_dir
+
+            # Initially assume (initialize path to) GI only. Can change below.
+            # If it is DBBP only, v_patch_dir == v_patch_proactive_bp_id, therefore does not need to append v_patch_proactive_bp_id
+            if self.oh_version in g_supported_version_new:
+
+                # COMBO of OJVM + DBBP
+                if v_patch_obj.is_dbbp and v_patch_obj.is_combo:
+                    v_patch_dir += "/" + v_patch_proactive_bp_id  + "/" + v_patch_db_id
+
+                # COMBO of OJVM + GI
+                if not v_patch_obj.is_dbbp and v_patch_obj.is_combo:
+                    v_patch_dir += "/" + v_patch_gi_id
+
+            if self.oh_version in g_supported_version_old:
+
+                # COMBO of OJVM + GI
+                # GI only, in such case v_patch_dir == v_patch_gi_id
+                if v_patch_obj.is_combo:
+                    v_patch_dir += "/" + v_patch_gi_id
+
+            v_patch_dirs.append(v_patch_dir)
+
+        return v_patch_dirs
+
+    # @Description:
+    #   Function to return the opatchauto commands (run as root) applying patch directories to a GI home
+    #   opatchauto (12c and higher) applies a patch stack with one session
+    #   "opatch auto" (11g) applies one patch per session
+    # @Parameters:
+    #   p_patch_dirs: patch directories (relative to the stage)
+    #   p_patch_list_file: -phBaseFile file, used if there is more than one directory
+    # @Return:
+    #   List of commands
+    # @Exception:
+    #   None
+    #
+    def get_grid_oh_commands(self, p_patch_dirs, p_patch_list_file = None):
+
+        v_sw_stage = str (self.sw_stage)
+        v_paths = []
+
+        if self.oh_version in g_supported_version_new:
+
+            if len(p_patch_dirs) > 1:
+                v_paths = [self.oracle_home + "/OPatch/opatchauto apply -phBaseFile " + str (p_patch_list_file) + " -oh " + self.oracle_home]
+            else:
+                v_paths = [self.oracle_home + "/OPatch/opatchauto apply " + v_sw_stage + "/" + p_patch_dirs[0] + " -oh " + self.oracle_home]
+
+        if self.oh_version in g_supported_version_old:
+
+            v_paths = [self.oracle_home + "/OPatch/opatch auto " + v_sw_stage + "/" + v_patch_dir + " -oh " + self.oracle_home + " -ocmrf " + g_ocmrf_file
+                       for v_patch_dir in p_patch_dirs]
+
+        return v_paths
+
+    # @Description:
+    #   Function to return the datapatch command of a database
+    # @Parameters:
+    #   p_db_obj: database object
+    # @Return:
+    #   datapatch command
+    # @Exception:
+    #   None
+    #
+    def get_datapatch_command(self, p_db_obj):
 
-        # If oracle home version is 10 or 11 define OCM file
-        # OCM file is needed when patching 10g and 11g oracle homes
-        if self.oh_version in g_supported_version_old and (g_function == "PATCH_OH" or g_function == "PATCH_OH_OJVM"):
-            self.gen_ocm_file(p_oracle_home)
+        return "export ORACLE_SID=" + p_db_obj.sid + "; $ORACLE_HOME/OPatch/datapatch -verbose"
 
     # @Description:
-    #   Identifies and sets OH inventory file
+    #   Function to perform actual patching of GI home
     # @Parameters:
     #   None
     # @Return:
     #   None
     # @Exception:
+    #   Module failure if patching process throws an error
+    #
+    def patch_grid_oh(self):
+
+        v_patch_dirs = self.get_grid_patch_dirs()
+
+        # Patch stack is applied with one opatchauto session
+        v_patch_list_file = None
+        if self.oh_version in g_supported_version_new and len(v_patch_dirs) > 1:
+            v_patch_list_file = self.write_patch_list_file(v_patch_dirs)
+
+        v_paths = self.get_grid_oh_commands(v_patch_dirs, v_patch_list_file)
+
+        try:
+
+            for v_path in v_paths:
+
+                if g_root_password:
+                    v_command = "su -c \"" + v_path + "\""
+                    g_expected_list["Password: "] = g_root_password + "\r"
+                    v_output= self.run_os_command(v_command, p_expect = True)
+                else:
+                    v_command = "sudo " + v_path
+                    v_output= self.run_os_command(v_command)
+
+                if self.oh_version in g_supported_version_new:
+                    if re.search(g_sw_opatchauto_check_pattern12, v_output) is not None:
+                        g_changed = True
+                        continue
+
+                if self.oh_version in g_supported_version_old:
+                    if re.search(g_sw_opatchauto_check_pattern11, v_output) is not None:
+                        g_changed = True
+                        continue
+
+                if re.search(g_sw_opatch_no_need, v_output) is not None:
+                    continue
+                else:
+                    fail_module("Error during applying patch for: " + self.oracle_home)
+
+        finally:
+            if v_patch_list_file:
+                os.remove(v_patch_list_file)
+
+    # @Description:
+    #   Function to perform actual patching of OJVM to oracle home
+    # @Parameters:
+    #   None
+    # @Return:
     #   None
+    # @Exception:
+    #   Module failure if patching process throws an error
     #
-    def set_inventory(self):
-        global g_inventory_file
+    def patch_oh_ojvm(self):
 
-        v_orainst_file = self.oracle_home + "/oraInst.loc"
-        v_command = "[ -f " + v_orainst_file + " ] && echo 1 || echo 0"
-        output = self.run_os_command(v_command)
+        v_patch_dirs = self.get_ojvm_patch_dirs()
+
+        if not v_patch_dirs:
+            logger("Skip OJVM as the patch could not be identified.")
+            return
+
+        # OJVM patches of the patch stack are applied with one OPatch session
+        v_patch_list_file = None
+        if len(v_patch_dirs) > 1:
+            v_patch_list_file = self.write_patch_list_file(v_patch_dirs)
+
+        v_command = self.get_opatch_apply_command(v_patch_dirs, v_patch_list_file)
+
+        try:
+            output= self.run_os_command(v_command)
+        finally:
+            if v_patch_list_file:
+                os.remove(v_patch_list_file)
+
+        if re.search(g_sw_opatch_check_pattern1,output) is not None or re.search(g_sw_opatch_check_pattern2,output) is not None:
+            g_changed = True
+
+        elif re.search(g_sw_opatch_no_need,output) is not None:
+            pass
 
-        if int(output) == 1:
-            v_command = "grep inventory_loc " + v_orainst_file + " | awk -F= '{ print $2 }'"
-            output = self.run_os_command(v_command)
         else:
-            v_command = "grep inventory_loc /etc/oraInst.loc | awk -F= '{ print $2 }'"
-            output = self.run_os_command(v_command)
+            fail_module("Error during applying patch for: " + self.oracle_home)
+
+    # @Description:
+    #   Function to return the OJVM patch directories (relative to the stage)
+    # @Parameters:
+    #   None
+    # @Return:
+    #   List of directories
+    # @Exception:
+    #   None
+    #
+    def get_ojvm_patch_dirs(self):
+
+        v_patch_dirs = []
+
+        for item in self.patch_list:
+
+            v_patch_obj = self.patch_list[item]
+
+            if (v_patch_obj.patch_ojvm_id):
+                v_patch_dirs.append(v_patch_obj.patch_dir + "/" + str (v_patch_obj.patch_ojvm_id))
 
-        logger("Inventory location [inventory_loc]: " + output)
-        g_inventory_file = output + "/ContentsXML/inventory.xml"
+        return v_patch_dirs
 
     # @Description:
-    #   Generates OCM file required for OPatch
+    #   Function to return the OPatch command applying patch directories to a DB oracle home
     # @Parameters:
-    #   p_oracle_home: oracle home for which to generate OCM file
+    #   p_patch_dirs: patch directories (relative to the stage)
+    #   p_patch_list_file: -phBaseFile file, used if there is more than one directory
+    # @Return:
+    #   OPatch command
+    # @Exception:
+    #   None
+    #
+    def get_opatch_apply_command(self, p_patch_dirs, p_patch_list_file = None):
+
+        if len(p_patch_dirs) > 1:
+            v_command = self.oracle_home + "/OPatch/opatch napply -silent -phBaseFile " + str (p_patch_list_file)
+        else:
+            v_command = self.oracle_home + "/OPatch/opatch apply -silent " + str (self.sw_stage) + "/" + p_patch_dirs[0]
+
+        if self.oh_version in g_supported_version_old:
+            v_command += " -ocmrf " + g_ocmrf_file
+
+        return v_command
+
+    # @Description:
+    #   Function to perform actual patching of DB oracle home
+    # @Parameters:
+    #   None
+    # @Return:
+    #   None
+    # @Exception:
+    #   Module failure if patching process throws an error
+    #
+    def patch_db_oh(self):
+
+        v_patch_dirs = [self.get_db_oh_patch_dir(self.patch_list[item]) for item in self.patch_list]
+
+        # Patch stack is applied with one OPatch session
+        v_patch_list_file = None
+        if len(v_patch_dirs) > 1:
+            v_patch_list_file = self.write_patch_list_file(v_patch_dirs)
+
+        v_command = self.get_opatch_apply_command(v_patch_dirs, v_patch_list_file)
+
+        try:
+            output= self.run_os_command(v_command)
+        finally:
+            if v_patch_list_file:
+                os.remove(v_patch_list_file)
+
+        if re.search(g_sw_opatch_check_pattern1,output) is not None or re.search(g_sw_opatch_check_pattern2,output) is not None:
+            g_changed = True
+
+        elif re.search(g_sw_opatch_no_need,output) is not None:
+            pass
+
+        else:
+            fail_module("Error during applying patch for: " + self.oracle_home)
+
+    # @Description:
+    #   Function to return the directory (relative to the stage) applied to a DB oracle home
+    # @Parameters:
+    #   p_patch_obj: patch object
+    # @Return:
+    #   Patch directory
+    # @Exception:
+    #   None
+    #
+    def get_db_oh_patch_dir(self, p_patch_obj):
+
+        v_patch_obj = p_patch_obj
+
+        v_patch_proactive_bp_id = str (v_patch_obj.patch_proactive_bp_id)
+        v_patch_db_id           = str (v_patch_obj.patch_db_id)
+        v_patch_gi_id           = str (v_patch_obj.patch_gi_id)
+        v_patch_dir             = v_patch_obj.patch_dir
+
+        #
+        # Valid cases:
+        #
+        #   1. if patch is DBBP only - in this case v_patch_dir == v_patch_proactive_bp_id, therefore only append v_patch_db_id
+        #      (v_patch_proactive_bp_id and not v_patch_obj.is_combo)
+        #
+        #   2. if patch is COMBO of OJVM + DB. Need to be sure it is not COMBO with DBBP or COMBO with GI
+        #      (not v_patch_proactive_bp_id and v_patch_obj.is_combo and not v_patch_obj.is_grid)
+        #
+        #   3. if patch is GI only
+        #      (v_patch_obj.is_grid and not v_patch_obj.is_combo)
+        #
+        if ((v_patch_obj.is_dbbp and not v_patch_obj.is_combo)
+            or (not v_patch_obj.is_dbbp and v_patch_obj.is_combo and not v_patch_obj.is_grid)
+            or (v_patch_obj.is_grid and not v_patch_obj.is_combo)):
+            v_patch_dir += "/" + v_patch_db_id
+
+        #
+        # Valid cases:
+        #
+        #   1. If patch is COMBO of OJVM + DBBP
+        #
+        if v_patch_obj.is_combo and v_patch_obj.is_dbbp:
+            v_patch_dir += "/" + v_patch_proactive_bp_id + "/" + v_patch_db_id
+
+        # Valid cases:
+        #
+        #   1. if patch is COMBO of OJVM + GI
+        #
+        if v_patch_obj.is_grid and v_patch_obj.is_grid:
+            v_patch_dir += "/" + v_patch_gi_id + "/" + v_patch_db_id
+
+        return v_patch_dir
+
+    # @Description:
+    #   Function to stop active services
+    #   Only necessary services are stopped from the home that is being patched
+    # @Parameters:
+    #   None
     # @Return:
     #   None
     # @Exception:
     #   None
     #
-    def gen_ocm_file(self, p_oracle_home):
-        global g_ocmrf_file
-        global g_expected_list
+    def stop_services_from_oh(self):
 
-        # Set environment variables
-        self.set_env(p_oracle_home)
+        global g_instance_list
+        global g_listener_list
 
-        # Prepare the command to generate OCM file
-        v_command = p_oracle_home + "/OPatch/ocm/bin/emocmrsp -no_banner -output " + g_ocmrf_file
-        self.run_os_command(v_command, p_expect = True)
+        if not g_instance_list and not g_listener_list:
+            logger("No instances or listeners found to stop.")
+            return
+
+        # Services are stopped in groups: listeners, DB instances, ASM instances
+        # Services within a group are stopped concurrently
+        # Stop active listeners
+        v_tasks = []
+        for item in g_listener_list:
+            v_tasks.append(("listener " + item.listener_name, item.oracle_home, functools.partial(self.stop_listener, item.listener_name)))
+
+        self.run_service_group("Stop listeners", v_tasks)
+
+        # if self.is_crs:
+        #     logger("This is CRS configuration, opatchauto takes care.")
+        #     logger("Skipping STOP_SERVICES_FROM_OH.")
+        #     return
+
+        # Stop active instances from specified OH
+        v_tasks = []
+        for item in g_instance_list:
+
+            v_db_obj = g_instance_list[item]
+
+            if not v_db_obj.is_asm:
+                v_tasks.append(("instance " + v_db_obj.sid, v_db_obj.oracle_home, functools.partial(self.stop_instance, v_db_obj)))
+
+        self.run_service_group("Stop DB instances", v_tasks)
+
+        #Stop active ASM instances from specified OH
+        v_tasks = []
+        for item in g_instance_list:
+
+            v_db_obj = g_instance_list[item]
+
+            if v_db_obj.is_asm:
+                v_tasks.append(("ASM instance " + v_db_obj.sid, v_db_obj.oracle_home, functools.partial(self.stop_instance, v_db_obj, p_asm = True)))
+
+        self.run_service_group("Stop ASM instances", v_tasks)
+
+        # sqlplus sessions keep the home binaries open
+        gf_get_sqlplus_pool().close()
 
     # @Description:
-    #   Generates OCM file required for OPatch
+    #   Function to start services
+    #   Only services that were stopped by this module are started
     # @Parameters:
-    #   p_oracle_home: oracle home for which to generate OCM file
+    #   None
     # @Return:
-    #   int
+    #   None
     # @Exception:
     #   None
     #
-    #todo: check for version > 12
-    def get_oh_version(self, p_oracle_home):
+    def start_services_from_oh(self):
 
-        # Prepare the command to get oracle installed version
-        # Current check is based on libcell library
-        # The library name contains version number
-        # Examples:
-        #   10g: libcell10.so
-        #   11g: libcell11.so
-        #   12c: libcell12.so
-        #command = "ls " + p_oracle_home + "/lib | grep libcell.*.so | awk '{ if ($0 == \"libcell10.so\"){ print 10 } if ($0 == \"libcell11.so\"){ print 11 } if ($0 == \"libcell12.so\") { print 12 } }'"
-        command = "ls " + p_oracle_home + "/lib | gawk 'match($0, /libcell([[:digit:]][[:digit:]])\.so/, res) { print res[1] }'"
-        v_result = self.run_os_command(command)
+        # if self.is_crs:
+        #     logger("This is CRS configuration, opatchauto takes care.")
+        #     logger("Skipping START_SERVICES_FROM_OH.")
+        #     return
 
-        if (v_result):
-            return int(v_result)
+        global g_instance_list
+        global g_listener_list
 
-        else:
-            logger("Could not determine Oracle version.")
-            fail_module("Could not determine Oracle version.")
+        if not g_instance_list and not g_listener_list:
+            logger("No instances or listeners found to start.")
+            return
+
+        # Services are started in groups: ASM instances, DB instances, listeners
+        # Services within a group are started concurrently
+        # Start previously stopped ASM instances
+        v_tasks = []
+        for item in g_instance_list:
+
+            v_db_obj = g_instance_list[item]
+
+            if v_db_obj.is_asm:
+                v_tasks.append(("ASM instance " + v_db_obj.sid, v_db_obj.oracle_home, functools.partial(self.start_instance, v_db_obj, p_asm = True)))
+
+        self.run_service_group("Start ASM instances", v_tasks)
+
+        logger("Now starting: [instance_list]: " + str (g_instance_list))
+        # Start previously stopped DB instances
+        v_tasks = []
+        for item in g_instance_list:
+
+            v_db_obj = g_instance_list[item]
+
+            if not v_db_obj.is_asm:
+                v_tasks.append(("instance " + v_db_obj.sid, v_db_obj.oracle_home, functools.partial(self.start_db_service, v_db_obj)))
+
+        self.run_service_group("Start DB instances", v_tasks)
+
+        # Start previously stopped listeners
+        v_tasks = []
+        for item in g_listener_list:
+            v_tasks.append(("listener " + item.listener_name, item.oracle_home, functools.partial(self.start_listener, item.listener_name)))
+
+        self.run_service_group("Start listeners", v_tasks)
 
     # @Description:
-    #   Sets oracle environment
+    #   Function to start a DB instance in its initial state
     # @Parameters:
-    #   p_ora_home: oracle home for which to ORACLE_HOME environment
+    #   p_db_obj: database object
     # @Return:
     #   None
     # @Exception:
     #   None
     #
-    def set_env(self, p_ora_home):
+    def start_db_service(self, p_db_obj):
 
-        logger("ORACLE_HOME set to to '" + p_ora_home + "'")
-        os.environ["ORACLE_HOME"] = p_ora_home
+        if p_db_obj.initial_state == "OPEN" or self.is_crs:
+
+            self.start_instance(p_db_obj, "open")
+
+        elif p_db_obj.initial_state == "MOUNTED":
+
+            self.start_instance(p_db_obj, "mount")
+
+        else:
+            logger("Database instance " + p_db_obj.sid + " not started. Wrong initial state.")
+            logger("Database instance initial state: " + str (p_db_obj.initial_state))
 
     # @Description:
-    #   This function creates an object from PatchFactory
-    #   The object contains details for the patch to be installed
+    #   Function to stop or start a group of services
+    #   Services are grouped by oracle home, ORACLE_HOME is set once per home
+    #   (homes are processed one after the other, the environment is per process)
+    #   and the services of the home run concurrently, at most service_parallel_degree
+    #   The time taken by each service is logged
+    # @Parameters:
+    #   p_group: group label used in the log
+    #   p_tasks: list of (service label, oracle home, callable)
+    # @Return:
+    #   None
+    # @Exception:
+    #   Module failure if a service operation fails,
+    #   after all services of the group have been processed
+    #
+    def run_service_group(self, p_group, p_tasks):
+
+        if not p_tasks:
+            return
+
+        v_homes = []
+        for v_label, v_oracle_home, v_callable in p_tasks:
+            if v_oracle_home not in v_homes:
+                v_homes.append(v_oracle_home)
+
+        v_group_start = time.monotonic()
+        v_failed = []
+
+        for v_oracle_home in v_homes:
+
+            self.set_env(v_oracle_home)
+
+            v_home_tasks = {}
+            for v_label, v_task_home, v_callable in p_tasks:
+                if v_task_home == v_oracle_home:
+                    v_home_tasks[v_label] = functools.partial(gf_run_timed, v_label, v_callable)
+
+            # Sequential mode: stop at the first error
+            if self.service_parallel_degree <= 1:
+                for v_label in v_home_tasks:
+                    v_home_tasks[v_label]()
+                continue
+
+            for v_label in v_home_tasks:
+                v_home_tasks[v_label] = functools.partial(gf_run_log_section, p_group + " => " + v_label, v_label, v_home_tasks[v_label])
+
+            v_results = gf_run_concurrently(v_home_tasks, self.service_parallel_degree)
+
+            for v_label in v_results:
+                if v_results[v_label][1]:
+                    logger(p_group + ": " + v_label + " failed: " + v_results[v_label][1])
+                    v_failed.append(v_label)
+
+        logger(p_group + " completed in " + "%.2f" % (time.monotonic() - v_group_start) + " seconds.")
+
+        if v_failed:
+            fail_module(p_group + " failed for: " + ", ".join(v_failed))
+
+    # @Description:
+    #   Function to identify databases and build database objects
+    #   If oracle home is part of CRS database list is build from CRS
+    #   otherwise, database list is build from oratab file
     # @Parameters:
     #   None
     # @Return:
     #   None
     # @Exception:
-    #   Module failure
+    #   None
     #
-    def build_patch_dict(self):
+    def build_instance_list(self):
 
-        #global patch_list
-        v_patch_temp = None
+        # if self.is_crs:
+        #     logger("This is CRS configuration, opatchauto takes care.")
+        #     logger("Skip BUILD_INSTANCE_LIST.")
+        #     return
 
-        p_patch_id              = self.patch_item["patch_id"]
-        p_patch_proactive_bp_id = self.patch_item["patch_proactive_bp_id"]
-        p_patch_gi_id           = self.patch_item["patch_gi_id"]
-        p_patch_db_id           = self.patch_item["patch_db_id"]
-        p_patch_ocw_id          = self.patch_item["patch_ocw_id"]
-        p_patch_ojvm_id         = self.patch_item["patch_ojvm_id"]
-        p_patch_dir             = self.patch_item["patch_dir"]
-        p_file                  = self.patch_item["file"]
-        p_only_oh               = gf_to_bool(self.patch_item["only_oh"])
-        p_desc                  = self.patch_item["desc"]
-        p_patch_acfs_id         = self.patch_item["patch_acfs_id"]
-        p_patch_dbwlm_id        = self.patch_item["patch_dbwlm_id"]
+        global g_file_oratab
+        global g_hostname
+
+        v_oratab_sid_match = {}
+        v_oratab_asm_sid_match = {}
+        v_oratab_sid_list = {}
+
+        # Build list of DBs defined in oratab
+        f = open(g_file_oratab,'r')
+        lines_oratab = list(f)
 
-        v_patch_temp = PatchFactory(p_patch_id, p_patch_proactive_bp_id,
-                                  p_patch_gi_id, p_patch_db_id, p_patch_ocw_id,
-                                  p_patch_ojvm_id, p_patch_acfs_id,
-                                  p_patch_dbwlm_id, p_patch_dir,
-                                  p_file, p_only_oh, p_desc)
+        for line in lines_oratab:
 
-        self.patch_list[p_patch_id] = v_patch_temp
+            if not line.startswith('#') and not line.startswith('\n'):
 
-        # If patch is not found throw fail message
-        if not v_patch_temp:
+                line_elements = line.split(':')
+                v_oratab_sid_list[line_elements[0]] = line_elements[1]
 
-            fail_module("Patch " + str (self.patch_id) + " not found!")
+        f.close
 
-    # @Description:
-    #   Function to execute OS command
-    # @Parameters:
-    #   p_command: command to be executed
-    #   p_expect: indicator whether the command requires user input
-    #             In case of an user input, the questions are matched 
-    #             against g_expect_list provided answers
-    # @Return:
-    #   Command output/result
-    # @Exception:
-    #   Module failure
-    #
-    def run_os_command(self, p_command, p_expect = False):
+        # Build list of DBs from oratab which map to specified OH
+        for item in v_oratab_sid_list:
 
-        v_error = None
-        v_output = ""
-        global g_expected_list
+            if v_oratab_sid_list[item] == self.oracle_home:
 
-        logger("command: " + p_command)
+                if self.is_crs:
 
-        if p_expect:
+                    v_oratab_asm_sid_match[item] = v_oratab_sid_list[item]
+                else:
 
-            timeout = 3600 # 60 minutes
-            #s = pexpect.pxssh()
+                    v_oratab_sid_match[item] = v_oratab_sid_list[item]
 
-            #try:
+        # Take a new process table snapshot, shared with BUILD_LISTENER_LIST
+        v_process_snapshot = gf_get_process_snapshot(p_refresh = True)
 
-            # Prefer pexpect.run
-            v_output, v_error = pexpect.run(p_command, timeout = timeout, withexitstatus = True, events = g_expected_list)
+        # If OH is GI
+        if self.is_crs:
 
-            #except TypeError:
+            # Get 1st key from "v_oratab_asm_sid_match"
+            #   - since it's GI, we're assuming only one ASM per GI.
+            v_asm_sid = list(v_oratab_asm_sid_match.keys())[0]
 
-            #    try:
-            #
-            #        v_output, v_error = pexpect.runu(p_command, timeout = timeout, withexitstatus = True, events = g_expected_list)
-            #
-            #    except:
-            #        raise
-        else:
+            # Check if ASM is running
+            v_is_sid_active = v_process_snapshot.is_pmon_running(v_asm_sid, p_asm = True)
 
-            process = subprocess.Popen(p_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
-            v_output, v_error = process.communicate()
-        
-        v_output = v_output.decode('ascii').strip()
-        
-        try:
-            v_error = v_error.decode('ascii').strip()
-        except AttributeError:
-            # if "v_error" returns 0
-            pass
+            # If ASM instance is running
+            if v_is_sid_active:
 
-        if g_debug:            
-            logger("---------------------------", True)
-            logger("output:", False)
-            logger(str (v_output), True)
-            logger("---------------------------", True)
+                # Create DB object for ASM instance
+                self.create_db_object(v_asm_sid, self.oracle_home, p_asm = True)
 
-        # 1. If there is an error terminate the module execution.
-        # (and) 2. If the error is reported for "OPatch Session completed with warnings" don't terminate the module execution.
-        if v_error and re.search(g_sw_opatch_check_pattern2,str (v_error)) is None:
+                # Set OH to GI
+                self.set_env(self.oracle_home)
 
-            if g_debug:
-                logger("subprocess error: " + str (v_error))
+                # Get databases online on this node from one CRS resource snapshot
+                logger("Registered databases:")
+                v_crs_databases = self.get_crs_databases()
 
-            fail_module(v_error)
+                # Optionally cross-check CRS resources with ASM clients
+                if self.asm_client_crosscheck:
+                    self.crosscheck_asm_clients(v_asm_sid, v_crs_databases)
 
-        else:
+                if v_crs_databases:
 
-            return str (v_output)
+                    for v_db_unique_name in v_crs_databases:
 
-    # @Description:
-    #   Function to check OPatch required version
-    #   It checks OPatch required version for all patches
-    # @Parameters:
-    #   None
-    # @Return:
-    #   None
-    # @Exception:
-    #   Module failure if OPatch version check fails
-    #
-    def check_opatch_min_version(self):
+                        v_inst_name, v_db_oracle_home = v_crs_databases[v_db_unique_name]
+                        logger("Database unique name/Instance name: " + v_db_unique_name + "/" + v_inst_name, p_notime = True)
 
-        global g_sw_opatch_min_version
+                        if v_inst_name in v_oratab_sid_list:
+                            v_db_oracle_home = v_oratab_sid_list[v_inst_name]
 
-        v_oracle_home   = str (self.oracle_home)
-        v_sw_stage      = str (self.sw_stage)
+                        if not v_db_oracle_home:
+                            logger("Oracle home for instance " + v_inst_name + " not found in oratab or CRS, skip.")
+                            continue
 
-        for patch in self.patch_list:
+                        self.create_db_object(p_sid = v_inst_name, p_ora_home = v_db_oracle_home, p_db_unique_name = v_db_unique_name)
+                        # # If ASM client matches to oratab list
+                        # if v_db_name not in v_oratab_sid_match:
+                        #     #v_oratab_sid_match[v_inst_name] = v_oratab_sid_list[v_inst_name]
+                        #     self.create_db_object(p_sid = v_inst_name, p_ora_home = v_oratab_sid_list[v_inst_name], p_db_name = v_db_name)
 
-            v_patch_obj = self.patch_list[patch]
+                else:
+                    logger("No databases found registered in local/cluster registry.")
 
-            logger("Check minumum OPatch version for OH: " + self.oracle_home)
+        else:
+            #
+            # 1. patch_only OH
+            #   -shutdown/start up ONLY active instances
 
-            v_patch_dir = v_patch_obj.patch_dir
-            v_patch_proactive_bp_id = v_patch_obj.patch_proactive_bp_id
-            v_patch_gi_id = v_patch_obj.patch_gi_id
-            v_patch_db_id = v_patch_obj.patch_db_id
-            v_patch_id = v_patch_obj.patch_id
-            v_is_combo = v_patch_obj.is_combo
+            # 2. patch all DBs
+            #   -shutdown/start up all active and inactive instances
 
-            v_command = v_oracle_home + "/OPatch/opatch prereq CheckMinimumOPatchVersion -phBaseDir " + v_sw_stage + "/" + v_patch_dir
+            # 3. patch specific DBs
+            #   -shutdown/start up only specific instances
 
-            if v_is_combo:
-                if v_patch_proactive_bp_id:
-                    v_command += "/" + str (v_patch_proactive_bp_id) + "/" + str (v_patch_db_id)
-                elif v_patch_gi_id:
-                    v_command += "/" + str (v_patch_gi_id) + "/" + str (v_patch_db_id)
+            for sid in v_oratab_sid_match:
 
-            output = self.run_os_command(v_command)
+                v_is_sid_active = v_process_snapshot.is_pmon_running(sid)
 
-            if re.search(g_sw_opatch_min_version,output) is None:
+                if v_is_sid_active:
 
-                p_message = "CheckMinimumOPatchVersion failed for " + self.oracle_home
-                fail_module(p_message)
+                    self.create_db_object(sid,v_oratab_sid_match[sid])
 
     # @Description:
-    #   Function to check patch conflicts against oracle home
+    #   Function to return databases online on this node from CRS
+    #   All database resources are read with one "crsctl stat res -f" call
+    #   and parsed into a resource table
     # @Parameters:
     #   None
     # @Return:
-    #   Command output/result
+    #   Dictionary of database unique name -> (instance name, resource oracle home)
     # @Exception:
-    #   Module failure if OPatch version check fails
+    #   None
     #
-    def check_conflict_against_oh(self):
-
-        global g_sw_opatch_check_conflict_pattern
-        global g_sw_opatch_spacecheck_pattern
+    def get_crs_databases(self):
 
-        v_oracle_home   = str (self.oracle_home)
-        v_sw_stage      = str (self.sw_stage)
-
-        for patch in self.patch_list:
+        v_command = "$ORACLE_HOME/bin/crsctl stat res -f -w \"TYPE = ora.database.type\""
+        v_resources = gf_parse_crs_resources(self.run_os_command(v_command, p_full_output = True))
 
-            v_patch_obj = self.patch_list[patch]
+        v_databases = {}
 
-            logger("Check conflict for patch: " + v_patch_obj.desc)
+        for v_resource in v_resources:
 
-            v_patch_dir = v_patch_obj.patch_dir
-            v_patch_proactive_bp_id = v_patch_obj.patch_proactive_bp_id
-            v_patch_gi_id = v_patch_obj.patch_gi_id
-            v_patch_db_id = v_patch_obj.patch_db_id
-            v_patch_ocw_id = v_patch_obj.patch_ocw_id
-            v_patch_dbwlm_id = v_patch_obj.patch_dbwlm_id
-            v_patch_acfs_id = v_patch_obj.patch_acfs_id
-            v_patch_id = v_patch_obj.patch_id
-            v_is_combo = v_patch_obj.is_combo
+            v_name = v_resource.get("NAME", "")
+            v_state = v_resource.get("STATE", "")
+            v_last_server = v_resource.get("LAST_SERVER", "")
 
-            v_command_list = {}
+            logger("CRS resource: " + v_name + ", state: " + v_state + ", last server: " + v_last_server, p_notime = True)
 
-            v_base_path_conflict = v_oracle_home + "/OPatch/opatch prereq CheckConflictAgainstOHWithDetail -phBaseDir " + v_sw_stage + "/" + v_patch_dir
-            v_base_path_space = v_oracle_home + "/OPatch/opatch prereq CheckSystemSpace -phBaseDir " + v_sw_stage + "/" + v_patch_dir
+            if not v_state.upper().startswith("ONLINE"):
+                continue
 
-            if v_is_combo:
-                if v_patch_proactive_bp_id:
-                    v_base_path_conflict += "/" + str (v_patch_proactive_bp_id)
-                    v_base_path_space += "/" + str (v_patch_proactive_bp_id)
-                elif v_patch_gi_id:
-                    v_base_path_conflict += "/" + str (v_patch_gi_id)
-                    v_base_path_space += "/" + str (v_patch_gi_id)
+            if v_last_server and g_hostname and v_last_server.lower() != g_hostname.lower():
+                continue
 
-                if v_patch_db_id:
-                    v_command_list["conflict_db"] = v_base_path_conflict + "/" + str (v_patch_db_id)
-                    v_command_list["space_db"] = v_base_path_space + "/" + str (v_patch_db_id)
+            v_db_unique_name = v_resource.get("DB_UNIQUE_NAME") or v_name.split(".")[1]
 
-                if v_patch_ocw_id:
-                    v_command_list["conflict_ocw"] = v_base_path_conflict + "/" + str (v_patch_ocw_id)
-                    v_command_list["space_ocw"] = v_base_path_space + "/" + str (v_patch_ocw_id)
+            # Instance name is defined per server for multi instance resources
+            v_inst_name = v_resource.get("USR_ORA_INST_NAME@SERVERNAME(" + v_last_server + ")") or v_resource.get("USR_ORA_INST_NAME")
 
-                if v_patch_dbwlm_id:
-                    v_command_list["conflict_dbwlm"] = v_base_path_conflict + "/" + str (v_patch_dbwlm_id)
-                    v_command_list["space_dbwlm"] = v_base_path_space + "/" + str (v_patch_dbwlm_id)
+            if v_inst_name:
+                v_databases[v_db_unique_name] = (v_inst_name, v_resource.get("ORACLE_HOME"))
 
-                if v_patch_acfs_id:
-                    v_command_list["conflict_acfs"] = v_base_path_conflict + "/" + str (v_patch_acfs_id)
-                    v_command_list["space_acfs"] = v_base_path_space + "/" + str (v_patch_acfs_id)
+        return v_databases
 
+    # @Description:
+    #   Function to cross-check CRS databases with ASM clients
+    #   ASM clients are read with files/get_asm_clients.sql
+    #   Differences are logged, they do not fail the module
+    # @Parameters:
+    #   p_asm_sid: ASM instance SID
+    #   p_crs_databases: databases from get_crs_databases
+    # @Return:
+    #   None
+    # @Exception:
+    #   None
+    #
+    def crosscheck_asm_clients(self, p_asm_sid, p_crs_databases):
 
-            for command in v_command_list:
+        v_command = "export ORACLE_SID=" + p_asm_sid + "; $ORACLE_HOME/bin/sqlplus -s / as sysasm @/tmp/orapatch_scripts/get_asm_clients"
+        v_output = self.run_os_command(v_command, p_full_output = True)
 
-                output = self.run_os_command(v_command_list[command])
+        # Output format: ;db_name,instance_name;db_name,instance_name
+        v_asm_instances = set()
+        for v_client in v_output.replace("\n", "").split(";"):
+            if "," in v_client:
+                v_asm_instances.add(v_client.split(",")[1].strip().lower())
 
-                if command[:8] == "conflict" and re.search(g_sw_opatch_check_conflict_pattern,output) is None:
+        v_crs_instances = set(p_crs_databases[db][0].lower() for db in p_crs_databases)
 
-                    p_message = "CheckConflictAgainstOHWithDetail failed for " + self.oracle_home
-                    fail_module(p_message)
+        logger("ASM clients: " + ", ".join(sorted(v_asm_instances)))
 
-                elif command[:5] == "space" and re.search(g_sw_opatch_spacecheck_pattern,output) is None:
+        for v_inst_name in sorted(v_asm_instances - v_crs_instances):
+            logger("Instance " + v_inst_name + " is an ASM client, but it is not an online CRS database resource on this node.")
 
-                    p_message = "CheckSystemSpace failed for " + self.oracle_home
-                    fail_module(p_message)
+        for v_inst_name in sorted(v_crs_instances - v_asm_instances):
+            logger("Instance " + v_inst_name + " is an online CRS database resource, but it is not an ASM client.")
 
     # @Description:
-    #   Function to initiate actual patching process
+    #   Function to create database object
     # @Parameters:
     #   None
     # @Return:
@@ -792,1184 +4940,1242 @@ class PatchProcess(object):
     # @Exception:
     #   None
     #
-    def patch_oh(self):
-
-        self.set_env(self.oracle_home)
-        
-        # start: "if self.is_crs"
-        if self.is_crs:
-
-            self.patch_grid_oh()
+    def create_db_object(self, p_sid
+                        , p_ora_home
+                        , p_asm = False
+                        , p_db_unique_name = None):
 
-            v_sleep_time = 10; # seconds
-            v_sleep_timeout = 600; # minutes
-            v_sleep_time_cnt = 0
+        global g_instance_list
 
-            v_command = "$ORACLE_HOME/bin/crsctl check has | grep -v \"is online$\" | wc -l"
-            v_stack_label = "CRS"
+        self.set_env(self.oracle_home)
 
-            if (self.is_cluster):
-                v_stack_label = "HAS"
-                v_command = "$ORACLE_HOME/bin/crsctl check crs | grep -v \"is online$\" | wc -l"
+        v_patch = False
 
-            while(True):
-                
-                v_result = self.run_os_command(v_command)
-                v_not_online_items = int(v_result)
+        if not p_asm:
 
-                if (v_not_online_items == 0):
-                    logger(v_stack_label + " is online, continue...")
-                    break
+            # if patching GI home we only to stop running databases
+            # no metadata is needed for databases
+            if self.is_crs:
 
-                if (v_sleep_time_cnt >= v_sleep_timeout):
-                    logger("Timeout: " + v_stack_label + " did not start within given 10 minutes period")
-                    fail_module("Error: " + v_stack_label + " start timeout. " + v_stack_label + " did not start within 10 minutes period")
+                v_db_initial_state = None
+                v_db_name = None
+                v_db_version = None
+                v_db_is_standby = None
+                v_db_is_rac = None
+                v_db_inst_list = None
+                v_db_hostname = None
+                v_crs_registered = True
+                v_db_unique_name = p_db_unique_name
 
-                logger(v_stack_label + " is not online, check again in 10 seconds...")
-                time.sleep(v_sleep_time)
-                
-                v_sleep_time_cnt += v_sleep_time
+            else:
 
-        else:
+                # get db name
+                v_db_metadata = gf_get_sqlplus_pool().execute(p_sid, p_ora_home, "@/tmp/orapatch_scripts/get_db_metadata").split(';')
+                logger("Database metadata: " + str (v_db_metadata))
+                # remove index 0 - used to catch output from gloging.sql
+                v_db_metadata.pop(0)
+                v_db_name = v_db_metadata[0]
 
-            self.patch_db_oh()
+                v_db_version = self.oh_version
+                v_db_hostname = g_hostname
+                v_db_inst_list = None # not used
+                v_db_unique_name = v_db_metadata[6]
 
-    # end: patch_oh
+                # Database configuration from CRS, None if not registered in CRS
+                v_srvctl_config = self.get_srvctl_config(v_db_unique_name)
 
-    # @Description:
-    #   Function to initiate patching process to DB dictionary
-    # @Parameters:
-    #   p_ojvm: indicator whether to patch JVM
-    # @Return:
-    #   None
-    # @Exception:
-    #   None
-    #
-    def patch_db(self, p_ojvm = False):
+                if v_srvctl_config is None:
+                    # Get database metadata from sql
+                    v_db_is_standby = False
+                    if v_db_metadata[2] == 'PHYSICAL STANDBY':
+                        v_db_is_standby = True
+                    v_db_is_rac = gf_to_bool(v_db_metadata[3])
+                    #if v_db_is_rac:
+                    #    v_db_inst_list = v_db_metadata[4].split(',')
+                    #else:
+                    #    v_db_inst_list = v_db_metadata[4]
+                    v_db_initial_state = v_db_metadata[5]
+                    v_crs_registered = False
 
-        if self.patch_db_all:
+                else:
+                    v_crs_registered = True
 
-            logger("Patch all databases for ORACLE_HOME: " + self.oracle_home)
+                    # Get database metadata details from CRS
+                    v_output = v_srvctl_config.get("database role", "")
+                    v_db_is_standby = False
+                    if v_output and v_output.upper().replace("_", " ") == "PHYSICAL STANDBY":
+                        v_db_is_standby = True
 
-        else:
+                    v_output = v_srvctl_config.get("type", "")
+                    v_db_is_rac = False
+                    if v_output and v_output.upper() == "RAC":
+                        v_db_is_rac = True
 
-            logger("Patch specific databases for ORACLE_HOME: " + self.oracle_home)
+                    v_output = v_srvctl_config.get("start options", "")
+                    v_db_initial_state = "OPEN"
+                    if v_output and v_output.upper() != "OPEN":
+                        v_db_initial_state = v_output
 
-            if not g_instance_list:
-                logger("No database found for patching.",True)
-            else:
 
-                for item in g_instance_list:
-                    logger("database: " + g_instance_list[item].name,True)
+                # Report which databases will be patched only if flag to patch only OH is set to False
+                if not self.patch_only_oh:
+                    if self.patch_db_all:
+                        v_patch = True
+                    elif self.patch_db_list:
+                        logger("db_unique_name list: " + str(self.patch_db_list))
+                        logger("Checking whether database ["+v_db_unique_name+"] exists in the user-defined list of databases.")
+                        if v_db_unique_name in self.patch_db_list:
+                            if v_db_is_standby:
+                                logger("Instance ["+v_db_unique_name+"] is found in the specified list, but it won't be patched because it's a standby.")
+                            else:
+                                v_patch = True
+                                logger("Instance ["+v_db_unique_name+"] is found in the specified list, will be patched.")
+                        else:
+                            logger("Instance ["+v_db_unique_name+"] is not in the specified list.")
+                else:
+                    v_patch = False
 
-        #db_list_to_patch = active_instance_list
+            logger("==========================", p_notime = True)
+            logger("Database details:", p_notime = True)
+            logger("Database name: " + str(v_db_name), p_notime = True)
+            logger("Database unique name: " + str(v_db_unique_name), p_notime = True)
+            logger("Database version: " + str(v_db_version), p_notime = True)
+            logger("Database hostname: " + str(v_db_hostname), p_notime = True)
+            logger("Database standby role: " + str(v_db_is_standby), p_notime = True)
+            logger("Database RAC: " + str(v_db_is_rac), p_notime = True)
+            logger("Database initial state: " + str(v_db_initial_state), p_notime = True)
+            logger("Database will be patched: " + str(v_patch), p_notime = True)
 
-        for dbname in g_instance_list:
+        else:
 
-            v_db_obj = g_instance_list[dbname]
+            v_db_name = None # not used in case of GI
+            v_db_unique_name = None
+            v_db_version = self.oh_version
+            v_db_hostname = g_hostname
+            v_db_inst_list = None # # not used in case of GI
+            v_db_is_standby = None # not used in case of GI
+            v_db_is_rac = None # not used in case of GI
+            v_db_initial_state = None # not used in case of GI
+            v_crs_registered = True
 
-            if not v_db_obj.patch:
-                logger("Skip database [" + v_db_obj.name + "/" + v_db_obj.db_unique_name + "].")
-                if v_db_obj.is_standby:
-                    logger("Database " + v_db_obj.name + " will not be patched because it's a standby database.",True)
-                continue
+        #end: if not p_asm
 
-            if v_db_obj.initial_state == "OPEN":
+        db_obj = DatabaseFactory(p_sid, v_db_version, v_db_name, p_asm, v_db_is_rac
+                                ,v_db_is_standby, v_db_inst_list, False
+                                ,v_db_initial_state, p_ora_home, v_db_hostname
+                                ,v_crs_registered, v_patch, v_db_unique_name)
 
-                if v_db_obj.version_short in g_supported_version_new:
-                    self.patch_db_12c(v_db_obj, p_ojvm)
+        if (g_function == "PATCH_DB" or g_function == "PATCH_DB_OJVM") and not db_obj.patch:
+            logger("Database [" + db_obj.db_unique_name + "] won't be patched.")
+            return
 
-                elif v_db_obj.version_short in g_supported_version_old:
-                    self.patch_db_pre_12c(v_db_obj, p_ojvm)
+        g_instance_list[p_sid] = db_obj
 
-            else:
+        #if is_down:
+        #    self.stop_instance(p_sid)
 
-                logger("Database " + v_db_obj.name + " will not be patched because its initial state is " + v_db_obj.initial_state + ".",True)
+        #logger ("db_name: " + db_obj.name)
+        #logger ("db_version: " + db_obj.version)
+        #logger ("is_standby: " + str (db_obj.is_standby))
+        #logger ("is_rac: " + str (db_obj.is_rac))
+        #logger ("inst_list: " + db_obj.instance_list)
+        #logger ("is_active: " + str (db_obj.is_active))
 
     # @Description:
-    #   Function to perform actual patching of DB dictionary for databases prior 12c version
+    #   Function to return CRS configuration of a database
+    #   For 12c and higher, the configuration of all databases is read with
+    #   one "srvctl config database -all" call (bulk mode) and kept for
+    #   later calls. If bulk mode is not available, or the database is
+    #   missing from the bulk result, one "srvctl config database" call for
+    #   the database is used.
     # @Parameters:
-    #   p_db_obj: database object
-    #   p_ojvm: indicator whether to patch JVM
+    #   p_db_unique_name: database unique name
     # @Return:
-    #   None
+    #   Dictionary of configuration attributes (lower case keys),
+    #   None if the database is not registered in CRS
     # @Exception:
     #   None
     #
-    def patch_db_pre_12c(self, p_db_obj, p_ojvm):
-
-        #if self.patch_db_id:
-        #logger("starting instance: " + p_db_obj.sid)
+    def get_srvctl_config(self, p_db_unique_name):
 
-        if not p_ojvm:
+        if self.srvctl_config is None:
 
-            self.start_instance(p_db_obj)
+            self.srvctl_config = {}
 
-            command = "export ORACLE_SID=" + p_db_obj.sid + "; " + self.oracle_home + "/bin/sqlplus / as sysdba <<< \"@" + self.oracle_home + "/rdbms/admin/catbundle.sql psu apply\""
-            logger("Now applying PSU for database dictionary: \"" + p_db_obj.sid + "\"", True)
-            output = self.run_os_command(command)
-            logger("Database dictionary \"" + p_db_obj.sid + "\" was patched. Check logfiles for errors.")
+            if self.oh_version in g_supported_version_new:
+                v_output = self.run_os_command("$ORACLE_HOME/bin/srvctl config database -all 2>&1", p_full_output = True)
+                self.srvctl_config = gf_parse_srvctl_config(v_output)
 
-        elif p_ojvm and self.patch_list[self.patch_id].patch_ojvm_id:
+            if self.srvctl_config:
+                logger("Databases registered in CRS: " + ", ".join(self.srvctl_config))
+            else:
+                # Bulk mode not available
+                self.srvctl_config = False
 
-            self.start_instance(p_db_obj, "upgrade")
+        if self.srvctl_config and p_db_unique_name.lower() in self.srvctl_config:
+            return self.srvctl_config[p_db_unique_name.lower()]
 
-            command = "export ORACLE_SID=" + p_db_obj.sid + "; " + self.oracle_home + "/bin/sqlplus / as sysdba <<< \"@" + self.oracle_home + "/sqlpatch/" + str (self.patch_list[self.patch_id].patch_ojvm_id) + "/postinstall.sql\""
-            logger("Now applying OJVM for database dictionary: """ + p_db_obj.sid + "", True)
-            output = self.run_os_command(command)
-            logger("Database dictionary \"" + p_db_obj.sid + "\" was patched. Check logfiles for errors.")
+        if self.oh_version in g_supported_version_old:
+            v_command = "$ORACLE_HOME/bin/srvctl config database -d " + p_db_unique_name + " -a 2>&1"
+        else:
+            v_command = "$ORACLE_HOME/bin/srvctl config database -db " + p_db_unique_name + " -all 2>&1"
 
-        self.stop_instance(p_db_obj)
+        return gf_parse_srvctl_config(self.run_os_command(v_command, p_full_output = True)).get(p_db_unique_name.lower())
 
     # @Description:
-    #   Function to perform actual patching of DB dictionary for 12c version and higher
+    #   Function to build listener list depended on oracle home being patched
     # @Parameters:
-    #   p_db_obj: database object
-    #   p_ojvm: indicator whether to patch JVM
+    #   p_oracle_home: oracle home being patched
     # @Return:
     #   None
     # @Exception:
     #   None
     #
-    def patch_db_12c(self, p_db_obj, p_ojvm):
-
-        if p_ojvm:
-            self.start_instance(p_db_obj, "upgrade")
-        else:
-            self.start_instance(p_db_obj)
+    def build_listener_list(self, p_oracle_home):
 
-        v_command = "export ORACLE_SID=" + p_db_obj.sid + "; $ORACLE_HOME/OPatch/datapatch -verbose"
+        # There might be unregistered listeners.
+        if self.is_crs:
+           logger("This is CRS configuration, opatchauto takes care.")
+           logger("Skipping BUILD_LISTENER_LIST.")
+           return
 
-        logger("Now patching database: \"" + p_db_obj.sid + "\"", p_notime = True)
+        global g_listener_list
 
-        v_output = self.run_os_command(v_command)
+        # Listeners running from the oracle home
+        v_listeners = gf_get_process_snapshot().get_listeners(p_oracle_home)
 
-        logger("Database dictionary \"" + p_db_obj.sid + "\" was patched. Check logfiles for errors.")
+        for listener in v_listeners:
+            logger("Listener running from OH: " + listener)
+            v_listener_obj = ListenerFactory(listener, p_oracle_home)
+            g_listener_list[v_listener_obj] = v_listener_obj
 
-        self.stop_instance(p_db_obj)
+        #logger("manage: " + str (g_listener_list))
 
     # @Description:
-    #   Function to perform actual patching of GI home
+    #   Function to stop an instance
     # @Parameters:
-    #   None
+    #   p_db_obj: database object
+    #   p_mode: what mode to use for shutdown operation
+    #   p_asm: indicator whether it's an ASM instance
     # @Return:
-    #   None
+    #   Output of shutdown operation
     # @Exception:
-    #   Module failure if patching process throws an error
+    #   None
     #
-    def patch_grid_oh(self):
+    def stop_instance(self, p_db_obj, p_mode = "immediate", p_asm = False):
 
-        v_sw_stage = str (self.sw_stage)
-        global g_ocmrf_file
+        if p_asm:
 
-        for item in self.patch_list:
+            logger("Skip ASM stop as opatchauto takes care")
 
-            v_patch_obj = self.patch_list[item]
+            # if self.oh_version in g_supported_version_new:
 
-            v_patch_proactive_bp_id = str (v_patch_obj.patch_proactive_bp_id)
-            v_patch_gi_id = str (v_patch_obj.patch_gi_id)
-            v_patch_db_id = str (v_patch_obj.patch_db_id)
-            v_patch_dir = v_patch_obj.patch_dir
+            #     v_argument_append = ""
 
-            if self.oh_version in g_supported_version_new:
+            #     if self.is_cluster:
+            #         v_argument_append = "-node " + p_db_obj.hostname
 
-                # Initially assume (initialize path to) GI only. Can change below.
-                # If it is DBBP only, v_patch_dir == v_patch_proactive_bp_id, therefore does not need to append v_patch_proactive_bp_id
-                v_path = self.oracle_home + "/OPatch/opatchauto apply " + v_sw_stage + "/" + v_patch_dir + " -oh " + self.oracle_home
+            #     v_command = "$ORACLE_HOME/bin/srvctl stop asm -force -stopoption " + p_mode + " " + v_argument_append
 
-                # COMBO of OJVM + DBBP
-                if v_patch_obj.is_dbbp and v_patch_obj.is_combo:
-                    v_path = self.oracle_home + "/OPatch/opatchauto apply " + v_sw_stage + "/" + v_patch_dir + "/" + v_patch_proactive_bp_id  + "/" + v_patch_db_id + " -oh " + self.oracle_home
+            # elif self.oh_version in g_supported_version_old:
 
-                # COMBO of OJVM + GI
-                if not v_patch_obj.is_dbbp and v_patch_obj.is_combo:
-                    v_path = self.oracle_home + "/OPatch/opatchauto apply " + v_sw_stage + "/" + v_patch_dir + "/" + v_patch_gi_id + " -oh " + self.oracle_home
+            #     v_argument_append = ""
 
-            if self.oh_version in g_supported_version_old:
+            #     if self.is_cluster:
+            #         v_argument_append = "-n " + p_db_obj.hostname
 
-                # COMBO of OJVM + GI
-                if v_patch_obj.is_combo:
-                    v_path = self.oracle_home + "/OPatch/opatch auto " + v_sw_stage + "/" + v_patch_dir + "/" + v_patch_gi_id + " -oh " + self.oracle_home + " -ocmrf " + g_ocmrf_file
+            #     v_command = "$ORACLE_HOME/bin/srvctl stop asm -f -o " + p_mode + " " + v_argument_append
 
-                # GI only, in such case v_patch_dir == v_patch_gi_id
-                if not v_patch_obj.is_combo:
-                    v_path = self.oracle_home + "/OPatch/opatch auto " + v_sw_stage + "/" + v_patch_dir + " -oh " + self.oracle_home + " -ocmrf " + g_ocmrf_file
+        else:
 
+            # Statement for sqlplus session if not controlled by srvctl
+            v_command, v_statement = self.get_instance_command(p_db_obj, "stop", p_mode)
 
-            if g_root_password:
-                v_command = "su -c \"" + v_path + "\""
-                g_expected_list["Password: "] = g_root_password + "\r"
-                v_output= self.run_os_command(v_command, p_expect = True)
-            else:
-                v_command = "sudo " + v_path
-                v_output= self.run_os_command(v_command)
+            logger("Stop instance: " + p_db_obj.sid)
 
-            if self.oh_version in g_supported_version_new:
-                if re.search(g_sw_opatchauto_check_pattern12, v_output) is not None:
-                    g_changed = True
-                    return
+            if v_command is None:
+                return gf_get_sqlplus_pool().execute(p_db_obj.sid, p_db_obj.oracle_home, v_statement)
 
-            if self.oh_version in g_supported_version_old:
-                if re.search(g_sw_opatchauto_check_pattern11, v_output) is not None:
-                    g_changed = True
-                    return
+            # Session to an instance stopped by srvctl is not usable anymore
+            gf_get_sqlplus_pool().close(p_sid = p_db_obj.sid)
 
-            if re.search(g_sw_opatch_no_need, v_output) is not None:
-                return
-            else:
-                fail_module("Error during applying patch for: " + self.oracle_home)
+            return self.run_os_command(v_command)
 
     # @Description:
-    #   Function to perform actual patching of OJVM to oracle home
+    #   Function to return the command stopping or starting a DB instance
+    #   RAC and CRS registered databases are controlled by srvctl, other
+    #   databases (and startup upgrade) by a sqlplus statement
     # @Parameters:
-    #   None
+    #   p_db_obj: database object
+    #   p_action: "stop" or "start"
+    #   p_mode: shutdown or startup mode
     # @Return:
-    #   None
+    #   Tuple (srvctl command, sqlplus statement), one of them is None
     # @Exception:
-    #   Module failure if patching process throws an error
+    #   None
     #
-    def patch_oh_ojvm(self):
-
-        global g_ocmrf_file
-        v_sw_stage = str (self.sw_stage)
-        v_patch_id = str (self.patch_id)
+    def get_instance_command(self, p_db_obj, p_action, p_mode):
 
-        for item in self.patch_list:
+        v_command = None
+        v_statement = None
+        v_srvctl = p_action == "stop" or p_mode != "upgrade"
 
-            v_patch_obj = self.patch_list[item]
+        if self.oh_version in g_supported_version_new:
 
-            v_patch_dir             = v_patch_obj.patch_dir
-            v_patch_ojvm_id         = str (v_patch_obj.patch_ojvm_id)
+            v_stopoption = " -stopoption " + p_mode if p_action == "stop" else ""
 
-            if (v_patch_obj.patch_ojvm_id):
+            if p_db_obj.is_rac and v_srvctl:
+                v_command = "$ORACLE_HOME/bin/srvctl " + p_action + " instance -db " + p_db_obj.db_unique_name + v_stopoption + " -instance " + p_db_obj.sid
+            elif p_db_obj.crs_registered and v_srvctl:
+                v_command = "$ORACLE_HOME/bin/srvctl " + p_action + " database -db " + p_db_obj.db_unique_name + v_stopoption
 
-                v_command = self.oracle_home + "/OPatch/opatch apply -silent " + v_sw_stage + "/" + v_patch_dir + "/" + v_patch_ojvm_id
+        elif self.oh_version in g_supported_version_old:
 
-                if self.oh_version in g_supported_version_old:
-                    v_command += " -ocmrf " + g_ocmrf_file
-            
-                output= self.run_os_command(v_command)
+            v_stopoption = " -o " + p_mode if p_action == "stop" else ""
 
-                if re.search(g_sw_opatch_check_pattern1,output) is not None or re.search(g_sw_opatch_check_pattern2,output) is not None:
-                    g_changed = True
+            if p_db_obj.is_rac and v_srvctl:
+                v_command = "$ORACLE_HOME/bin/srvctl " + p_action + " instance -d " + p_db_obj.db_unique_name + v_stopoption + " -i " + p_db_obj.sid
+            elif p_db_obj.crs_registered and v_srvctl:
+                v_command = "$ORACLE_HOME/bin/srvctl " + p_action + " database -d " + p_db_obj.db_unique_name + v_stopoption
 
-                elif re.search(g_sw_opatch_no_need,output) is not None:
-                    pass
+        if v_command is None:
+            v_statement = ("shutdown " if p_action == "stop" else "startup ") + p_mode
 
-                else:
-                    fail_module("Error during applying patch for: " + self.oracle_home)
-            else:
-                logger("Skip OJVM as the patch could not be identified.")
+        return v_command, v_statement
 
     # @Description:
-    #   Function to perform actual patching of DB oracle home
+    #   Function to stop a listener
     # @Parameters:
-    #   None
+    #   p_listener: listener to be stopped
     # @Return:
-    #   None
+    #   Output of listener stop operation
     # @Exception:
-    #   Module failure if patching process throws an error
+    #   None
     #
-    def patch_db_oh(self):
-
-        v_sw_stage = str (self.sw_stage)
-        v_patch_id = str (self.patch_id)
-
-        for item in self.patch_list:
-
-            v_patch_obj = self.patch_list[item]
-
-            v_patch_proactive_bp_id = str (v_patch_obj.patch_proactive_bp_id)
-            v_patch_db_id           = str (v_patch_obj.patch_db_id)
-            v_patch_gi_id           = str (v_patch_obj.patch_gi_id)
-            v_patch_dir             = v_patch_obj.patch_dir
-
-            # Define patch path
-            v_command = self.oracle_home+"/OPatch/opatch apply -silent " + v_sw_stage + "/" + v_patch_dir
-
-            #
-            # Valid cases:
-            #
-            #   1. if patch is DBBP only - in this case v_patch_dir == v_patch_proactive_bp_id, therefore only append v_patch_db_id
-            #      (v_patch_proactive_bp_id and not v_patch_obj.is_combo)
-            #
-            #   2. if patch is COMBO of OJVM + DB. Need to be sure it is not COMBO with DBBP or COMBO with GI
-            #      (not v_patch_proactive_bp_id and v_patch_obj.is_combo and not v_patch_obj.is_grid)
-            #
-            #   3. if patch is GI only
-            #      (v_patch_obj.is_grid and not v_patch_obj.is_combo)
-            #
-            if ((v_patch_obj.is_dbbp and not v_patch_obj.is_combo)
-                or (not v_patch_obj.is_dbbp and v_patch_obj.is_combo and not v_patch_obj.is_grid)
-                or (v_patch_obj.is_grid and not v_patch_obj.is_combo)):
-                v_command += "/" + v_patch_db_id
-
-            #
-            # Valid cases:
-            #
-            #   1. If patch is COMBO of OJVM + DBBP
-            #
-            if v_patch_obj.is_combo and v_patch_obj.is_dbbp:
-                v_command += "/" + v_patch_proactive_bp_id + "/" + v_patch_db_id
-
-            # Valid cases:
-            #
-            #   1. if patch is COMBO of OJVM + GI
-            # 
-            if v_patch_obj.is_grid and v_patch_obj.is_grid:
-                v_command += "/" + v_patch_gi_id + "/" + v_patch_db_id
-
-            if self.oh_version in g_supported_version_old:
-                v_command += " -ocmrf " + g_ocmrf_file
-
-            output= self.run_os_command(v_command)
+    def stop_listener(self, p_listener):
 
-            if re.search(g_sw_opatch_check_pattern1,output) is not None or re.search(g_sw_opatch_check_pattern2,output) is not None:
-                g_changed = True
+        v_command = "$ORACLE_HOME/bin/lsnrctl stop " + p_listener
 
-            elif re.search(g_sw_opatch_no_need,output) is not None:
-                pass
+        logger("Stopping listener: " + p_listener)
 
-            else:
-                fail_module("Error during applying patch for: " + self.oracle_home)
+        return self.run_os_command(v_command)
 
     # @Description:
-    #   Function to stop active services
-    #   Only necessary services are stopped from the home that is being patched
+    #   Function to start an instance
     # @Parameters:
-    #   None
+    #   p_db_obj: database object
+    #   p_mode: mode used for startup operation
+    #   p_asm: indicator whether the instance is an ASM instance
     # @Return:
-    #   None
+    #   Output of startup operation
     # @Exception:
     #   None
     #
-    def stop_services_from_oh(self):
+    def start_instance(self, p_db_obj, p_mode = "open", p_asm = False):
 
-        global g_instance_list
-        global g_listener_list
+        if p_asm:
 
-        if not g_instance_list and not g_listener_list:
-            logger("No instances or listeners found to stop.")
-            return
+            logger("Skip ASM start as opatchauto takes care")
+            # v_argument_append = ""
 
-        # Stop active listeners
-        for item in g_listener_list:
+            # if self.is_cluster:
 
-            self.set_env(item.oracle_home)
-            self.stop_listener(item.listener_name)
+            #     if self.oh_version in g_supported_version_new:
 
-        # if self.is_crs:
-        #     logger("This is CRS configuration, opatchauto takes care.")
-        #     logger("Skipping STOP_SERVICES_FROM_OH.")
-        #     return
+            #         v_argument_append = "-node " + p_db_obj.hostname
 
-        # Stop active instances from specified OH
-        for item in g_instance_list:
+            #     elif self.oh_version in g_supported_version_old:
 
-            v_db_obj = g_instance_list[item]
+            #         v_argument_append = "-n " + p_db_obj.hostname
 
-            if not v_db_obj.is_asm:
+            # v_command = "$ORACLE_HOME/bin/srvctl start asm " + v_argument_append
 
-                self.set_env(v_db_obj.oracle_home)
-                self.stop_instance(v_db_obj)
+        else:
 
-        #Stop active ASM instances from specified OH
-        for item in g_instance_list:
+            # Statement for sqlplus session if not controlled by srvctl
+            v_command, v_statement = self.get_instance_command(p_db_obj, "start", p_mode)
 
-            v_db_obj = g_instance_list[item]
+            logger("Starting instance: " + p_db_obj.sid)
 
-            if v_db_obj.is_asm:
+            if v_command is None:
+                return gf_get_sqlplus_pool().execute(p_db_obj.sid, p_db_obj.oracle_home, v_statement)
 
-                self.set_env(v_db_obj.oracle_home)
-                self.stop_instance(v_db_obj, p_asm = True)
+            return self.run_os_command(v_command)
 
     # @Description:
-    #   Function to start services
-    #   Only services that were stopped by this module are started
+    #   Function to start listener
     # @Parameters:
-    #   None
+    #   p_listener: listener to be started
     # @Return:
+    #   Output of startup operation
+    # @Exception:
     #   None
+    #
+    def start_listener(self, p_listener):
+
+        v_command = "$ORACLE_HOME/bin/lsnrctl start " + p_listener
+
+        logger("Starting listener: " + p_listener)
+
+        return self.run_os_command(v_command)
+
+    # @Description:
+    #   Function to start listener
+    # @Parameters:
+    #   p_listener: listener to be started
+    # @Return:
+    #   Output of startup operation
     # @Exception:
     #   None
     #
-    def start_services_from_oh(self):
+    def check_running_services_from_oh(self):
 
-        # if self.is_crs:
-        #     logger("This is CRS configuration, opatchauto takes care.")
-        #     logger("Skipping START_SERVICES_FROM_OH.")
-        #     return
+        if self.is_crs:
+            logger("This is CRS configuration, opatchauto takes care.")
+            logger("Skip CHECK_RUNNING_SERVICES_FROM_OH.")
+            return
 
         global g_instance_list
-        global g_listener_list
 
-        if not g_instance_list and not g_listener_list:
-            logger("No instances or listeners found to start.")
-            return
+        v_fail = False
+
+        # Services were stopped, take a new process table snapshot
+        v_process_snapshot = gf_get_process_snapshot(p_refresh = True)
+
+        if not self.is_crs:
+            # Check running processes from OH
+            v_pids = v_process_snapshot.get_home_processes(self.oracle_home)
+
+            if v_pids:
+
+                logger("Running processes under OH: " + str (v_pids))
+                v_fail = True
 
-        # Start previously stopped ASM instances
         for item in g_instance_list:
 
             v_db_obj = g_instance_list[item]
 
-            if v_db_obj.is_asm:
+            if v_db_obj.initial_state != "DOWN":
+
+                if v_process_snapshot.is_pmon_running(v_db_obj.sid, p_asm = v_db_obj.is_asm):
+
+                    logger("Instance is still running: " + v_db_obj.sid)
+                    v_fail = True
+
+        #if not found_home_oratab:
+            #module.fail_json(rc=256, msg="Oracle home " + self.oracle_home+" was not found in " + g_file_oratab)
+        #    p_message = "Oracle home " + self.oracle_home+" was not found in " + g_file_oratab
+        #    fail_module(p_message)
+        if v_fail:
+            #module.fail_json(rc=256, msg="There are active services under " + self.oracle_home)
+            p_message = "There are running processes under " + self.oracle_home
+
+            fail_module(p_message)
 
-                self.set_env(g_instance_list[item].oracle_home)
-                self.start_instance(g_instance_list[item], p_asm = True)
+    # @Description:
+    #   Function to check whether patches are already applied to the oracle home
+    #   No JVM is started (see gf_get_applied_patches)
+    # @Parameters:
+    #   p_patch_ids: list of patch IDs
+    # @Return:
+    #   True if all patches are applied
+    # @Exception:
+    #   None
+    #
+    def check_patch_exist(self, p_patch_ids):
 
-        logger("Now starting: [instance_list]: " + str (g_instance_list))
-        # Start previously stopped DB instances
-        for item in g_instance_list:
+        global g_patch_applied
 
-            v_db_obj = g_instance_list[item]
-            #logger("Now starting: [db_name]: " + str (v_db_obj.name))
-            #logger("Now starting: [initial_state]: " + str (v_db_obj.initial_state))
-            #logger("Now starting  [is_asm]: " + str (v_db_obj.is_asm))
-            if not v_db_obj.is_asm:
+        v_start = time.monotonic()
+        v_missing = self.get_missing_patches(p_patch_ids)
 
-                v_db_obj = g_instance_list[item]
-                self.set_env(v_db_obj.oracle_home)
+        g_patch_applied = not v_missing
 
-                if v_db_obj.initial_state == "OPEN" or self.is_crs:
+        logger("Checking if patches " + ", ".join(str (item) for item in p_patch_ids) + " are already applied (" + "%.3f" % (time.monotonic() - v_start) + " seconds).")
 
-                    self.start_instance(v_db_obj, "open")
+        if g_patch_applied:
+            logger("All patches are already installed.")
+        else:
+            logger("Patches not installed: " + ", ".join(str (item) for item in v_missing))
 
-                elif v_db_obj.initial_state == "MOUNTED":
+        g_output["patch_exist"] = { "patches": p_patch_ids, "missing": v_missing, "applied": g_patch_applied }
 
-                    self.start_instance(v_db_obj, "mount")
+        return g_patch_applied
 
-                else:
-                    logger("Database instance " + v_db_obj.sid + " not started. Wrong initial state.")
-                    logger("Database instance initial state: " + str (v_db_obj.initial_state))
+    # @Description:
+    #   Function to return the patches of a list not applied to the oracle home
+    #   The inventory is read natively (gf_get_applied_patches)
+    # @Parameters:
+    #   p_patch_ids: list of patch IDs
+    # @Return:
+    #   List of patch IDs not applied
+    # @Exception:
+    #   None
+    #
+    def get_missing_patches(self, p_patch_ids):
 
-        # Start previously stopped listeners
-        for item in g_listener_list:
+        v_applied = gf_get_applied_patches(self.oracle_home)
 
-            self.set_env(item.oracle_home)
-            self.start_listener(item.listener_name)
+        return [item for item in p_patch_ids if int(item) not in v_applied]
 
     # @Description:
-    #   Function to identify databases and build database objects
-    #   If oracle home is part of CRS database list is build from CRS
-    #   otherwise, database list is build from oratab file
+    #   Function to return the patch IDs installed into the oracle home by PATCH_OH
+    #   GI home: DB, OCW, ACFS and DBWLM sub-patches
+    #   DB home: the patch applied by OPatch (last directory of get_db_oh_patch_dir)
     # @Parameters:
     #   None
     # @Return:
-    #   None
+    #   List of patch IDs
     # @Exception:
     #   None
     #
-    def build_instance_list(self):
+    def get_oh_patch_ids(self):
 
-        # if self.is_crs:
-        #     logger("This is CRS configuration, opatchauto takes care.")
-        #     logger("Skip BUILD_INSTANCE_LIST.")
-        #     return
+        v_patch_ids = []
 
-        global g_file_oratab
-        global g_hostname
+        for item in self.patch_list:
 
-        v_oratab_sid_match = {}
-        v_oratab_asm_sid_match = {}
-        v_oratab_sid_list = {}
+            v_patch_obj = self.patch_list[item]
 
-        # Build list of DBs defined in oratab
-        f = open(g_file_oratab,'r')
-        lines_oratab = list(f)
+            if self.is_crs:
+                v_ids = [v_patch_obj.patch_db_id, v_patch_obj.patch_ocw_id, v_patch_obj.patch_acfs_id, v_patch_obj.patch_dbwlm_id]
+                v_patch_ids += [int(v_id) for v_id in v_ids if v_id] or [int(v_patch_obj.patch_id)]
+            else:
+                v_patch_ids.append(int(os.path.basename(self.get_db_oh_patch_dir(v_patch_obj))))
 
-        for line in lines_oratab:
+        return v_patch_ids
 
-            if not line.startswith('#') and not line.startswith('\n'):
+    def check_cluster_patch_db_dict(self):
 
-                line_elements = line.split(':')
-                v_oratab_sid_list[line_elements[0]] = line_elements[1]
+        global g_patch_db_dict
+        global g_check_cluster_state
 
-        f.close
+        g_patch_db_dict = True
 
-        # Build list of DBs from oratab which map to specified OH
-        for item in v_oratab_sid_list:
+        logger("Checking if cluster is in NORMAL upgrade state.")
+        v_command = "if [ -f /etc/oracle/olr.loc ]; then cat /etc/oracle/olr.loc | grep 'crs_home=' | awk '{split($0,list,\"=\"); print list[2]}'; fi"
+        v_gi_home= self.run_os_command(v_command, p_full_output = True)
 
-            if v_oratab_sid_list[item] == self.oracle_home:
+        logger("CRS_HOME: " + v_gi_home)
 
-                if self.is_crs:
+        if len (v_gi_home) > 0:
 
-                    v_oratab_asm_sid_match[item] = v_oratab_sid_list[item]
-                else:
+            g_patch_db_dict = False
+            v_command = "su -c \"" + v_gi_home + "/bin/crsctl query crs activeversion -f\""
+            g_expected_list["Password: "] = g_root_password + "\r"
+            v_output= self.run_os_command(v_command, p_expect = True)
 
-                    v_oratab_sid_match[item] = v_oratab_sid_list[item]
+            if re.search(g_check_cluster_state,v_output):
+                g_patch_db_dict = True
+            else:
+                logger("Cluster state is: " + v_output)
+                logger("Database dictionary won't be patched.")
 
-        # If OH is GI
-        if self.is_crs:
+    def patchprocess_pre_patch(self):
 
-            # Get 1st key from "v_oratab_asm_sid_match"
-            #   - since it's GI, we're assuming only one ASM per GI.
-            v_asm_sid = list(v_oratab_asm_sid_match.keys())[0]
+        gf_run_phase(g_function + " => BUILD_INSTANCE_LIST", self.build_instance_list)
 
-            # Check if ASM is running
-            v_command = "ps -ef | grep -iw [a]sm_pmon_" + v_asm_sid + " | wc -l"
-            output = self.run_os_command(v_command)
-            v_is_sid_active = int(output)
+        if g_function != "PATCH_DB" and g_function != "PATCH_DB_OJVM":
+            gf_run_phase(g_function + " => BUILD_LISTENER_LIST", functools.partial(self.build_listener_list, self.oracle_home))
 
-            # If ASM instance is running
-            if v_is_sid_active:
+        gf_run_phase(g_function + " => STOP_SERVICES_FROM_OH", self.stop_services_from_oh)
 
-                # Create DB object for ASM instance
-                self.create_db_object(v_asm_sid, self.oracle_home, p_asm = True)
+        if g_function != "PATCH_DB" and g_function != "PATCH_DB_OJVM":
+            gf_run_phase(g_function + " => CHECK_RUNNING_SERVICES_FROM_OH", self.check_running_services_from_oh)
 
-                # Set OH to GI
-                self.set_env(self.oracle_home)
 
-                # Get ASM clients
-                logger("Registered databases:")
-                v_command = "$ORACLE_HOME/bin/crsctl stat res -f -w \"(TYPE = ora.database.type) and (STATE = ONLINE)\" | grep -i \"^NAME=\" | uniq || paste -s -d, -"
-                v_result = self.run_os_command(v_command)                
+    def patchprocess_post_patch(self):
 
-                if v_result:
-                    
-                    v_crs_registered_dbs = v_result.split(',')
+        gf_run_phase(g_function + " => START_SERVICES_FROM_OH", self.start_services_from_oh)
 
-                    for client in v_crs_registered_dbs:
-                        v_db_unique_name = client.split('=')[1].split('.')[1]
 
-                        v_command = "$ORACLE_HOME/bin/crsctl stat res -f -w \"(TYPE = ora.database.type) and (NAME = ora." + v_db_unique_name + ".db) and (LAST_SERVER = " + g_hostname + ")\" | grep -i \"^USR_ORA_INST_NAME=\""
-                        v_result = self.run_os_command(v_command)
+    def patchprocess_main(self):
 
-                        if (v_result):
-                            v_inst_name = v_result.split('=')[1]
-                            logger("Database unique name/Instance name: " + v_db_unique_name + "/" + v_inst_name, p_notime = True)
+        # Build list of patches which will be applied
+        self.build_patch_dict()
 
-                            self.create_db_object(p_sid = v_inst_name, p_ora_home = v_oratab_sid_list[v_inst_name], p_db_unique_name = v_db_unique_name)
-                            # # If ASM client matches to oratab list
-                            # if v_db_name not in v_oratab_sid_match:
-                            #     #v_oratab_sid_match[v_inst_name] = v_oratab_sid_list[v_inst_name]
-                            #     self.create_db_object(p_sid = v_inst_name, p_ora_home = v_oratab_sid_list[v_inst_name], p_db_name = v_db_name)
+        # Use patches from the host local stage cache (STAGE reads from swlib_path)
+        if self.stage_cache and g_function != "STAGE":
+            self.use_stage_cache()
 
-                else:
-                    logger("No databases found registered in local/cluster registry.")
+        v_patch_obj = self.patch_list[self.patch_id]
 
-        else:
-            #
-            # 1. patch_only OH
-            #   -shutdown/start up ONLY active instances
+        # Context of the commands stored in the timing history
+        g_history_context.update({ "oracle_home": self.oracle_home, "version": self.oh_version,
+                                   "patch_id": self.patch_id, "function": g_function })
 
-            # 2. patch all DBs
-            #   -shutdown/start up all active and inactive instances
+        if not pexpect_found:
+            fail_module("Required \"pexpect\" (RPM) library not found")
 
-            # 3. patch specific DBs
-            #   -shutdown/start up only specific instances
+        if g_function == "CHECK_OPATCH_MIN_VERSION":
 
-            for sid in v_oratab_sid_match:
+            gf_run_phase("FUNC => CHECK_OPATCH_MIN_VERSION", self.check_opatch_min_version)
 
-                v_command = "ps -ef | grep -iw [o]ra_pmon_" + sid + " | wc -l"
+        elif g_function == "CHECK_CONFLICT_AGAINST_OH":
 
-                v_output = self.run_os_command(v_command)
-                v_is_sid_active = int(v_output)
+            gf_run_phase("FUNC => CHECK_CONFLICT_AGAINST_OH", self.check_conflict_against_oh)
+            g_changed = False
 
-                if v_is_sid_active == 1:
+        elif g_function == "PATCH_OH" and not self.only_prereq:
 
-                    self.create_db_object(sid,v_oratab_sid_match[sid])
+            # Services are not stopped if the patches are already applied
+            if gf_run_phase(g_function + " => CHECK_PATCH_EXISTENCE", functools.partial(self.check_patch_exist, self.get_oh_patch_ids())):
+                logger("Skip PATCH_OH.")
+                return
 
-    # @Description:
-    #   Function to create database object
-    # @Parameters:
-    #   None
-    # @Return:
-    #   None
-    # @Exception:
-    #   None
-    #
-    def create_db_object(self, p_sid
-                        , p_ora_home
-                        , p_asm = False
-                        , p_db_unique_name = None):
+            self.patchprocess_pre_patch()
 
-        global g_instance_list
+            gf_run_phase("FUNC => PATCH_OH", self.patch_oh)
 
-        self.set_env(self.oracle_home)
+            self.patchprocess_post_patch()
 
-        v_patch = False
+        elif g_function == "PATCH_DB" and not self.patch_only_oh and not self.is_only_oh() and not self.is_crs:
 
-        if not p_asm:
+            if self.is_cluster:
+                self.check_cluster_patch_db_dict()
+                if not g_patch_db_dict:
+                    return
 
-            # if patching GI home we only to stop running databases
-            # no metadata is needed for databases
-            if self.is_crs:
+            self.patchprocess_pre_patch()
 
-                v_db_initial_state = None
-                v_db_name = None
-                v_db_version = None
-                v_db_is_standby = None
-                v_db_is_rac = None
-                v_db_inst_list = None
-                v_db_hostname = None
-                v_crs_registered = True
-                v_db_unique_name = p_db_unique_name
+            gf_run_phase("FUNC => PATCH_DB", self.patch_db)
+
+            self.patchprocess_post_patch()
+
+        elif g_function == "PATCH_OH_OJVM" and not self.patch_only_oh and not self.is_only_oh() and not self.is_crs:
+
+            if self.get_ojvm_patch_ids():
+
+                # Services are not stopped if the patches are already applied
+                if gf_run_phase(g_function + " => CHECK_PATCH_EXISTENCE", functools.partial(self.check_patch_exist, self.get_ojvm_patch_ids())):
+                    logger("Skip PATCH_OH_OJVM.")
+                    return
+
+                self.patchprocess_pre_patch()
+
+                gf_run_phase("FUNC => PATCH_OH_OJVM", self.patch_oh_ojvm)
+
+                self.patchprocess_post_patch()
 
             else:
+                logger("Skip OJVM.")
+                logger("OJVM patch number not defined in patch metadata file.")
 
-                # get db name
-                v_command = "export ORACLE_SID=""" + p_sid + "; $ORACLE_HOME/bin/sqlplus -s / as sysdba @/tmp/orapatch_scripts/get_db_metadata"
-                v_db_metadata = self.run_os_command(v_command).split(';')
-                logger("Database metadata: " + str (v_db_metadata))
-                # remove index 0 - used to catch output from gloging.sql
-                v_db_metadata.pop(0)
-                v_db_name = v_db_metadata[0]
+        elif g_function == "PATCH_DB_OJVM" and not self.patch_only_oh and not self.is_only_oh() and not self.is_crs:
 
-                v_db_version = self.oh_version
-                v_db_hostname = g_hostname
-                v_db_inst_list = None # not used
-                v_db_unique_name = v_db_metadata[6]
+            if self.get_ojvm_patch_ids():
+            
+                if self.is_cluster:
+                    self.check_cluster_patch_db_dict()
+                    if not g_patch_db_dict:
+                        return
 
-                v_argument_append = "-db"
-                if self.oh_version in g_supported_version_old:
-                    v_argument_append = "-d"
+                self.patchprocess_pre_patch()
 
-                v_command = "$ORACLE_HOME/bin/srvctl status database " + v_argument_append + " " + v_db_unique_name + " | grep -Ei \"Database is (not ){0,1}running\" | wc -l"
-                v_output = self.run_os_command(v_command)
+                gf_run_phase("FUNC => PATCH_DB_OJVM", functools.partial(self.patch_db, p_ojvm = True))
 
-                if int(v_output) == 0:
-                    # Get database metadata from sql
-                    v_db_is_standby = False
-                    if v_db_metadata[2] == 'PHYSICAL STANDBY':
-                        v_db_is_standby = True
-                    v_db_is_rac = gf_to_bool(v_db_metadata[3])
-                    #if v_db_is_rac:
-                    #    v_db_inst_list = v_db_metadata[4].split(',')
-                    #else:
-                    #    v_db_inst_list = v_db_metadata[4]
-                    v_db_initial_state = v_db_metadata[5]
-                    v_crs_registered = False
+                self.patchprocess_post_patch()
 
-                elif int(v_output) == 1:
-                    v_crs_registered = True
+            else:
+                logger("Skip OJVM.")
+                logger("OJVM patch number not defined in patch metadata file.")
 
-                    # Get database metadata details from CRS
-                    if self.oh_version in g_supported_version_old:
-
-                        v_command = "$ORACLE_HOME/bin/srvctl config database -d " + v_db_unique_name + " -a | grep -i \"^Database role:\""
-                        v_output = self.run_os_command(v_command).split(':')[1].strip()
-                        v_db_is_standby = False
-                        if v_output and v_output.upper() == "PHYSICAL STANDBY":
-                            v_db_is_standby = True
-
-                        v_command = "$ORACLE_HOME/bin/srvctl config database -d " + v_db_unique_name + " -a | grep -i \"^Type:\""
-                        v_output = self.run_os_command(v_command)
-                        v_db_is_rac = False
-
-                        if v_output:
-                            if v_output.split(':')[1].upper() == "RAC":
-                                v_db_is_rac = True
-
-                        v_command = "$ORACLE_HOME/bin/srvctl config database -d " + v_db_unique_name + " -a | grep -i \"^Start options:\""
-                        v_output = self.run_os_command(v_command).split(':')[1].strip()
-                        v_db_initial_state = "OPEN"
-                        if v_output and v_output.upper() != "OPEN":
-                            v_db_initial_state = v_output
-
-                    elif self.oh_version in g_supported_version_new:
-
-                        v_command = "$ORACLE_HOME/bin/srvctl config database -db " + v_db_unique_name + " -all | grep -i \"^Database role:\""
-                        v_output = self.run_os_command(v_command).split(':')[1].strip()
-                        v_db_is_standby = False
-                        if v_output and v_output.upper() == "PHYSICAL STANDBY":
-                            v_db_is_standby = True
-
-                        v_command = "$ORACLE_HOME/bin/srvctl config database -db " + v_db_unique_name + " -all | grep -i \"^Type:\""
-                        v_output = self.run_os_command(v_command)
-                        v_db_is_rac = False
-
-                        if v_output:
-                            if v_output.split(':')[1].strip().upper() == "RAC":
-                                v_db_is_rac = True
-
-                        v_command = "$ORACLE_HOME/bin/srvctl config database -db " + v_db_unique_name + " -all | grep -i \"^Start options:\""
-                        v_output = self.run_os_command(v_command).split(':')[1].strip()
-                        v_db_initial_state = "OPEN"
-                        if v_output and v_output.upper() != "OPEN":
-                            v_db_initial_state = v_output
-                else:
-                    fail_module("Failed in determing whether database is registered in CRS.")
+        elif g_function == "PATCH_ALL" and not self.only_prereq:
 
+            self.patchprocess_all(v_patch_obj)
 
-                # Report which databases will be patched only if flag to patch only OH is set to False
-                if not self.patch_only_oh:
-                    if self.patch_db_all:
-                        v_patch = True
-                    elif self.patch_db_list:
-                        logger("db_unique_name list: " + str(self.patch_db_list))
-                        logger("Checking whether database ["+v_db_unique_name+"] exists in the user-defined list of databases.")
-                        if v_db_unique_name in self.patch_db_list:
-                            if v_db_is_standby:
-                                logger("Instance ["+v_db_unique_name+"] is found in the specified list, but it won't be patched because it's a standby.")
-                            else:
-                                v_patch = True
-                                logger("Instance ["+v_db_unique_name+"] is found in the specified list, will be patched.")
-                        else:
-                            logger("Instance ["+v_db_unique_name+"] is not in the specified list.")
-                else:
-                    v_patch = False
+        elif g_function == "PATCH_OOP" and not self.only_prereq:
 
-            logger("==========================", p_notime = True)
-            logger("Database details:", p_notime = True)
-            logger("Database name: " + str(v_db_name), p_notime = True)
-            logger("Database unique name: " + str(v_db_unique_name), p_notime = True)
-            logger("Database version: " + str(v_db_version), p_notime = True)
-            logger("Database hostname: " + str(v_db_hostname), p_notime = True)
-            logger("Database standby role: " + str(v_db_is_standby), p_notime = True)
-            logger("Database RAC: " + str(v_db_is_rac), p_notime = True)
-            logger("Database initial state: " + str(v_db_initial_state), p_notime = True)
-            logger("Database will be patched: " + str(v_patch), p_notime = True)
+            self.patchprocess_out_of_place()
 
-        else:
+        elif g_function == "STAGE":
 
-            v_db_name = None # not used in case of GI
-            v_db_unique_name = None
-            v_db_version = self.oh_version
-            v_db_hostname = g_hostname
-            v_db_inst_list = None # # not used in case of GI
-            v_db_is_standby = None # not used in case of GI
-            v_db_is_rac = None # not used in case of GI
-            v_db_initial_state = None # not used in case of GI
-            v_crs_registered = True
+            gf_run_phase("FUNC => STAGE", self.stage_patches)
 
-        #end: if not p_asm
+        elif g_function == "PLAN":
 
-        db_obj = DatabaseFactory(p_sid, v_db_version, v_db_name, p_asm, v_db_is_rac
-                                ,v_db_is_standby, v_db_inst_list, False
-                                ,v_db_initial_state, p_ora_home, v_db_hostname
-                                ,v_crs_registered, v_patch, v_db_unique_name)
+            gf_run_phase("FUNC => PLAN", self.plan)
 
-        if (g_function == "PATCH_DB" or g_function == "PATCH_DB_OJVM") and not db_obj.patch:
-            logger("Database [" + db_obj.db_unique_name + "] won't be patched.")
-            return
+        elif g_function == "HISTORY":
 
-        g_instance_list[p_sid] = db_obj
+            if g_history is None:
+                fail_module("Timing history (history_file) is not defined.")
 
-        #if is_down:
-        #    self.stop_instance(p_sid)
+            g_output["history"] = g_history.get_report(self.oracle_home, self.oh_version)
 
-        #logger ("db_name: " + db_obj.name)
-        #logger ("db_version: " + db_obj.version)
-        #logger ("is_standby: " + str (db_obj.is_standby))
-        #logger ("is_rac: " + str (db_obj.is_rac))
-        #logger ("inst_list: " + db_obj.instance_list)
-        #logger ("is_active: " + str (db_obj.is_active))
+        elif g_function == "BACKUP" and self.backup_mode == "parallel":
+
+            gf_run_phase("FUNC => BACKUP", self.backup_oh_full)
+
+        elif g_function == "BACKUP":
+
+            gf_run_phase("FUNC => BACKUP", self.backup_oh)
+
+        elif g_function == "RESTORE" and self.backup_mode == "parallel":
+
+            gf_run_phase("FUNC => RESTORE", self.restore_oh_full)
+
+        elif g_function == "RESTORE":
+
+            gf_run_phase("FUNC => RESTORE", self.restore_oh)
 
     # @Description:
-    #   Function to build listener list depended on oracle home being patched
+    #   Function to build the execution plan of the role for this oracle home (discovery only)
+    #   Nothing is stopped, started or patched. The plan lists:
+    #     - listeners and instances stopped and started, in order, with their commands
+    #     - functions (PATCH_OH, PATCH_DB, ...) run by the role with their commands
+    #       With oop_home_path the PATCH_OOP steps: clone and patch the new
+    #       home (services running), then one outage to switch and patch
+    #     - databases whose dictionary is not patched, with the reason
+    #     - predicted downtime per database, from the timing history
+    #       (g_history_plan_percentile) or g_plan_default_durations
     # @Parameters:
-    #   p_oracle_home: oracle home being patched
+    #   None
     # @Return:
     #   None
     # @Exception:
     #   None
     #
-    def build_listener_list(self, p_oracle_home):
+    def plan(self):
 
-        # There might be unregistered listeners.
-        if self.is_crs:
-           logger("This is CRS configuration, opatchauto takes care.")
-           logger("Skipping BUILD_LISTENER_LIST.")
-           return
+        v_durations = dict(g_plan_default_durations)
+        v_durations_source = dict((item, "default") for item in v_durations)
 
-        global g_listener_list
+        if g_history is not None:
 
-        # the shell command
-        v_command = "ps -eo args | grep tns | grep -iw " + p_oracle_home + " | grep -v grep | cut -d' ' -f2"
+            for item in v_durations:
 
-        #Launch the shell command:
-        v_output = self.run_os_command(v_command)
+                v_stats = g_history.get_percentiles(g_plan_history_categories[item], self.oracle_home, self.oh_version)
 
-        for listener in v_output.splitlines():
-            v_listener_obj = ListenerFactory(listener.strip(), p_oracle_home)
-            g_listener_list[v_listener_obj] = v_listener_obj
+                if v_stats:
+                    v_durations[item] = v_stats["p" + str (g_history_plan_percentile)]
+                    v_durations_source[item] = v_stats["category"] + " p" + str (g_history_plan_percentile) + " (" + str (v_stats["count"]) + " samples, " + v_stats["scope"] + ")"
 
-        #logger("manage: " + str (g_listener_list))
+        gf_run_phase("PLAN => BUILD_INSTANCE_LIST", self.build_instance_list)
+        gf_run_phase("PLAN => BUILD_LISTENER_LIST", functools.partial(self.build_listener_list, self.oracle_home))
 
-    # @Description:
-    #   Function to stop an instance
-    # @Parameters:
-    #   p_db_obj: database object
-    #   p_mode: what mode to use for shutdown operation
-    #   p_asm: indicator whether it's an ASM instance
-    # @Return:
-    #   Output of shutdown operation
-    # @Exception:
-    #   None
-    #
-    def stop_instance(self, p_db_obj, p_mode = "immediate", p_asm = False):
+        v_instances = [g_instance_list[item] for item in g_instance_list if not g_instance_list[item].is_asm]
+        v_patch_db = not self.patch_only_oh and not self.is_only_oh() and not self.is_crs
+        v_patch_ojvm = bool(self.patch_ojvm and self.get_ojvm_patch_ids() and v_patch_db)
 
-        if p_asm:
+        v_plan = { "oracle_home": self.oracle_home,
+                   "version": self.oh_version,
+                   "is_crs": self.is_crs,
+                   "is_cluster": self.is_cluster,
+                   "single_downtime": self.patch_single_downtime,
+                   "stop_order": [],
+                   "start_order": [],
+                   "functions": [],
+                   "databases": {},
+                   "durations": v_durations,
+                   "durations_source": v_durations_source }
 
-            logger("Skip ASM stop as opatchauto takes care")
+        # Services, in the order of stop_services_from_oh/start_services_from_oh
+        if self.is_crs:
+            v_plan["stop_order"].append({ "group": "opatchauto", "services": ["GI stack and all instances on the node"] })
+        else:
+            v_plan["stop_order"].append({ "group": "Stop listeners", "services": [
+                { "name": item.listener_name, "command": "$ORACLE_HOME/bin/lsnrctl stop " + item.listener_name } for item in g_listener_list ] })
+            v_plan["stop_order"].append({ "group": "Stop DB instances", "services": [
+                { "name": item.sid, "command": " ".join(filter(None, self.get_instance_command(item, "stop", "immediate"))) } for item in v_instances ] })
+            v_plan["start_order"].append({ "group": "Start DB instances", "services": [
+                { "name": item.sid, "command": " ".join(filter(None, self.get_instance_command(item, "start", "mount" if item.initial_state == "MOUNTED" else "open"))) } for item in v_instances ] })
+            v_plan["start_order"].append({ "group": "Start listeners", "services": [
+                { "name": item.listener_name, "command": "$ORACLE_HOME/bin/lsnrctl start " + item.listener_name } for item in g_listener_list ] })
 
-            # if self.oh_version in g_supported_version_new:
+        # Dictionary patching
+        v_cluster_reason = None
 
-            #     v_argument_append = ""
+        if v_patch_db and self.is_cluster and g_root_password:
+            self.check_cluster_patch_db_dict()
+            if not g_patch_db_dict:
+                v_cluster_reason = "the cluster is not in NORMAL upgrade state"
 
-            #     if self.is_cluster:
-            #         v_argument_append = "-node " + p_db_obj.hostname
+        v_patched = []
 
-            #     v_command = "$ORACLE_HOME/bin/srvctl stop asm -force -stopoption " + p_mode + " " + v_argument_append
+        for v_db_obj in v_instances:
 
-            # elif self.oh_version in g_supported_version_old:
+            v_skip_reason = self.get_db_skip_reason(v_db_obj)
 
-            #     v_argument_append = ""
+            if v_skip_reason is None and not v_patch_db:
+                v_skip_reason = "only the oracle home is patched"
 
-            #     if self.is_cluster:
-            #         v_argument_append = "-n " + p_db_obj.hostname
+            if v_skip_reason is None:
+                v_skip_reason = v_cluster_reason
 
-            #     v_command = "$ORACLE_HOME/bin/srvctl stop asm -f -o " + p_mode + " " + v_argument_append
+            v_plan["databases"][v_db_obj.sid] = { "db_unique_name": v_db_obj.db_unique_name,
+                                                  "initial_state": v_db_obj.initial_state,
+                                                  "standby": v_db_obj.is_standby,
+                                                  "crs_registered": v_db_obj.crs_registered,
+                                                  "patch": v_skip_reason is None,
+                                                  "skip_reason": v_skip_reason }
+            if v_skip_reason is None:
+                v_patched.append(v_db_obj)
+
+        # Commands and duration of the dictionary patching of one database
+        v_db_commands = []
+
+        for v_db_obj in v_patched:
+            if self.oh_version in g_supported_version_old:
+                v_db_commands.append(v_db_obj.sid + ": sqlplus @?/rdbms/admin/catbundle.sql psu apply")
+            else:
+                v_db_commands.append(self.get_datapatch_command(v_db_obj))
 
+        if self.oh_version in g_supported_version_old:
+            v_db_seconds = v_durations["instance_start"] + v_durations["sqlplus_script"] + v_durations["instance_stop"]
         else:
+            v_db_seconds = v_durations["instance_start"] + v_durations["datapatch"] + v_durations["instance_stop"]
 
-            if self.oh_version in g_supported_version_new:
+        # Databases are patched one after the other (or parallel_degree at a time),
+        # all are started once the last one is patched
+        v_db_batches = -(-len(v_patched) // max(1, self.parallel_degree))
 
-                if p_db_obj.is_rac:
-                    v_command = "$ORACLE_HOME/bin/srvctl stop instance -db " + p_db_obj.db_unique_name + " -stopoption " + p_mode + " -instance " + p_db_obj.sid
-                elif p_db_obj.crs_registered:
-                    v_command = "$ORACLE_HOME/bin/srvctl stop database -db " + p_db_obj.db_unique_name + " -stopoption " + p_mode
-                else:
-                    v_command = "export ORACLE_SID=" + p_db_obj.sid + "; $ORACLE_HOME/bin/sqlplus -s / as sysdba <<< \"shutdown " + p_mode + "\""
+        v_stop_seconds = (v_durations["listener_stop"] if g_listener_list else 0) + (v_durations["instance_stop"] if v_instances else 0)
+        v_start_seconds = (v_durations["listener_start"] if g_listener_list else 0) + (v_durations["instance_start"] if v_instances else 0)
 
-            elif self.oh_version in g_supported_version_old:
+        if self.is_crs:
+            v_oh_commands = self.get_grid_oh_commands(self.get_grid_patch_dirs(), "<patch list file>")
+            v_oh_seconds = v_durations["opatchauto"] * len(v_oh_commands)
+            v_stop_seconds = 0
+            v_start_seconds = 0
+        else:
+            v_oh_commands = [self.get_opatch_apply_command([self.get_db_oh_patch_dir(self.patch_list[item]) for item in self.patch_list], "<patch list file>")]
+            v_oh_seconds = v_durations["opatch_apply"]
 
-                if p_db_obj.is_rac:
-                    v_command = "$ORACLE_HOME/bin/srvctl stop instance -d " + p_db_obj.db_unique_name + " -o " + p_mode + " -i " + p_db_obj.sid
-                elif p_db_obj.crs_registered:
-                    v_command = "$ORACLE_HOME/bin/srvctl stop database -d " + p_db_obj.db_unique_name + " -o " + p_mode
-                else:
-                    v_command = "export ORACLE_SID=" + p_db_obj.sid + "; $ORACLE_HOME/bin/sqlplus -s / as sysdba <<< \"shutdown " + p_mode + "\""
+        v_ojvm_commands = []
+        if v_patch_ojvm:
+            v_ojvm_commands = [self.get_opatch_apply_command(self.get_ojvm_patch_dirs(), "<patch list file>")]
 
-            logger("Stop instance: " + p_db_obj.sid)
+        # PATCH_OH, PATCH_OH_OJVM and PATCH_ALL do nothing if the patches are already applied
+        v_plan["missing_patches"] = self.get_missing_patches(self.get_oh_patch_ids())
+        v_plan["missing_ojvm_patches"] = self.get_missing_patches(self.get_ojvm_patch_ids()) if v_patch_ojvm else []
 
-            return self.run_os_command(v_command)
+        # Functions run by the role, each with its stop/start window (seconds)
+        # (function, commands, seconds, instances down)
+        v_functions = []
 
-    # @Description:
-    #   Function to stop a listener
-    # @Parameters:
-    #   p_listener: listener to be stopped
-    # @Return:
-    #   Output of listener stop operation
-    # @Exception:
-    #   None
-    #
-    def stop_listener(self, p_listener):
+        if self.oop_home_path:
 
-        v_command = "$ORACLE_HOME/bin/lsnrctl stop " + p_listener
+            v_old_home = self.oracle_home
+            v_new_home = os.path.normpath(self.oop_home_path)
 
-        logger("Stopping listener: " + p_listener)
+            v_plan["out_of_place"] = { "old_home": v_old_home, "new_home": v_new_home }
 
-        return self.run_os_command(v_command)
+            if self.is_crs or self.is_cluster:
+                v_plan["out_of_place"]["error"] = "Out-of-place patching is supported only for single instance DB homes."
+            else:
+                # OPatch commands run against the clone (see patchprocess_out_of_place)
+                self.oracle_home = v_new_home
+                try:
+                    v_oop_oh_commands = [self.get_opatch_apply_command([self.get_db_oh_patch_dir(self.patch_list[item]) for item in self.patch_list], "<patch list file>")]
+                    v_oop_ojvm_commands = [self.get_opatch_apply_command(self.get_ojvm_patch_dirs(), "<patch list file>")] if v_patch_ojvm else []
+                finally:
+                    self.oracle_home = v_old_home
 
-    # @Description:
-    #   Function to start an instance
-    # @Parameters:
-    #   p_db_obj: database object
-    #   p_mode: mode used for startup operation
-    #   p_asm: indicator whether the instance is an ASM instance
-    # @Return:
-    #   Output of startup operation
-    # @Exception:
-    #   None
-    #
-    def start_instance(self, p_db_obj, p_mode = "open", p_asm = False):
+                v_functions.append(("PATCH_OOP => CLONE_OH", [ "cp -RP --preserve=mode,timestamps,links --reflink=auto " + v_old_home + " " + v_new_home,
+                                                               v_new_home + "/clone/bin/clone.pl ORACLE_HOME=" + v_new_home,
+                                                               v_new_home + "/root.sh -silent" ], v_durations["clone_oh"], []))
+                v_functions.append(("PATCH_OOP => PATCH_OH", v_oop_oh_commands, v_oh_seconds, []))
 
-        if p_asm:
+                if v_patch_ojvm:
+                    v_functions.append(("PATCH_OOP => PATCH_OH_OJVM", v_oop_ojvm_commands, v_durations["opatch_apply_ojvm"], []))
 
-            logger("Skip ASM start as opatchauto takes care")
-            # v_argument_append = ""
+                # One outage: stop from the old home, switch, patch dictionaries, start from the new home
+                v_commands = [ "oratab: " + v_old_home + " -> " + v_new_home,
+                               "$ORACLE_HOME/bin/srvctl modify database/listener (CRS resources of " + v_old_home + ") -oraclehome " + v_new_home ]
+                v_seconds = v_stop_seconds + v_durations["switch_oh"] + v_start_seconds
 
-            # if self.is_cluster:
+                if v_patched:
+                    v_commands += v_db_commands
+                    v_seconds += v_db_batches * v_db_seconds
 
-            #     if self.oh_version in g_supported_version_new:
+                v_functions.append(("PATCH_OOP => SWITCH_OH", v_commands, v_seconds, v_instances))
 
-            #         v_argument_append = "-node " + p_db_obj.hostname
+        elif self.patch_single_downtime:
 
-            #     elif self.oh_version in g_supported_version_old:
+            # With all binaries applied PATCH_ALL patches only the dictionaries
+            v_commands = []
+            v_seconds = 0
 
-            #         v_argument_append = "-n " + p_db_obj.hostname
+            if v_plan["missing_patches"] or v_plan["missing_ojvm_patches"]:
+                v_commands = v_oh_commands + v_ojvm_commands
+                v_seconds = v_oh_seconds + (v_durations["opatch_apply_ojvm"] if v_patch_ojvm else 0)
 
-            # v_command = "$ORACLE_HOME/bin/srvctl start asm " + v_argument_append
+            if v_patched:
+                v_commands += v_db_commands
+                v_seconds += v_db_batches * v_db_seconds
+                if v_patch_ojvm and self.oh_version in g_supported_version_old:
+                    v_seconds += v_db_batches * (v_durations["instance_start"] + v_durations["sqlplus_script"] + v_durations["instance_stop"])
+
+            if v_commands or (v_patch_db and v_cluster_reason is None):
+                v_functions.append(("PATCH_ALL", v_commands, v_stop_seconds + v_seconds + v_start_seconds, v_instances))
 
         else:
 
-            if self.oh_version in g_supported_version_new:
+            if v_plan["missing_patches"]:
+                v_functions.append(("PATCH_OH", v_oh_commands, v_stop_seconds + v_oh_seconds + v_start_seconds, v_instances))
 
-                if p_db_obj.is_rac and p_mode != "upgrade":
-                    v_command = "$ORACLE_HOME/bin/srvctl start instance -db " + p_db_obj.db_unique_name + " -instance " + p_db_obj.sid
-                elif p_db_obj.crs_registered and p_mode != "upgrade":
-                    v_command = "$ORACLE_HOME/bin/srvctl start database -db " + p_db_obj.db_unique_name
-                else:
-                    v_command = "export ORACLE_SID=" + p_db_obj.sid + "; $ORACLE_HOME/bin/sqlplus -s / as sysdba <<< \"startup " + p_mode + "\""
+            # Listeners are not stopped by PATCH_DB and PATCH_DB_OJVM
+            v_db_window = v_durations["instance_stop"] + v_db_batches * v_db_seconds + v_durations["instance_start"]
 
-            elif self.oh_version in g_supported_version_old:
+            if v_patched:
+                v_functions.append(("PATCH_DB", v_db_commands, v_db_window, v_patched))
 
-                if p_db_obj.is_rac and p_mode != "upgrade":
-                    v_command = "$ORACLE_HOME/bin/srvctl start instance -d " + p_db_obj.db_unique_name + " -i " + p_db_obj.sid
-                elif p_db_obj.crs_registered and p_mode != "upgrade":
-                    v_command = "$ORACLE_HOME/bin/srvctl start database -d " + p_db_obj.db_unique_name
-                else:
-                    v_command = "export ORACLE_SID=" + p_db_obj.sid + "; $ORACLE_HOME/bin/sqlplus -s / as sysdba <<< \"startup " + p_mode + "\""
+            if v_patch_ojvm:
+                if v_plan["missing_ojvm_patches"]:
+                    v_functions.append(("PATCH_OH_OJVM", v_ojvm_commands, v_stop_seconds + v_durations["opatch_apply_ojvm"] + v_start_seconds, v_instances))
 
-            logger("Starting instance: " + p_db_obj.sid)
+                if v_patched:
+                    v_functions.append(("PATCH_DB_OJVM", v_db_commands, v_db_window, v_patched))
 
-            return self.run_os_command(v_command)
+        v_downtime = dict((item.sid, 0) for item in v_instances)
+
+        for v_function, v_commands, v_seconds, v_down in v_functions:
+
+            v_plan["functions"].append({ "function": v_function, "commands": v_commands,
+                                         "seconds": v_seconds, "instances_down": [item.sid for item in v_down] })
+
+            for item in v_down:
+                v_downtime[item.sid] += v_seconds
+
+        for v_sid in v_downtime:
+            v_plan["databases"][v_sid]["predicted_downtime"] = v_downtime[v_sid]
+
+        v_plan["predicted_seconds"] = sum(item[2] for item in v_functions)
+
+        for v_sid in v_plan["databases"]:
+            v_db = v_plan["databases"][v_sid]
+            logger("Plan: " + v_sid + " (" + str (v_db["db_unique_name"]) + ") predicted downtime " + str (round(v_db["predicted_downtime"])) + " seconds" +
+                   ("" if v_db["patch"] else ", dictionary not patched: " + v_db["skip_reason"]))
+
+        g_output["plan"] = v_plan
 
     # @Description:
-    #   Function to start listener
+    #   Function to apply OH, OJVM and DB dictionary patches with one stop/start of services
+    #   GI homes are patched with opatchauto only
+    #   If all OH and OJVM patches are already applied (rerun after a failed
+    #   datapatch), only the DB dictionaries are patched, nothing is done for
+    #   homes without databases to patch
     # @Parameters:
-    #   p_listener: listener to be started
+    #   p_patch_obj: patch object
     # @Return:
-    #   Output of startup operation
+    #   None
     # @Exception:
     #   None
     #
-    def start_listener(self, p_listener):
+    def patchprocess_all(self, p_patch_obj):
 
-        v_command = "$ORACLE_HOME/bin/lsnrctl start " + p_listener
+        v_patch_ojvm = bool(self.patch_ojvm and self.get_ojvm_patch_ids() and not self.patch_only_oh and not self.is_only_oh() and not self.is_crs)
+        v_patch_db = not self.patch_only_oh and not self.is_only_oh() and not self.is_crs
 
-        logger("Starting listener: " + p_listener)
+        # Services are not stopped if the patches are already applied and there is nothing else to do
+        v_patch_ids = self.get_oh_patch_ids() + (self.get_ojvm_patch_ids() if v_patch_ojvm else [])
+        v_oh_patched = gf_run_phase(g_function + " => CHECK_PATCH_EXISTENCE", functools.partial(self.check_patch_exist, v_patch_ids))
 
-        return self.run_os_command(v_command)
+        if v_patch_db and self.is_cluster:
+            self.check_cluster_patch_db_dict()
+            v_patch_db = g_patch_db_dict
+
+        if v_oh_patched:
+
+            if not v_patch_db:
+                logger("Skip PATCH_ALL, patches are already applied.")
+                return
+
+            logger("Patches are already applied, patch database dictionaries only.")
+
+        self.patchprocess_pre_patch()
+
+        if not v_oh_patched:
+
+            gf_run_phase("FUNC => PATCH_OH", self.patch_oh)
+
+            if v_patch_ojvm:
+                gf_run_phase("FUNC => PATCH_OH_OJVM", self.patch_oh_ojvm)
+
+        if v_patch_db:
+
+            if self.oh_version in g_supported_version_old:
+
+                gf_run_phase("FUNC => PATCH_DB", self.patch_db)
+
+                if v_patch_ojvm:
+                    gf_run_phase("FUNC => PATCH_DB_OJVM", functools.partial(self.patch_db, p_ojvm = True))
+
+            else:
+
+                # datapatch applies RU and OJVM SQL changes with one run
+                # Database is started in upgrade mode if OJVM was applied
+                gf_run_phase("FUNC => PATCH_DB", functools.partial(self.patch_db, p_ojvm = v_patch_ojvm))
+
+        self.patchprocess_post_patch()
 
     # @Description:
-    #   Function to start listener
+    #   Function to patch a DB oracle home out-of-place
+    #   The home is cloned and the clone is patched while services keep running
+    #   Services are stopped only to switch oratab, CRS and listeners to the new home,
+    #   to patch DB dictionary and to start services from the new home
     # @Parameters:
-    #   p_listener: listener to be started
+    #   None
     # @Return:
-    #   Output of startup operation
-    # @Exception:
     #   None
+    # @Exception:
+    #   Module failure if the home is a GI or cluster home
     #
-    def check_running_services_from_oh(self):
-
-        if self.is_crs:
-            logger("This is CRS configuration, opatchauto takes care.")
-            logger("Skip CHECK_RUNNING_SERVICES_FROM_OH.")
-            return
-
-        global g_instance_list
+    def patchprocess_out_of_place(self):
 
-        v_fail = False
-
-        if not self.is_crs:
-            # Check running processes from OH
-            v_command = "ps -ef | grep -iw " + self.oracle_home + " | grep -v grep | wc -l"
-            #Launch the shell command:
-            v_output = self.run_os_command(v_command)
+        if self.is_crs or self.is_cluster:
+            fail_module("Out-of-place patching is supported only for single instance DB homes.")
 
-            v_output = int(v_output)
+        if not self.oop_home_path:
+            fail_module("New oracle home path (oop_home_path) is not defined.")
 
-            if v_output > 0:
+        v_old_home = self.oracle_home
+        v_new_home = os.path.normpath(self.oop_home_path)
 
-                v_fail = True
+        v_patch_ojvm = bool(self.patch_ojvm and self.get_ojvm_patch_ids() and not self.patch_only_oh and not self.is_only_oh())
+        v_patch_db = not self.patch_only_oh and not self.is_only_oh()
 
-        for item in g_instance_list:
+        v_home_name = gf_run_phase("FUNC => CLONE_OH", functools.partial(self.clone_oh, v_new_home))
 
-            v_db_obj = g_instance_list[item]
+        g_output["out_of_place"] = { "old_home": v_old_home, "new_home": v_new_home, "new_home_name": v_home_name, "switched": False }
 
-            if v_db_obj.initial_state != "DOWN":
+        # Patch the new home, services are still running from the old home
+        self.oracle_home = v_new_home
 
-                v_inst_argument = "ora_pmon"
+        gf_run_phase("FUNC => PATCH_OH", self.patch_oh)
 
-                if v_db_obj.is_asm:
-                    v_inst_argument = "asm_pmon"
+        if v_patch_ojvm:
+            gf_run_phase("FUNC => PATCH_OH_OJVM", self.patch_oh_ojvm)
 
-                v_command = "ps -ef | grep -iw " + v_inst_argument + "_" + v_db_obj.sid + " | grep -v grep | wc -l"
+        # Outage starts: stop services from the old home
+        self.oracle_home = v_old_home
+        self.set_env(v_old_home)
 
-                #Launch the shell command:
-                v_output = self.run_os_command(v_command)
+        self.patchprocess_pre_patch()
 
-                v_output = int(v_output)
+        gf_run_phase("FUNC => SWITCH_OH", functools.partial(self.switch_oh, v_old_home, v_new_home))
 
-                if v_output > 0:
+        if v_patch_db:
+            gf_run_phase("FUNC => PATCH_DB", functools.partial(self.patch_db, p_ojvm = v_patch_ojvm))
 
-                    v_fail = True
+        self.patchprocess_post_patch()
 
-        #if not found_home_oratab:
-            #module.fail_json(rc=256, msg="Oracle home " + self.oracle_home+" was not found in " + g_file_oratab)
-        #    p_message = "Oracle home " + self.oracle_home+" was not found in " + g_file_oratab
-        #    fail_module(p_message)
-        if v_fail:
-            #module.fail_json(rc=256, msg="There are active services under " + self.oracle_home)
-            p_message = "There are running processes under " + self.oracle_home
+    # @Description:
+    #   Function to clone the oracle home to a new path
+    #   Files are copied with reflinks where the filesystem supports them
+    #   The copy is registered in the inventory with clone.pl and root.sh is run
+    # @Parameters:
+    #   p_new_home: new oracle home path
+    # @Return:
+    #   Oracle home name of the new home
+    # @Exception:
+    #   Module failure if the new home path is not empty or the clone is not registered
+    #
+    def clone_oh(self, p_new_home):
 
-            fail_module(p_message)
+        global g_expected_list
 
-    def check_patch_exist(self):
+        if os.path.exists(p_new_home):
 
-        global g_patch_applied
-        logger("Checking if patch " + str (self.patch_id) + " is already applied.")
-        v_command = self.oracle_home + "/OPatch/opatch lspatches -id " + str (self.patch_id)
-        v_output = self.run_os_command(v_command)
+            if os.listdir(p_new_home):
+                fail_module("New oracle home " + p_new_home + " already exists and it is not empty.")
 
-        if re.search(g_sw_opatch_check_patch_nonexist,v_output) is not None:
-            logger("Patch " + self.patch_id + " is not installed.")
-            # Patch is not installed
-        if re.search(g_sw_opatch_check_patch_exist,v_output) is not None:
-            g_patch_applied = True
-            logger("Patch " + self.patch_id + " is already installed.")
-        else:
-            fail_module("Unknown error for patch existence check.")
+            os.rmdir(p_new_home)
 
+        logger("Clone oracle home " + self.oracle_home + " to " + p_new_home)
 
-    def check_cluster_patch_db_dict(self):
+        # Ownership of root owned files is restored by root.sh
+        v_command = "cp -RP --preserve=mode,timestamps,links --reflink=auto " + self.oracle_home + " " + p_new_home
+        self.run_os_command(v_command)
 
-        global g_patch_db_dict
-        global g_check_cluster_state
+        self.set_env(self.oracle_home)
+        v_oracle_base = self.run_os_command("$ORACLE_HOME/bin/orabase", p_full_output = True).strip()
 
-        g_patch_db_dict = True
+        v_home_name = "OraDB" + str (self.oh_version) + "Home_" + gf_gettime().replace("-", "")
 
-        logger("Checking if cluster is in NORMAL upgrade state.")
-        v_command = "if [ -f /etc/oracle/olr.loc ]; then cat /etc/oracle/olr.loc | grep 'crs_home=' | awk '{split($0,list,\"=\"); print list[2]}'; fi"
-        v_gi_home= self.run_os_command(v_command)
+        self.set_env(p_new_home)
+        v_command = ("$ORACLE_HOME/perl/bin/perl $ORACLE_HOME/clone/bin/clone.pl ORACLE_HOME=" + p_new_home
+                     + " ORACLE_HOME_NAME=" + v_home_name + " ORACLE_BASE=" + v_oracle_base + " 2>&1")
+        self.run_os_command(v_command)
 
-        logger("CRS_HOME: " + v_gi_home)
+        if not InventoryReader(p_new_home).get_home(p_new_home):
+            fail_module("New oracle home " + p_new_home + " is not registered in the inventory. Check clone.pl output.")
 
-        if len (v_gi_home) > 0:
+        v_path = p_new_home + "/root.sh -silent"
 
-            g_patch_db_dict = False
-            v_command = "su -c \"" + v_gi_home + "/bin/crsctl query crs activeversion -f\""
+        if g_root_password:
+            v_command = "su -c \"" + v_path + "\""
             g_expected_list["Password: "] = g_root_password + "\r"
-            v_output= self.run_os_command(v_command, p_expect = True)
+            self.run_os_command(v_command, p_expect = True)
+        else:
+            self.run_os_command("sudo " + v_path)
 
-            if re.search(g_check_cluster_state,v_output):
-                g_patch_db_dict = True
-            else:
-                logger("Cluster state is: " + v_output)
-                logger("Database dictionary won't be patched.")
+        logger("Oracle home " + p_new_home + " registered as " + v_home_name)
 
-    def patchprocess_pre_patch(self):
+        return v_home_name
+
+    # @Description:
+    #   Function to switch stopped services from the old to the new oracle home
+    #   Instance files (dbs) and network configuration are copied again as they
+    #   might have changed since the home was cloned
+    #   oratab entries, CRS (Oracle Restart) registered databases (also
+    #   databases that are down) and listeners of the old home are switched
+    #   The old oratab file is saved to /tmp, the new one replaces it by rename
+    # @Parameters:
+    #   p_old_home: old oracle home path
+    #   p_new_home: new oracle home path
+    # @Return:
+    #   None
+    # @Exception:
+    #   Module failure
+    #
+    def switch_oh(self, p_old_home, p_new_home):
 
-        logger("==============================================",True)
-        logger(g_function + " => BUILD_INSTANCE_LIST",True)
-        logger("==============================================",True)
-        self.build_instance_list()
+        global g_instance_list
+        global g_listener_list
+        global g_log_home
 
-        if g_function != "PATCH_DB" and g_function != "PATCH_DB_OJVM":
-            logger("==============================================",True)
-            logger(g_function + " => BUILD_LISTENER_LIST",True)
-            logger("==============================================",True)
-            self.build_listener_list(self.oracle_home)
+        for v_dir in ("dbs", "network/admin"):
+            if os.path.isdir(p_old_home + "/" + v_dir):
+                self.run_os_command("cp -RP --preserve=mode,timestamps,links " + p_old_home + "/" + v_dir + "/. " + p_new_home + "/" + v_dir + "/")
 
-        logger("==============================================",True)
-        logger(g_function + " => STOP_SERVICES_FROM_OH",True)
-        logger("==============================================",True)
-        self.stop_services_from_oh()
+        # Switch oratab entries of the old home
+        with open(g_file_oratab, "r") as f:
+            v_lines = list(f)
 
-        if g_function != "PATCH_DB" and g_function != "PATCH_DB_OJVM":
-            logger("==============================================",True)
-            logger(g_function + " => CHECK_RUNNING_SERVICES_FROM_OH",True)
-            logger("==============================================",True)
-            self.check_running_services_from_oh()
+        v_oratab_backup = "/tmp/oratab.orapatch_" + gf_gettime()
 
+        with open(v_oratab_backup, "w") as f:
+            f.writelines(v_lines)
 
-    def patchprocess_post_patch(self):
+        logger("oratab saved to " + v_oratab_backup)
 
-        logger("==============================================",True)
-        logger(g_function + " => START_SERVICES_FROM_OH",True)
-        logger("==============================================",True)
-        self.start_services_from_oh()
+        for v_index, v_line in enumerate(v_lines):
 
+            if not v_line.startswith('#') and not v_line.startswith('\n'):
 
-    def patchprocess_main(self):
+                v_line_elements = v_line.split(':')
 
-        # Build list of patches which will be applied
-        self.build_patch_dict()
+                if len(v_line_elements) > 1 and v_line_elements[1] == p_old_home:
+                    v_line_elements[1] = p_new_home
+                    v_lines[v_index] = ":".join(v_line_elements)
+                    logger("oratab: " + v_lines[v_index].strip())
 
-        v_patch_obj = self.patch_list[self.patch_id]
+        v_oratab_dir = os.path.dirname(os.path.abspath(g_file_oratab))
 
-        if not pexpect_found:
-            fail_module("Required \"pexpect\" (RPM) library not found")
+        if os.access(v_oratab_dir, os.W_OK):
+            v_tmp_file = g_file_oratab + ".orapatch_" + str (os.getpid())
+            with open(v_tmp_file, "w") as f:
+                f.writelines(v_lines)
+                f.flush()
+                os.fsync(f.fileno())
+            shutil.copymode(g_file_oratab, v_tmp_file)
+            os.rename(v_tmp_file, g_file_oratab)
+        else:
+            # The oratab directory (/etc) is usually not writable by the home owner
+            logger("Directory " + v_oratab_dir + " is not writable, oratab is rewritten in place.")
+            with open(g_file_oratab, "r+") as f:
+                f.writelines(v_lines)
+                f.truncate()
+                f.flush()
+                os.fsync(f.fileno())
 
-        if g_function == "CHECK_OPATCH_MIN_VERSION":
+        # Switch services to the new home
+        self.set_env(p_new_home)
 
-            logger("==============================================",True)
-            logger("FUNC => CHECK_OPATCH_MIN_VERSION",True)
-            logger("==============================================",True)
-            self.check_opatch_min_version()
+        v_crs_databases, v_crs_listeners = self.get_crs_home_resources(p_old_home)
 
-        elif g_function == "CHECK_CONFLICT_AGAINST_OH":
+        for v_db_unique_name in v_crs_databases:
 
-            logger("==============================================",True)
-            logger("FUNC => CHECK_CONFLICT_AGAINST_OH",True)
-            logger("==============================================",True)
-            self.check_conflict_against_oh()
-            g_changed = False
+            if self.oh_version in g_supported_version_new:
+                v_command = "$ORACLE_HOME/bin/srvctl modify database -db " + v_db_unique_name + " -oraclehome " + p_new_home + " 2>&1"
+            else:
+                v_command = "$ORACLE_HOME/bin/srvctl modify database -d " + v_db_unique_name + " -o " + p_new_home + " 2>&1"
 
-        elif g_function == "PATCH_OH" and not self.only_prereq:
+            self.run_srvctl_modify(v_command)
 
-            #logger("==============================================",True)
-            #logger(g_function + " => CHECK_PATCH_EXISTENCE",True)
-            #logger("==============================================",True)
-            #self.check_patch_exist()
+        for v_listener_name in v_crs_listeners:
 
-            #if not g_patch_applied:
+            if self.oh_version in g_supported_version_new:
+                v_command = "$ORACLE_HOME/bin/srvctl modify listener -listener " + v_listener_name + " -oraclehome " + p_new_home + " 2>&1"
+            else:
+                v_command = "$ORACLE_HOME/bin/srvctl modify listener -l " + v_listener_name + " -o " + p_new_home + " 2>&1"
 
-            self.patchprocess_pre_patch()
+            self.run_srvctl_modify(v_command)
 
-            logger("==============================================",True)
-            logger("FUNC => PATCH_OH",True)
-            logger("==============================================",True)
-            self.patch_oh()
+        for item in g_instance_list:
+            g_instance_list[item].oracle_home = p_new_home
 
-            self.patchprocess_post_patch()
+        for item in g_listener_list:
+            item.oracle_home = p_new_home
 
-        elif g_function == "PATCH_DB" and not self.patch_only_oh and not v_patch_obj.only_oh and not self.is_crs:
+        self.oracle_home = p_new_home
+        g_log_home = p_new_home
+        g_output["out_of_place"]["switched"] = True
 
-            if self.is_cluster:
-                self.check_cluster_patch_db_dict()
-                if not g_patch_db_dict:
-                    return
+        logger("Services switched from " + p_old_home + " to " + p_new_home)
 
-            self.patchprocess_pre_patch()
+    # @Description:
+    #   Function to return CRS (Oracle Restart) registered databases and
+    #   listeners configured with given oracle home, running or not
+    # @Parameters:
+    #   p_oracle_home: oracle home path
+    # @Return:
+    #   Tuple of database unique name list and listener name list
+    # @Exception:
+    #   None
+    #
+    def get_crs_home_resources(self, p_oracle_home):
 
-            logger("==============================================",True)
-            logger("FUNC => PATCH_DB",True)
-            logger("==============================================",True)
-            self.patch_db()
+        v_oracle_home = os.path.normpath(p_oracle_home)
 
-            self.patchprocess_post_patch()
+        # Output: one database unique name per line, or an error if there is no CRS
+        v_databases = []
+        for v_line in self.run_os_command("$ORACLE_HOME/bin/srvctl config database 2>&1", p_full_output = True).splitlines():
 
-        elif g_function == "PATCH_OH_OJVM" and not self.patch_only_oh and not v_patch_obj.only_oh and not self.is_crs:
+            if not re.match(r"^[A-Za-z][\w$#.-]*$", v_line.strip()):
+                continue
 
-            if (v_patch_obj.patch_ojvm_id):
+            v_config = self.get_srvctl_config(v_line.strip())
 
-                self.patchprocess_pre_patch()
+            if v_config and os.path.normpath(v_config.get("oracle home", "")) == v_oracle_home:
+                v_databases.append(v_line.strip())
 
-                logger("==============================================",True)
-                logger("FUNC => PATCH_OH_OJVM",True)
-                logger("==============================================",True)
-                self.patch_oh_ojvm()
+        # Output: one "Name:" block per listener with its "Home:"
+        v_listeners = []
+        v_listener_name = None
+        for v_line in self.run_os_command("$ORACLE_HOME/bin/srvctl config listener 2>&1", p_full_output = True).splitlines():
 
-                self.patchprocess_post_patch()
+            v_key, v_sep, v_value = v_line.partition(":")
+            v_key = v_key.strip().lower()
 
-            else:
-                logger("Skip OJVM.")
-                logger("OJVM patch number not defined in patch metadata file.")
+            if v_sep and v_key == "name":
+                v_listener_name = v_value.strip()
+            elif v_sep and v_key == "home" and v_listener_name and os.path.normpath(v_value.strip()) == v_oracle_home:
+                v_listeners.append(v_listener_name)
 
-        elif g_function == "PATCH_DB_OJVM" and not self.patch_only_oh and not v_patch_obj.only_oh and not self.is_crs:
+        logger("CRS databases of " + p_oracle_home + ": " + ", ".join(v_databases))
+        logger("CRS listeners of " + p_oracle_home + ": " + ", ".join(v_listeners))
 
-            if (v_patch_obj.patch_ojvm_id):
-            
-                if self.is_cluster:
-                    self.check_cluster_patch_db_dict()
-                    if not g_patch_db_dict:
-                        return
+        return v_databases, v_listeners
 
-                self.patchprocess_pre_patch()
+    # @Description:
+    #   Function to run a "srvctl modify" command and check its result
+    # @Parameters:
+    #   p_command: srvctl modify command (stderr redirected to stdout)
+    # @Return:
+    #   None
+    # @Exception:
+    #   Module failure if srvctl fails
+    #
+    def run_srvctl_modify(self, p_command):
 
-                logger("==============================================",True)
-                logger("FUNC => PATCH_DB_OJVM",True)
-                logger("==============================================",True)
-                self.patch_db(p_ojvm = True)
+        v_output, v_exit_status = self.run_os_command(p_command, p_return_status = True)
 
-                self.patchprocess_post_patch()
+        if v_exit_status or re.search(r"\bPR[A-Z]{2}-\d+", v_output):
+            fail_module("Command failed (exit status " + str (v_exit_status) + "): " + p_command + "\n" + v_output)
 
-            else:
-                logger("Skip OJVM.")
-                logger("OJVM patch number not defined in patch metadata file.")
 
 def main():
 
@@ -1978,10 +6184,13 @@ def main():
         global module
         global g_function
         global g_logger_file
+        global g_json_logger_file
+        global g_log_home
         global g_root_password
         global g_file_oratab
         global g_debug
         global g_hostname
+        global g_history
 
         module = AnsibleModule(
             argument_spec = dict(
@@ -1994,11 +6203,29 @@ def main():
                 patch_db_all        = dict(required = False, type = 'bool'),
                 patch_db_list       = dict(required = False, type = 'str'),
                 patch_item          = dict(required = True,  type = 'dict'),
+                patch_items         = dict(required = False, type = 'list'),
                 function            = dict(required = True,  type = 'str'),
                 orapatch_logfile    = dict(required = True,  type = 'str'),
+                orapatch_json_logfile = dict(required = False, type = 'str'),
                 root_password       = dict(required = True,  type = 'str'),
                 oratab_file         = dict(required = False,  type = 'str'),
                 debug               = dict(required = False, type = 'bool'),
+                prereq_batch        = dict(required = False, type = 'bool', default = False),
+                parallel_degree     = dict(required = False, type = 'int', default = 1),
+                service_parallel_degree = dict(required = False, type = 'int', default = 1),
+                crs_wait_timeout    = dict(required = False, type = 'int'),
+                crs_wait_initial_interval = dict(required = False, type = 'int'),
+                crs_wait_max_interval = dict(required = False, type = 'int'),
+                asm_client_crosscheck = dict(required = False, type = 'bool', default = False),
+                oop_home_path       = dict(required = False, type = 'path'),
+                stage_cache_dir     = dict(required = False, type = 'path'),
+                stage_cache_max_size_gb = dict(required = False, type = 'float'),
+                backup_loc          = dict(required = False, type = 'path'),
+                backup_mode         = dict(required = False, type = 'str', choices = ['full', 'incremental', 'parallel']),
+                backup_parallel_degree = dict(required = False, type = 'int'),
+                restore_files       = dict(required = False, type = 'list'),
+                patch_single_downtime = dict(required = False, type = 'bool', default = False),
+                history_file        = dict(required = False, type = 'path'),
                 ansible_hostname    = dict(required = False, type = 'str'),
             )
         )
@@ -2014,15 +6241,44 @@ def main():
         p_patch_db_list = module.params['patch_db_list']
         p_patch_item    = module.params['patch_item']
         g_logger_file   = module.params['orapatch_logfile']
+        g_json_logger_file = module.params['orapatch_json_logfile']
+        g_log_home      = p_oracle_home
         g_function      = module.params['function'].upper()
         g_root_password = module.params['root_password']
         g_file_oratab   = module.params['oratab_file']
         g_hostname      = module.params['ansible_hostname']
+        p_prereq_batch  = module.params['prereq_batch']
+        p_parallel_degree = module.params['parallel_degree']
+        p_crs_wait      = { "timeout": module.params['crs_wait_timeout'],
+                            "initial_interval": module.params['crs_wait_initial_interval'],
+                            "max_interval": module.params['crs_wait_max_interval'] }
+        p_asm_client_crosscheck = module.params['asm_client_crosscheck']
+        p_patch_items   = module.params['patch_items']
+        p_oop_home_path = module.params['oop_home_path']
+
+        p_stage_cache = None
+        if module.params['stage_cache_dir']:
+            v_max_size = None
+            if module.params['stage_cache_max_size_gb']:
+                v_max_size = int(module.params['stage_cache_max_size_gb'] * 1024 * 1024 * 1024)
+
+            # BACKUP runs as backup_user, it reads the cache of the oracle home owner
+            v_owner_uid = None
+            if g_function == "BACKUP" and os.path.isdir(p_oracle_home):
+                v_owner_uid = os.stat(p_oracle_home).st_uid
+
+            p_stage_cache = StageCache(module.params['stage_cache_dir'], v_max_size, v_owner_uid)
+
+        if module.params['history_file']:
+            g_history = TimingHistory(module.params['history_file'])
 
         if "debug" in module.params:
             g_debug = module.params['debug']
 
-        if g_function != "START_LOGGER_SESSION" and g_function != "END_LOGGER_SESSION":
+        atexit.register(gf_close_logger)
+        atexit.register(gf_close_sqlplus_pool)
+
+        if g_function != "START_LOGGER_SESSION" and g_function != "END_LOGGER_SESSION" and g_function != "CLUSTER_INFO":
 
             if g_debug:
                 logger("Debug is enabled for: [" + str (p_oracle_home) + "].")
@@ -2042,17 +6298,28 @@ def main():
 
             gf_end_logger_session()
 
+        elif g_function == "CLUSTER_INFO":
+
+            g_output.update(gf_get_cluster_info())
+
         else:
 
             patchprocess = PatchProcess(p_oracle_home, p_only_prereq
                                         ,p_patch_id, p_sw_stage
                                         ,p_patch_only_oh, p_patch_ojvm
                                         ,p_patch_db_all, p_patch_db_list
-                                        ,p_patch_item)
+                                        ,p_patch_item, p_prereq_batch
+                                        ,p_parallel_degree, p_crs_wait
+                                        ,p_asm_client_crosscheck, p_patch_items
+                                        ,p_oop_home_path, p_stage_cache
+                                        ,module.params['backup_loc'], module.params['backup_mode']
+                                        ,module.params['backup_parallel_degree'], module.params['restore_files']
+                                        ,module.params['patch_single_downtime'], module.params['service_parallel_degree'])
 
             patchprocess.patchprocess_main()
 
-        module.exit_json(changed = g_changed, msg = "Finished.")
+        gf_finish_timings()
+        module.exit_json(changed = g_changed, msg = "Finished.", **g_output)
 
     except Exception as e:
         logger(str(e))
@@ -13,4 +13,3 @@ select ';'||
 (select status from v$instance where status in ('MOUNTED','OPEN')) ||';'||
 (select value from v$parameter where name = 'db_unique_name')  db_metadata
 from dual;
-exit